@@ -0,0 +1,90 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import shutil
+import tempfile
+import unittest
+from durable_kv import DurableKV, WALReader
+from async_durable_kv import AsyncDurableKV
+
+
+class TestAsyncDurableKV(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_writes_in_one_tick_share_a_commit(self):
+        kv = DurableKV(self.dir, n_shards=4)
+
+        async def main():
+            akv = AsyncDurableKV(kv)
+            results = await asyncio.gather(*(akv.put(f"k{i}", i) for i in range(100)),
+                                           akv.delete("k5"),
+                                           akv.write_batch([("PUT", "x", 1), ("PUT", "y", 2)]))
+            self.assertEqual(akv.commits, 1)
+            self.assertEqual(akv.ops_committed, 103)
+            self.assertEqual(len(set(results)), 1)  # all resolved with the same WAL record
+            self.assertEqual(await akv.get("k42"), 42)
+            self.assertIsNone(await akv.get("k5"))
+            await akv.close()
+
+        asyncio.run(main())
+        kv.close()
+        entries = list(WALReader(os.path.join(self.dir, "wal_1.log")))
+        self.assertEqual([e[2] for e in entries], ["BATCH"])
+        kv2 = DurableKV(self.dir, n_shards=4)
+        kv2.recover()
+        self.assertEqual((kv2.get("k99"), kv2.get("k5"), kv2.get("y")), (99, None, 2))
+        kv2.close()
+
+    def test_bad_write_fails_only_its_caller(self):
+        kv = DurableKV(self.dir, n_shards=4)
+
+        async def main():
+            akv = AsyncDurableKV(kv)
+            results = await asyncio.gather(akv.put("good", 1), akv.put("bad", {1, 2}),
+                                           akv.put("good2", 2), return_exceptions=True)
+            self.assertIsInstance(results[1], TypeError)
+            self.assertEqual(results[0], results[2])  # the others still share one record
+            self.assertEqual((await akv.get("good"), await akv.get("good2")), (1, 2))
+            # a merged commit that fails anyway is retried caller by caller
+            write_batch = kv.write_batch
+
+            def fail_merged(ops):
+                if len(ops) > 1:
+                    raise OSError("merged commit failed")
+                return write_batch(ops)
+
+            kv.write_batch = fail_merged
+            results = await asyncio.gather(akv.put("a", 1), akv.put("b", 2))
+            self.assertNotEqual(results[0], results[1])
+            self.assertEqual((await akv.get("a"), await akv.get("b")), (1, 2))
+            self.assertEqual(akv.ops_committed, 4)
+            await akv.close()
+
+        asyncio.run(main())
+        kv.close()
+
+    def test_partitioned_and_lsm_reads(self):
+        kv = DurableKV(self.dir, n_shards=4, partitioned=True, engine="lsm")
+
+        async def main():
+            akv = AsyncDurableKV(kv)
+            await asyncio.gather(*(akv.put(f"k{i}", i) for i in range(50)))
+            self.assertEqual(akv.commits, 4)  # one per partition
+            with self.assertRaises(ValueError):
+                await akv.write_batch([("PUT", f"k{i}", i) for i in range(10)])
+            await asyncio.get_running_loop().run_in_executor(None, kv.snapshot)
+            self.assertEqual(kv.peek("k7"), (False, None))  # flushed: needs a segment read
+            self.assertEqual(await akv.get("k7"), 7)
+            await akv.close()
+
+        asyncio.run(main())
+        kv.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
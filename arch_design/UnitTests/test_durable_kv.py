@@ -0,0 +1,991 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import json
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from durable_kv import (DurableKV, WALManager, WALReader, SnapshotReader, stable_hash,
+                        WriterPreferringRWLock, BlockCache)
+
+
+class TestGroupCommit(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_concurrent_puts_are_ordered_and_recovered(self):
+        kv = DurableKV(self.dir, n_shards=4, group_commit=True, max_batch=32, max_linger=0.001)
+        results = []
+        lock = threading.Lock()
+
+        def writer(t):
+            for i in range(50):
+                r = kv.put(f"t{t}-k{i}", i)
+                with lock:
+                    results.append(r)
+
+        threads = [threading.Thread(target=writer, args=(t,)) for t in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        kv.close()
+
+        # entry ids are unique and appear in the file in increasing order
+        self.assertEqual(len(set(results)), 400)
+        with open(os.path.join(self.dir, "wal_1.log")) as f:
+            ids = [json.loads(line)["entry_id"] for line in f]
+        self.assertEqual(ids, list(range(1, 401)))
+
+        kv2 = DurableKV(self.dir, n_shards=4)
+        kv2.recover()
+        self.assertEqual(kv2.get("t3-k49"), 49)
+        kv2.close()
+
+    def test_rotate_flushes_pending_records(self):
+        wal = WALManager(self.dir, group_commit=True, max_linger=0.05)
+        t = threading.Thread(target=wal.append, args=("PUT", "a", 1))
+        t.start()
+        while wal._next_ticket == 0:
+            time.sleep(0.001)
+        wal.rotate()
+        t.join()
+        wal.close()
+        with open(os.path.join(self.dir, "wal_1.log")) as f:
+            self.assertEqual(json.loads(f.readline())["key"], "a")
+
+
+class TestBinaryWAL(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_roundtrip_value_types(self):
+        kv = DurableKV(self.dir, n_shards=2, wal_format="binary")
+        kv.put("s", "text")
+        kv.put("b", b"\x00\x01")
+        kv.put("j", {"a": [1, 2]})
+        kv.put("n", None)
+        kv.delete("s")
+        kv.close()
+        kv2 = DurableKV(self.dir, n_shards=2)
+        kv2.recover()
+        self.assertIsNone(kv2.get("s"))
+        self.assertEqual(kv2.get("b"), b"\x00\x01")
+        self.assertEqual(kv2.get("j"), {"a": [1, 2]})
+        self.assertEqual(kv2.torn_wal_files, [])
+        kv2.close()
+
+    def test_torn_tail_is_detected(self):
+        wal = WALManager(self.dir, record_format="binary")
+        for i in range(100):
+            wal.append("PUT", f"k{i}", "v" * 50)
+        wal.close()
+        path = os.path.join(self.dir, "wal_1.log")
+        size = os.path.getsize(path)
+        with open(path, "r+b") as f:
+            f.truncate(size - 7)
+        reader = WALReader(path, block_size=256)
+        entries = list(reader)
+        self.assertEqual(len(entries), 99)
+        self.assertEqual(entries[-1][3], "k98")
+        self.assertTrue(reader.torn_tail)
+        # a flipped byte inside a record fails its CRC
+        with open(path, "r+b") as f:
+            f.seek(size // 2)
+            b = f.read(1)
+            f.seek(size // 2)
+            f.write(bytes([b[0] ^ 0xFF]))
+        reader = WALReader(path)
+        self.assertLess(len(list(reader)), 99)
+        self.assertTrue(reader.torn_tail)
+
+    def test_json_torn_tail(self):
+        wal = WALManager(self.dir)
+        wal.append("PUT", "a", 1)
+        wal.close()
+        with open(os.path.join(self.dir, "wal_1.log"), "ab") as f:
+            f.write(b'{"wal_seq": 1, "entry')
+        reader = WALReader(os.path.join(self.dir, "wal_1.log"))
+        self.assertEqual([e[3] for e in reader], ["a"])
+        self.assertTrue(reader.torn_tail)
+
+
+class TestBackgroundSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_snapshot_is_point_in_time(self):
+        kv = DurableKV(self.dir, n_shards=4)
+        for i in range(100):
+            kv.put(f"k{i}", i)
+        fut = kv.snapshot(background=True)
+        # writes after the freeze go to fresh copies, not into the snapshot
+        for i in range(100):
+            kv.put(f"k{i}", -i)
+        kv.put("late", 1)
+        path = fut.result(timeout=10)
+        with open(path) as f:
+            data = json.load(f)["data"]
+        self.assertEqual(data["k7"], 7)
+        self.assertNotIn("late", data)
+        self.assertEqual(kv.get("k7"), -7)
+        kv.close()
+
+        kv2 = DurableKV(self.dir, n_shards=4)
+        kv2.recover()
+        self.assertEqual(kv2.get("k7"), -7)
+        self.assertEqual(kv2.get("late"), 1)
+        kv2.close()
+
+
+class TestChunkedSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_chunked_snapshot_roundtrip(self):
+        kv = DurableKV(self.dir, n_shards=4, snapshot_format="chunked", snapshot_chunk_bytes=256)
+        for i in range(200):
+            kv.put(f"k{i}", {"i": i} if i % 2 else f"v{i}")
+        path = kv.snapshot()
+        kv.put("after", True)
+        kv.close()
+
+        reader = SnapshotReader(path)
+        self.assertGreater(len(reader._chunks), 1)
+        self.assertEqual(sum(1 for _ in reader), 200)
+
+        kv2 = DurableKV(self.dir, n_shards=4)
+        self.assertEqual(kv2.recover(), reader.meta["snapshot_seq"])
+        self.assertEqual(kv2.get("k3"), {"i": 3})
+        self.assertEqual(kv2.get("k4"), "v4")
+        self.assertTrue(kv2.get("after"))
+        kv2.close()
+
+
+class TestParallelRecovery(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_parallel_matches_sequential(self):
+        kv = DurableKV(self.dir, n_shards=4, wal_format="binary")
+        for round_ in range(3):
+            for i in range(100):
+                kv.put(f"k{i % 37}", round_ * 1000 + i)
+                if i % 11 == 0:
+                    kv.delete(f"k{(i * 7) % 37}")
+            kv.wal.rotate()
+        kv.close()
+
+        seq = DurableKV(self.dir, n_shards=4)
+        seq.recover()
+        expected = {k: v for shard in seq.shards for k, v in shard.items()}
+        seq.close()
+        for executor in ("thread", "process"):
+            par = DurableKV(self.dir, n_shards=4)
+            par.recover(parallel=True, workers=2, executor=executor)
+            got = {k: v for shard in par.shards for k, v in shard.items()}
+            self.assertEqual(got, expected)
+            stats = par.last_recovery_stats
+            self.assertEqual(stats["wal_entries"], 300 + 30)
+            self.assertIsNotNone(stats["apply_s"])
+            par.close()
+
+
+class TestPartitionedLayout(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_stable_hash_is_deterministic(self):
+        self.assertEqual(stable_hash("user:1"), stable_hash(b"user:1"))
+        self.assertEqual(stable_hash("user:1"), 0x7BA5C282)
+
+    def test_per_shard_files_and_recovery(self):
+        kv = DurableKV(self.dir, n_shards=4, partitioned=True, snapshot_format="chunked")
+        for i in range(40):
+            kv.put(f"k{i}", i)
+        paths = kv.snapshot()
+        self.assertEqual(len(paths), 4)
+        kv.put("k1", "new")
+        kv.delete("k2")
+        kv.close()
+
+        idx = stable_hash("k1") % 4
+        self.assertTrue(os.path.exists(os.path.join(self.dir, f"shard_{idx:03d}", "wal_2.log")))
+
+        for parallel in (False, True):
+            kv2 = DurableKV(self.dir, n_shards=4, partitioned=True)
+            self.assertEqual(len(kv2.recover(parallel=parallel)), 4)
+            self.assertEqual(kv2.get("k1"), "new")
+            self.assertIsNone(kv2.get("k2"))
+            self.assertEqual(kv2.get("k39"), 39)
+            kv2.close()
+
+    def test_layout_mismatch_is_rejected(self):
+        DurableKV(self.dir, n_shards=4, partitioned=True).close()
+        with self.assertRaises(ValueError):
+            DurableKV(self.dir, n_shards=8, partitioned=True)
+        with self.assertRaises(ValueError):
+            DurableKV(self.dir, n_shards=4)
+
+
+class TestLSMEngine(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_flush_compaction_and_recovery(self):
+        kv = DurableKV(self.dir, n_shards=2, engine="lsm", memtable_bytes=2000, compaction_trigger=3)
+        for i in range(300):
+            kv.put(f"k{i:03d}", f"v{i}")
+        kv.delete("k005")
+        kv.snapshot()
+        self.assertTrue(all(len(s) == 0 for s in kv.shards))
+        self.assertGreater(sum(len(s) for s in kv._segments), 0)
+        self.assertIsNone(kv.get("k005"))
+        self.assertEqual(kv.get("k123"), "v123")
+        kv.put("k123", "newer")
+        kv.compact()
+        self.assertTrue(all(len(s) <= 1 for s in kv._segments))
+        self.assertEqual(kv.get("k123"), "newer")
+        self.assertIsNone(kv.get("k005"))
+        self.assertIsNone(kv.get("missing"))
+        kv.close()
+
+        kv2 = DurableKV(self.dir, n_shards=2, engine="lsm")
+        kv2.recover()
+        self.assertEqual(kv2.get("k123"), "newer")
+        self.assertEqual(kv2.get("k299"), "v299")
+        self.assertIsNone(kv2.get("k005"))
+        # WALs below the last flush fence were not replayed
+        self.assertLess(kv2.last_recovery_stats["wal_entries"], 100)
+        kv2.close()
+
+    def test_misses_skip_files_via_bloom_filter(self):
+        kv = DurableKV(self.dir, n_shards=1, engine="lsm", segment_block_bytes=512)
+        for i in range(2000):
+            kv.put(f"k{i:05d}", f"v{i}")
+        kv.snapshot()
+        seg = kv._segments[0][0]
+        self.assertGreater(len(seg.block_offsets), 10)
+        self.assertEqual(kv.get("k01234"), "v1234")
+        for i in range(2000):
+            self.assertIsNone(kv.get(f"k{i:05d}x"))
+        stats = kv.lookup_stats()
+        self.assertEqual(stats["lookups"], 2001)
+        self.assertLess(stats["false_positive_rate"], 0.05)
+        self.assertLess(stats["bytes_per_lookup"], 64)
+        kv.close()
+
+    def test_engine_is_recorded_in_layout(self):
+        DurableKV(self.dir, engine="lsm").close()
+        with self.assertRaises(ValueError):
+            DurableKV(self.dir)
+
+
+class TestOrderedScans(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def check_store(self, kv):
+        expected = {}
+        for u in range(20):
+            for i in range(15):
+                kv.put(f"user:{u:03d}:{i:02d}", u * 100 + i)
+                expected[f"user:{u:03d}:{i:02d}"] = u * 100 + i
+        for i in range(0, 15, 3):
+            kv.delete(f"user:007:{i:02d}")
+            del expected[f"user:007:{i:02d}"]
+        self.assertEqual(list(kv.scan()), sorted(expected.items()))
+        self.assertEqual([k for k, _ in kv.prefix("user:007:")],
+                         [f"user:007:{i:02d}" for i in range(15) if i % 3])
+        page = list(kv.scan("user:010:", None, limit=5))
+        self.assertEqual(page[0][0], "user:010:00")
+        self.assertEqual(len(page), 5)
+        self.assertEqual(list(kv.scan("user:019:14", "user:020")), [("user:019:14", 1914)])
+
+    def test_hash_engine_with_and_without_index(self):
+        for ordered in (True, False):
+            d = os.path.join(self.dir, str(ordered))
+            kv = DurableKV(d, n_shards=4, ordered_index=ordered)
+            self.check_store(kv)
+            kv.close()
+
+    def test_lsm_engine_merges_segments(self):
+        kv = DurableKV(self.dir, n_shards=3, engine="lsm", memtable_bytes=1500,
+                       segment_block_bytes=256, ordered_index=True)
+        self.check_store(kv)
+        kv.snapshot()
+        kv.put("user:007:01", "updated")
+        self.assertEqual(dict(kv.prefix("user:007:"))["user:007:01"], "updated")
+        kv.close()
+
+    def test_scan_is_lazy_under_concurrent_writes(self):
+        kv = DurableKV(self.dir, n_shards=2, ordered_index=True)
+        for i in range(300):
+            kv.put(f"k{i:04d}", i)
+        it = kv.scan()
+        first = next(it)
+        kv.delete("k0299")
+        kv.put("k9999", "late")
+        rest = list(it)
+        keys = [first[0]] + [k for k, _ in rest]
+        self.assertEqual(keys, sorted(set(keys)))
+        self.assertNotIn("k0299", keys)
+        kv.close()
+
+
+class TestWriteBatch(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_batch_is_one_record_and_recovers(self):
+        for fmt in ("json", "binary"):
+            d = os.path.join(self.dir, fmt)
+            kv = DurableKV(d, n_shards=4, wal_format=fmt)
+            kv.put("gone", 1)
+            ops = [("PUT", f"k{i}", i) for i in range(50)] + [("DEL", "gone"), ("PUT", "b", b"\x01" if fmt == "binary" else "x")]
+            kv.write_batch(ops)
+            self.assertIsNone(kv.get("gone"))
+            self.assertEqual(kv.get("k42"), 42)
+            kv.close()
+            entries = list(WALReader(os.path.join(d, "wal_1.log")))
+            self.assertEqual([e[2] for e in entries], ["PUT", "BATCH"])
+            for parallel in (False, True):
+                kv2 = DurableKV(d, n_shards=4)
+                kv2.recover(parallel=parallel)
+                self.assertEqual(kv2.get("k49"), 49)
+                self.assertIsNone(kv2.get("gone"))
+                kv2.close()
+
+    def test_torn_batch_is_dropped_whole(self):
+        kv = DurableKV(self.dir, n_shards=2, wal_format="binary")
+        kv.put("a", 1)
+        kv.write_batch([("PUT", "a", 2), ("PUT", "b", 2)])
+        kv.close()
+        path = os.path.join(self.dir, "wal_1.log")
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 3)
+        kv2 = DurableKV(self.dir, n_shards=2)
+        kv2.recover()
+        self.assertEqual((kv2.get("a"), kv2.get("b")), (1, None))
+        self.assertEqual(kv2.torn_wal_files, [path])
+        kv2.close()
+
+    def test_partitioned_batch_must_stay_in_one_shard(self):
+        kv = DurableKV(self.dir, n_shards=4, partitioned=True)
+        keys = [f"k{i}" for i in range(20)]
+        with self.assertRaises(ValueError):
+            kv.write_batch([("PUT", k, 1) for k in keys])
+        same = [k for k in keys if stable_hash(k) % 4 == stable_hash(keys[0]) % 4]
+        kv.write_batch([("PUT", k, 1) for k in same])
+        self.assertEqual(kv.get(same[-1]), 1)
+        kv.close()
+
+
+class TestDurabilityModes(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_interval_flusher_drains_lag(self):
+        wal = WALManager(self.dir, durability="interval", sync_interval_ms=20)
+        wal.append("PUT", "a", 1)
+        lag = wal.durability_lag()
+        self.assertEqual(lag["unsynced_records"], 1)
+        self.assertGreater(lag["unsynced_bytes"], 0)
+        deadline = time.monotonic() + 2
+        while wal.durability_lag()["unsynced_records"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(wal.durability_lag(), {"unsynced_bytes": 0, "unsynced_records": 0,
+                                                "lag_seconds": 0.0})
+        wal.close()
+
+    def test_bytes_threshold_and_per_write_override(self):
+        for group in (False, True):
+            d = os.path.join(self.dir, str(group))
+            wal = WALManager(d, group_commit=group, durability="bytes", sync_bytes=1 << 30)
+            wal.append("PUT", "a", 1)
+            self.assertEqual(wal.durability_lag()["unsynced_records"], 1)
+            wal.append("PUT", "b", 2, durability="always")
+            self.assertEqual(wal.durability_lag()["unsynced_records"], 0)
+            wal.sync_bytes = 1
+            wal.append("PUT", "c", 3)
+            self.assertEqual(wal.durability_lag()["unsynced_bytes"], 0)
+            wal.close()
+        with self.assertRaises(ValueError):
+            WALManager(self.dir, durability="never")
+
+    def test_preallocated_wal_recovers_and_is_trimmed(self):
+        for fmt in ("json", "binary"):
+            d = os.path.join(self.dir, fmt)
+            kv = DurableKV(d, n_shards=2, wal_format=fmt, durability="fdatasync",
+                           preallocate_bytes=1 << 16)
+            for i in range(20):
+                kv.put(f"k{i}", i)
+            path = os.path.join(d, "wal_1.log")
+            self.assertGreaterEqual(os.path.getsize(path), 1 << 16)
+            # a crash leaves the zero-filled tail behind: it reads as a clean end of log
+            reader = WALReader(path)
+            self.assertEqual(len(list(reader)), 20)
+            self.assertFalse(reader.torn_tail)
+            kv.close()
+            self.assertEqual(os.path.getsize(path), reader.valid_bytes)
+            kv2 = DurableKV(d, n_shards=2)
+            kv2.recover()
+            self.assertEqual(kv2.get("k19"), 19)
+            self.assertEqual(kv2.torn_wal_files, [])
+            kv2.close()
+
+
+class TestWALRetention(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _files(self, prefix):
+        return sorted(f for f in os.listdir(self.dir) if f.startswith(prefix))
+
+    def test_size_based_rotation_preallocates_and_recovers(self):
+        kv = DurableKV(self.dir, n_shards=2, wal_format="binary", wal_segment_bytes=4096)
+        for i in range(500):
+            kv.put(f"k{i}", "x" * 20)
+        seqs = kv.wal.list_wal_seqs()
+        self.assertGreater(len(seqs), 2)
+        # the open segment is preallocated, closed ones are trimmed to their data
+        self.assertGreaterEqual(os.path.getsize(os.path.join(self.dir, f"wal_{seqs[-1]}.log")), 4096)
+        self.assertLess(os.path.getsize(os.path.join(self.dir, f"wal_{seqs[0]}.log")), 4096 + 64)
+        kv.close()
+        kv2 = DurableKV(self.dir, n_shards=2)
+        kv2.recover()
+        self.assertEqual(sum(len(s) for s in kv2.shards), 500)
+        self.assertEqual(kv2.last_recovery_stats["wal_entries"], 500)
+        kv2.close()
+
+    def test_snapshot_retires_covered_wals_and_snapshots(self):
+        kv = DurableKV(self.dir, n_shards=2, wal_segment_bytes=2048)
+        for round_ in range(3):
+            for i in range(100):
+                kv.put(f"k{i}", round_)
+            seq = int(os.path.basename(kv.snapshot()).split("_")[1].split(".")[0])
+        kv.close()  # waits for the background retirement
+        self.assertEqual(self._files("snapshot_"), [f"snapshot_{seq}.snap"])
+        self.assertTrue(all(s >= seq for s in kv.wal.list_wal_seqs()))
+        kv2 = DurableKV(self.dir, n_shards=2)
+        kv2.recover()
+        self.assertEqual(kv2.get("k7"), 2)
+        kv2.close()
+
+    def test_snapshot_fence_covers_writes_logged_before_a_rotation(self):
+        for engine in ("hash", "lsm"):
+            d = os.path.join(self.dir, engine)
+            kv = DurableKV(d, n_shards=2, engine=engine, wal_segment_bytes=1024)
+            wal = kv.wal
+            append = wal.append
+            logged, resume = threading.Event(), threading.Event()
+
+            def slow_append(op, key, value, durability=None):
+                result = append(op, key, value, durability)
+                if key == "x":  # logged, but not applied until resumed
+                    logged.set()
+                    resume.wait()
+                return result
+
+            wal.append = slow_append
+            t = threading.Thread(target=kv.put, args=("x", 1))
+            t.start()
+            self.assertTrue(logged.wait(5))
+            for i in range(100):  # rotate past the segment holding x
+                kv.put(f"k{i}", "v" * 20)
+            self.assertGreater(wal.current_seq, 2)
+            kv.snapshot()
+            resume.set()
+            t.join()
+            self.assertEqual(kv.get("x"), 1)
+            kv.close()
+            kv2 = DurableKV(d, n_shards=2, engine=engine)
+            kv2.recover()
+            self.assertEqual((kv2.get("x"), kv2.get("k99")), (1, "v" * 20))
+            kv2.close()
+
+    def test_lsm_flush_retires_wals_below_fence(self):
+        kv = DurableKV(self.dir, n_shards=2, engine="lsm", wal_segment_bytes=2048)
+        for i in range(200):
+            kv.put(f"k{i}", i)
+        kv.snapshot()
+        kv.close()
+        with open(os.path.join(self.dir, "MANIFEST.json")) as f:
+            fence = json.load(f)["wal_fence"]
+        self.assertGreater(fence, 1)
+        self.assertEqual(min(kv.wal.list_wal_seqs()), fence)
+
+    def test_retire_wals_off_keeps_everything(self):
+        kv = DurableKV(self.dir, n_shards=2, retire_wals=False)
+        kv.put("a", 1)
+        kv.snapshot()
+        kv.put("a", 2)
+        kv.snapshot()
+        kv.close()
+        self.assertEqual(len(self._files("snapshot_")), 2)
+        self.assertEqual(kv.wal.list_wal_seqs(), [1, 2, 3])
+
+
+class TestWriterPreferringLock(unittest.TestCase):
+    def _start(self, fn):
+        t = threading.Thread(target=fn, daemon=True)
+        t.start()
+        return t
+
+    def _wait_depth(self, lock, depth):
+        deadline = time.monotonic() + 2
+        while lock.stats()["queue_depth"] < depth and time.monotonic() < deadline:
+            time.sleep(0.001)
+        self.assertEqual(lock.stats()["queue_depth"], depth)
+
+    def test_waiting_writer_blocks_new_readers(self):
+        for fair in (False, True):
+            lock = WriterPreferringRWLock(fair=fair)
+            order = []
+            lock.acquire_read()
+
+            def writer():
+                lock.acquire_write()
+                order.append("w")
+                lock.release_write()
+
+            def reader():
+                lock.acquire_read()
+                order.append("r")
+                lock.release_read()
+
+            tw = self._start(writer)
+            self._wait_depth(lock, 1)
+            tr = self._start(reader)
+            self._wait_depth(lock, 2)
+            self.assertEqual(order, [])
+            lock.release_read()
+            tw.join(2)
+            tr.join(2)
+            self.assertEqual(order, ["w", "r"])
+            stats = lock.stats()
+            self.assertEqual((stats["acquires"], stats["contended"]), (3, 2))
+            self.assertEqual(stats["max_queue_depth"], 2)
+            self.assertGreater(stats["wait_s"], 0)
+
+    def test_fair_mode_grants_in_arrival_order(self):
+        lock = WriterPreferringRWLock(fair=True)
+        order = []
+        lock.acquire_write()
+
+        def take(name, write):
+            def run():
+                (lock.acquire_write if write else lock.acquire_read)()
+                order.append(name)
+                time.sleep(0.01)
+                (lock.release_write if write else lock.release_read)()
+            return run
+
+        threads = []
+        for depth, (name, write) in enumerate([("r1", False), ("w1", True), ("r2", False), ("r3", False)], 1):
+            threads.append(self._start(take(name, write)))
+            self._wait_depth(lock, depth)
+        lock.release_write()
+        for t in threads:
+            t.join(2)
+        self.assertEqual(order[:2], ["r1", "w1"])
+        self.assertEqual(sorted(order[2:]), ["r2", "r3"])
+
+    def test_store_reports_per_shard_lock_stats(self):
+        d = tempfile.mkdtemp()
+        try:
+            kv = DurableKV(d, n_shards=4, lock_policy="fair")
+            kv.put("a", 1)
+            kv.get("a")
+            stats = kv.lock_stats()
+            self.assertEqual(len(stats), 4)
+            self.assertEqual(sum(s["acquires"] for s in stats), 2)
+            kv.close()
+            kv = DurableKV(d, n_shards=4, lock_policy="reader")
+            self.assertEqual(kv.lock_stats(), [None] * 4)
+            kv.close()
+        finally:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+class TestMVCC(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.kv = DurableKV(self.dir, n_shards=4, mvcc=True)
+
+    def tearDown(self):
+        self.kv.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_view_is_pinned(self):
+        kv = self.kv
+        kv.put("a", 1)
+        kv.put("b", 1)
+        with kv.read_view() as view:
+            kv.put("a", 2)
+            kv.delete("b")
+            kv.put("c", 3)
+            self.assertEqual((view.get("a"), view.get("b"), view.get("c")), (1, 1, None))
+            self.assertEqual(list(view.scan()), [("a", 1), ("b", 1)])
+            self.assertEqual((kv.get("a"), kv.get("b"), kv.get("c")), (2, None, 3))
+        with kv.read_view() as view:
+            self.assertEqual(list(view.scan()), [("a", 2), ("c", 3)])
+
+    def test_views_never_see_partial_batches(self):
+        kv = self.kv
+        keys = [f"k{i}" for i in range(8)]  # spread over all shards
+        kv.write_batch([("PUT", k, 0) for k in keys])
+        stop = threading.Event()
+
+        def writer():
+            n = 0
+            while not stop.is_set():
+                n += 1
+                kv.write_batch([("PUT", k, n) for k in keys])
+
+        t = threading.Thread(target=writer)
+        t.start()
+        try:
+            for _ in range(300):
+                with kv.read_view() as view:
+                    self.assertEqual(len({view.get(k) for k in keys}), 1)
+        finally:
+            stop.set()
+            t.join()
+
+    def test_gc_drops_versions_once_views_close(self):
+        kv = self.kv
+        kv.put("a", 0)
+        view = kv.read_view()
+        for i in range(1, 50):
+            kv.put("a", i)
+        kv.put("gone", 1)
+        kv.delete("gone")
+        stats = kv.version_stats()
+        self.assertEqual(stats["open_views"], 1)
+        self.assertGreater(stats["versions"], 50)
+        self.assertGreater(stats["overhead_bytes_per_version"], 0)
+        self.assertEqual(view.get("a"), 0)
+        view.close()
+        kv.gc_versions()
+        stats = kv.version_stats()
+        self.assertEqual((stats["keys"], stats["versions"], stats["open_views"]), (1, 1, 0))
+        self.assertEqual(kv.get("a"), 49)
+
+    def test_gc_runs_without_any_view(self):
+        kv = self.kv
+        keys = [f"k{i}" for i in range(4000)]
+        for ops in ([("PUT", k, round_) for k in keys] for round_ in range(3)):
+            for i in range(0, len(ops), 100):
+                kv.write_batch(ops[i:i + 100])
+        for i in range(0, len(keys), 100):
+            kv.write_batch([("DEL", k) for k in keys[i:i + 100]])
+        kv.put("last", 1)
+        deadline = time.monotonic() + 5
+        while kv.version_stats()["versions"] >= 1000 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        stats = kv.version_stats()
+        self.assertLess(stats["keys"], 1000)  # only what piled up since the last pass
+        self.assertLess(stats["versions"], 2 * stats["keys"] + 1)
+        self.assertEqual((kv.get("k7"), kv.get("last")), (None, 1))
+        kv.gc_versions()
+        self.assertEqual(kv.version_stats()["versions"], 1)
+
+    def test_recover_and_lsm_rejected(self):
+        self.kv.put("a", 1)
+        self.kv.close()
+        self.kv = DurableKV(self.dir, n_shards=4, mvcc=True)
+        self.kv.recover()
+        with self.kv.read_view() as view:
+            self.assertEqual(view.get("a"), 1)
+        with self.assertRaises(ValueError):
+            DurableKV(os.path.join(self.dir, "lsm"), engine="lsm", mvcc=True)
+
+
+class TestValueLog(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def _vlog_files(self):
+        return sorted(f for f in os.listdir(self.dir) if f.startswith("vlog_"))
+
+    def test_large_values_are_separated_and_recovered(self):
+        blob = b"\xab" * 20000
+        text = "t" * 20000
+        for wal_format, snapshot_format in (("json", "json"), ("binary", "chunked")):
+            shutil.rmtree(self.dir)
+            kv = DurableKV(self.dir, n_shards=4, wal_format=wal_format,
+                           snapshot_format=snapshot_format, value_log_threshold=1024)
+            if wal_format == "binary":
+                kv.put("blob", blob)
+            kv.put("text", text)
+            kv.put("small", "s")
+            kv.write_batch([("PUT", "b1", text), ("PUT", "b2", "tiny")])
+            wal_bytes = os.path.getsize(os.path.join(self.dir, "wal_1.log"))
+            self.assertLess(wal_bytes, 2000)
+            self.assertEqual((kv.get("text"), kv.get("small"), kv.get("b1")), (text, "s", text))
+            self.assertEqual(dict(kv.scan())["b1"], text)
+            kv.snapshot()
+            kv.put("after", text)
+            kv.close()
+            kv2 = DurableKV(self.dir, n_shards=4, value_log_threshold=1024)
+            kv2.recover()
+            self.assertEqual((kv2.get("text"), kv2.get("after"), kv2.get("b2")), (text, text, "tiny"))
+            if wal_format == "binary":
+                self.assertEqual(kv2.get("blob"), blob)
+            kv2.close()
+
+    def test_gc_relocates_live_values_and_retires_files(self):
+        value = "v" * 4000
+        kv = DurableKV(self.dir, n_shards=2, value_log_threshold=1000,
+                       value_log_file_bytes=40000, value_log_gc_ratio=0.9)
+        for i in range(40):
+            kv.put(f"k{i}", value + str(i))
+        for i in range(40):
+            if i % 4:
+                kv.delete(f"k{i}")  # 75% garbage: below the background trigger
+        self.assertEqual(kv.value_log_stats()["retiring"], 0)
+        first = self._vlog_files()[0]
+        kv.value_log_gc_ratio = 0.5
+        self.assertGreater(kv.gc_value_log(), 0)
+        self.assertTrue(kv.value_log_stats()["retiring"] > 0)
+        kv.snapshot()
+        kv.close()
+        self.assertNotIn(first, self._vlog_files())
+        kv2 = DurableKV(self.dir, n_shards=2, value_log_threshold=1000)
+        kv2.recover()
+        self.assertEqual(sorted(k for k, _ in kv2.scan()), sorted(f"k{i}" for i in range(0, 40, 4)))
+        self.assertEqual(kv2.get("k8"), value + "8")
+        kv2.close()
+
+    def test_gc_keeps_file_of_a_put_not_yet_applied(self):
+        value = "v" * 4000
+        kv = DurableKV(self.dir, n_shards=2, value_log_threshold=1000,
+                       value_log_file_bytes=10000, value_log_gc_ratio=0.99)
+        append = kv.wal.append
+        logged, resume = threading.Event(), threading.Event()
+
+        def slow_append(op, key, value, durability=None):
+            result = append(op, key, value, durability)
+            if key == "x":  # value and record logged, index not updated until resumed
+                logged.set()
+                resume.wait()
+            return result
+
+        kv.wal.append = slow_append
+        self.addCleanup(resume.set)
+        t = threading.Thread(target=kv.put, args=("x", value))
+        t.start()
+        self.assertTrue(logged.wait(5))
+        first = self._vlog_files()[0]
+        for i in range(4):
+            kv.put(f"k{i}", value)  # k0, k1 share the first file with x
+        kv.delete("k0")
+        kv.delete("k1")
+        kv.value_log_gc_ratio = 0.5
+        kv.gc_value_log()
+        self.assertEqual(kv.value_log_stats()["retiring"], 0)
+        resume.set()
+        t.join()
+        kv.snapshot()
+        kv.close()
+        self.assertIn(first, self._vlog_files())
+        self.assertEqual(kv.get("x"), value)
+        kv2 = DurableKV(self.dir, n_shards=2, value_log_threshold=1000,
+                        value_log_file_bytes=10000, value_log_gc_ratio=0.5)
+        kv2.recover()
+        self.assertEqual(kv2.gc_value_log(), 1)  # now x is in the index and moves
+        kv2.snapshot()
+        kv2.close()
+        self.assertNotIn(first, self._vlog_files())
+        kv3 = DurableKV(self.dir, n_shards=2, value_log_threshold=1000)
+        kv3.recover()
+        self.assertEqual((kv3.get("x"), kv3.get("k3")), (value, value))
+        kv3.close()
+
+    def test_rejected_or_failed_writes_leave_no_live_bytes(self):
+        kv = DurableKV(self.dir, n_shards=4, partitioned=True, value_log_threshold=10)
+        with self.assertRaises(ValueError):
+            kv.write_batch([("PUT", f"k{i}", "v" * 100) for i in range(8)])  # spans partitions
+        with self.assertRaises(ValueError):
+            kv.write_batch([("PUT", "k0", "v" * 100), ("NOP", "k0")])
+        wal = kv.partitions[kv.partition_index("k0")].wal
+
+        def failing_append(op, key, value, durability=None):
+            raise OSError("disk full")
+
+        wal.append = failing_append
+        for write in (lambda: kv.put("k0", "v" * 100),
+                      lambda: kv.write_batch([("PUT", "k0", "v" * 100)])):
+            with self.assertRaises(OSError):
+                write()
+        self.assertEqual(kv.value_log_stats()["live_bytes"], 0)
+        del wal.append
+        kv.put("k0", "v" * 100)
+        self.assertEqual(kv.get("k0"), "v" * 100)
+        kv.close()
+
+    def test_relocation_replays_conditionally(self):
+        kv = DurableKV(self.dir, n_shards=2, value_log_threshold=10, value_log_file_bytes=100)
+        kv.put("a", "x" * 200)
+        kv.put("pad", "y" * 200)  # seals the first file
+        kv.put("b", "z" * 200)
+        kv.delete("pad")
+        kv.gc_value_log()
+        kv.put("a", "new" * 100)
+        kv.close()
+        kv2 = DurableKV(self.dir, n_shards=2, value_log_threshold=10)
+        kv2.recover()
+        self.assertEqual((kv2.get("a"), kv2.get("b")), ("new" * 100, "z" * 200))
+        kv2.close()
+
+
+class TestBlockCache(unittest.TestCase):
+    def test_budget_and_scan_resistance(self):
+        cache = BlockCache(capacity_bytes=10 * 100)
+        hot = [("hot", i) for i in range(4)]
+        for key in hot:
+            cache.put(key, b"h" * 100)
+        # push the hot blocks through a1in into the ghost list, then touch them again
+        for i in range(10):
+            cache.put(("warmup", i), b"w" * 100)
+        for key in hot:
+            self.assertIsNone(cache.get(key))
+            cache.put(key, b"h" * 100)  # ghost hit: promoted to the LRU
+        for i in range(100):  # one long scan
+            if cache.get(("scan", i)) is None:
+                cache.put(("scan", i), b"s" * 100)
+        self.assertTrue(all(cache.get(key) is not None for key in hot))
+        stats = cache.stats()
+        self.assertLessEqual(stats["bytes"], 1000)
+        self.assertGreater(stats["evictions"], 0)
+        self.assertEqual(stats["hits"], 4)
+        cache.invalidate("hot")
+        self.assertIsNone(cache.get(("hot", 0)))
+        self.assertEqual(cache.stats()["invalidations"], 4)
+
+    def test_lsm_reads_hit_cache_and_compaction_invalidates(self):
+        d = tempfile.mkdtemp()
+        try:
+            kv = DurableKV(d, n_shards=1, engine="lsm", compaction_trigger=100)
+            for round_ in range(2):
+                for i in range(200):
+                    kv.put(f"k{i:04d}", round_)
+                kv.snapshot()
+            for _ in range(3):
+                self.assertEqual(kv.get("k0042"), 1)
+            stats = kv.block_cache_stats()
+            self.assertEqual((stats["misses"], stats["hits"]), (1, 2))
+            reads = kv.lookup_stats()["blocks_read"]
+            self.assertEqual(reads, 1)
+            kv.compact()
+            self.assertGreater(kv.block_cache_stats()["invalidations"], 0)
+            self.assertEqual(kv.get("k0042"), 1)
+            self.assertEqual(kv.block_cache_stats()["misses"], 2)
+            kv.close()
+            kv = DurableKV(d, n_shards=1, engine="lsm", block_cache_bytes=0)
+            self.assertIsNone(kv.block_cache_stats())
+            kv.close()
+        finally:
+            shutil.rmtree(d, ignore_errors=True)
+
+
+class TestCompression(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    @staticmethod
+    def _value(i):
+        return {"user": f"user-{i}", "status": "active", "tags": ["alpha", "beta", "gamma"],
+                "note": "the quick brown fox jumps over the lazy dog " * 3}
+
+    def test_codecs_round_trip_and_shrink_files(self):
+        sizes = {}
+        for codec in (None, "zlib", "lzma", "bz2", "zlib-dict"):
+            d = os.path.join(self.dir, str(codec))
+            kv = DurableKV(d, n_shards=2, wal_format="binary", snapshot_format="chunked",
+                           wal_compression=codec, snapshot_compression=codec,
+                           snapshot_chunk_bytes=4096)
+            for i in range(200):
+                kv.put(f"k{i}", self._value(i))
+            kv.write_batch([("PUT", "b", self._value(-1)), ("DEL", "k0")])
+            snap = kv.snapshot()
+            kv.put("after", self._value(7))
+            kv.close()
+            sizes[codec] = (os.path.getsize(os.path.join(d, "wal_1.log")), os.path.getsize(snap))
+            for parallel in (False, True):
+                kv2 = DurableKV(d, n_shards=2)
+                kv2.recover(parallel=parallel)
+                self.assertEqual(kv2.get("k150"), self._value(150))
+                self.assertEqual(kv2.get("b"), self._value(-1))
+                self.assertEqual(kv2.get("after"), self._value(7))
+                self.assertIsNone(kv2.get("k0"))
+                kv2.close()
+        for codec in ("zlib", "lzma", "bz2", "zlib-dict"):
+            self.assertLess(sizes[codec][1], sizes[None][1] / 2)
+        # per-record: plain zlib barely helps ~200-byte values, a trained dictionary does
+        self.assertLess(sizes["zlib-dict"][0], sizes[None][0] / 2)
+
+    def test_mixed_plain_and_compressed_files_recover(self):
+        kv = DurableKV(self.dir, n_shards=2, wal_format="binary", snapshot_format="chunked")
+        kv.put("a", self._value(1))
+        kv.snapshot()
+        kv.put("b", self._value(2))
+        kv.close()
+        kv = DurableKV(self.dir, n_shards=2, wal_format="binary", wal_compression="zlib-dict")
+        kv.recover()
+        for i in range(100):
+            kv.put(f"k{i}", self._value(i))
+        kv.close()
+        kv = DurableKV(self.dir, n_shards=2)
+        kv.recover()
+        self.assertEqual((kv.get("a"), kv.get("b"), kv.get("k99")),
+                         (self._value(1), self._value(2), self._value(99)))
+        kv.close()
+        with self.assertRaises(ValueError):
+            DurableKV(self.dir, wal_compression="zlib")  # json WAL
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+from durable_kv import DurableKV, ValuePointer, TOMBSTONE
+from kv_server import KVServer, KVClient, KVServerError
+
+
+class TestKVServer(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.kv = DurableKV(os.path.join(self.dir, "data"), n_shards=4, wal_format="binary")
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.server.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.kv.close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def start(self, address):
+        self.server = KVServer(self.kv, address)
+        return asyncio.run_coroutine_threadsafe(self.server.start(), self.loop).result()
+
+    def test_ops_over_unix_socket(self):
+        address = self.start("unix:" + os.path.join(self.dir, "kv.sock"))
+        with KVClient(address, pool_size=2) as client:
+            client.put("a", {"n": 1})
+            client.put("b", b"\x00raw")
+            client.put("c", "text")
+            client.batch([("PUT", "d", 4), ("DEL", "c")])
+            client.delete("a")
+            self.assertIsNone(client.get("a"))
+            self.assertEqual(client.get("b"), b"\x00raw")
+            self.assertEqual(client.scan(), [("b", b"\x00raw"), ("d", 4)])
+            self.assertEqual(client.scan("c", None, 1), [("d", 4)])
+            with self.assertRaises(KVServerError):
+                client.batch([("VPUT", "x", 1)])  # rejected by the server
+            # storage-internal value encodings are refused, in bodies and inside batches
+            for forged in (ValuePointer(1, 8, 100), TOMBSTONE):
+                with self.assertRaises(KVServerError):
+                    client.put("x", forged)
+                with self.assertRaises(KVServerError):
+                    client.batch([("PUT", "x", forged)])
+            self.assertIsNone(client.get("x"))
+        self.assertEqual(self.kv.get("d"), 4)
+
+    def test_pipelined_writes_share_commits_over_tcp(self):
+        address = self.start("127.0.0.1:0")
+        with KVClient(address, pool_size=4) as client:
+            futures = [client.send("put", f"k{i}", i) for i in range(500)]
+            for f in futures:
+                f.result()
+            reads = [client.send("get", f"k{i}") for i in range(500)]
+            self.assertEqual([f.result() for f in reads], list(range(500)))
+        self.assertEqual(self.server.akv.ops_committed, 500)
+        self.assertLess(self.server.akv.commits, 500)  # writes from all connections batched
+
+
+if __name__ == "__main__":
+    unittest.main()
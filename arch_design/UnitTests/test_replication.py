@@ -0,0 +1,76 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import multiprocessing
+import shutil
+import tempfile
+import time
+import unittest
+from durable_kv import DurableKV
+from replication import Follower
+
+
+def run_leader(data_dir, snapshotted, resume):
+    kv = DurableKV(data_dir, n_shards=4, wal_format="binary")
+    for i in range(500):
+        kv.put(f"k{i}", i)
+    kv.snapshot()
+    kv.delete("k0")
+    snapshotted.set()
+    resume.wait()
+    kv.write_batch([("PUT", "k1", "one"), ("DEL", "k2")])
+    for i in range(500, 1000):
+        kv.put(f"k{i}", i)
+    kv.close()
+
+
+class TestFollower(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_follows_leader_in_another_process(self):
+        snapshotted, resume = multiprocessing.Event(), multiprocessing.Event()
+        leader = multiprocessing.Process(target=run_leader, args=(self.dir, snapshotted, resume))
+        leader.start()
+        self.assertTrue(snapshotted.wait(30))
+        with Follower(self.dir) as follower:
+            # bootstrapped from the snapshot, then streamed the delete logged after it
+            self.assertEqual((follower.get("k499"), follower.get("k0")), (499, None))
+            self.assertEqual(follower.lag(), {"entries": 0, "seconds": 0.0})
+            resume.set()
+            leader.join(30)
+            self.assertEqual(follower.lag()["entries"], 501)
+            self.assertGreater(follower.lag()["seconds"], 0.0)
+            follower.start()
+            deadline = time.time() + 30
+            while follower.lag()["entries"] and time.time() < deadline:
+                time.sleep(0.01)
+            self.assertEqual((follower.get("k1"), follower.get("k2"), follower.get("k999")),
+                             ("one", None, 999))
+            self.assertEqual(len(list(follower.scan())), 998)
+            self.assertIsNone(follower.error)
+
+    def test_bootstraps_again_after_wal_retirement(self):
+        leader = DurableKV(self.dir, n_shards=4, partitioned=True, wal_format="binary",
+                           wal_segment_bytes=4096)
+        follower = Follower(self.dir, mvcc=True)
+        for i in range(300):
+            leader.put(f"k{i}", "v" * 50)
+        self.assertEqual(follower.poll(), 300)
+        with follower.read_view() as view:
+            for i in range(300, 600):
+                leader.put(f"k{i}", i)
+            leader.snapshot()
+            leader.close()  # waits for the retirement of the WALs the snapshot covers
+            follower.poll()  # a WAL it still needed is gone: bootstrap again
+            self.assertEqual(follower.bootstraps, 2)
+            self.assertIsNone(view.get("k450"))  # the old store's view is unaffected
+        self.assertEqual((follower.get("k0"), follower.get("k599")), ("v" * 50, 599))
+        follower.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
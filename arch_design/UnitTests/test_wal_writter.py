@@ -0,0 +1,244 @@
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import asyncio
+import shutil
+import tempfile
+import threading
+import unittest
+from wal_writter import (WALWriter, AsyncWALWriter, MultiStreamWALWriter, Histogram, LogReader,
+                         recover_log, stream_of, encode_frame_header, FRAMED_MAGIC)
+
+
+class TestWALWriter(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "wal.log")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def test_concurrent_submits_are_batched_and_kept_in_thread_order(self):
+        writer = WALWriter(self.path, max_batch_records=16, max_linger_us=2000)
+
+        def producer(t):
+            for i in range(50):
+                writer.submit(f"{t}:{i}\n".encode())
+
+        threads = [threading.Thread(target=producer, args=(t,)) for t in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.close()
+        with open(self.path) as f:
+            lines = f.read().split()
+        self.assertEqual(len(lines), 400)
+        for t in range(8):
+            self.assertEqual([int(l.split(":")[1]) for l in lines if l.startswith(f"{t}:")], list(range(50)))
+        s = writer.stats()
+        self.assertEqual(s["records"], 400)
+        self.assertLess(s["batches"], 400)
+        self.assertLessEqual(writer.batch_sizes.max, 16)
+        self.assertGreater(s["p99_commit_us"], 0)
+        self.assertLessEqual(s["p50_commit_us"], s["p99_commit_us"])
+
+    def test_batch_bytes_limit_and_closed_writer(self):
+        writer = WALWriter(self.path, max_batch_bytes=10)
+        writer.submit(b"a" * 25)  # an oversized record still forms a batch of its own
+        writer.close()
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"a" * 25)
+        with self.assertRaises(ValueError):
+            writer.submit(b"late")
+
+    def test_submit_nowait_pipelines_with_lsns(self):
+        writer = WALWriter(self.path, max_batch_records=64)
+        futures = [writer.submit_nowait(f"{i}\n".encode()) for i in range(500)]
+        self.assertEqual([f.lsn for f in futures], list(range(1, 501)))
+        self.assertTrue(writer.flush_until(500))
+        self.assertTrue(all(f.done() for f in futures))
+        self.assertEqual(futures[-1].result(), 500)
+        self.assertEqual(writer.submit(b"last\n"), 501)
+        with self.assertRaises(ValueError):
+            writer.flush_until(1000)
+        writer.close()
+        with open(self.path) as f:
+            self.assertEqual(f.read().split(), [str(i) for i in range(500)] + ["last"])
+        self.assertLess(writer.batches, 500)
+
+    def test_async_submit(self):
+        writer = WALWriter(self.path)
+
+        async def main():
+            awriter = AsyncWALWriter(writer)
+            lsns = await asyncio.gather(*(awriter.submit(b"x") for _ in range(100)))
+            self.assertEqual(sorted(lsns), list(range(1, 101)))
+            pending = [awriter.submit_nowait(b"y") for _ in range(50)]
+            await awriter.flush_until(pending[-1].lsn)
+            self.assertTrue(all(f.done() for f in pending))
+            await awriter.flush_until(10)  # already durable
+
+        asyncio.run(main())
+        writer.close()
+        self.assertEqual(os.path.getsize(self.path), 150)
+
+    def test_double_buffered_staging(self):
+        writer = WALWriter(self.path, staging_bytes=64)  # tiny: producers wait for swaps
+
+        def producer(t):
+            for i in range(100):
+                writer.submit(f"{t}:{i:03d}\n".encode())
+
+        threads = [threading.Thread(target=producer, args=(t,)) for t in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        futures = [writer.submit_nowait(b"f\n") for _ in range(30)]
+        self.assertTrue(writer.flush_until(futures[-1].lsn))
+        self.assertEqual([f.result() for f in futures], list(range(401, 431)))
+        with self.assertRaises(ValueError):
+            writer.submit(b"x" * 65)
+        writer.close()
+        with open(self.path) as f:
+            lines = f.read().split()
+        self.assertEqual(len(lines), 430)
+        for t in range(4):
+            self.assertEqual([l for l in lines if l.startswith(f"{t}:")],
+                             [f"{t}:{i:03d}" for i in range(100)])
+        s = writer.stats()
+        self.assertEqual(s["records"], 430)
+        self.assertLessEqual(s["bytes"] / s["batches"], 64)
+
+    def test_async_submit_parks_instead_of_blocking_when_staging_is_full(self):
+        writer = WALWriter(self.path, staging_bytes=64, framed=True)
+
+        async def main():
+            awriter = AsyncWALWriter(writer)
+            futures = [awriter.submit_nowait(f"{i:04d}".encode()) for i in range(60)]
+            self.assertGreater(len(writer.parked), 0)  # 60 * 20 bytes: parked, loop kept running
+            self.assertEqual([f.lsn for f in futures], list(range(1, 61)))
+            threaded = asyncio.get_running_loop().run_in_executor(None, writer.submit, b"thread")
+            self.assertEqual(await asyncio.gather(*futures), list(range(1, 61)))
+            self.assertEqual(await threaded, 61)  # waited behind the parked records
+
+        asyncio.run(main())
+        writer.close()
+        with LogReader(self.path) as reader:
+            records = [(lsn, bytes(p)) for lsn, p in reader]
+        self.assertEqual(records, [(i + 1, f"{i:04d}".encode()) for i in range(60)] + [(61, b"thread")])
+
+    def test_multi_stream_global_order(self):
+        for knobs in ({}, {"staging_bytes": 256}):
+            d = os.path.join(self.dir, f"streams_{len(knobs)}")
+            writer = MultiStreamWALWriter(d, streams=4, **knobs)
+
+            def producer(t):
+                for i in range(100):
+                    writer.submit(f"tenant-{t}", f"{t}:{i}".encode())
+
+            threads = [threading.Thread(target=producer, args=(t,)) for t in range(6)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            futures = [writer.submit_nowait(f"tenant-{i % 6}", b"tail") for i in range(20)]
+            self.assertTrue(writer.flush_until(futures[-1].lsn))
+            self.assertEqual([f.result() for f in futures], list(range(601, 621)))
+            writer.close()
+            records = [(lsn, bytes(p)) for lsn, p in MultiStreamWALWriter.replay(d)]
+            self.assertEqual([lsn for lsn, _ in records], list(range(1, 621)))
+            for t in range(6):
+                self.assertEqual([p for _, p in records if p.startswith(f"{t}:".encode())],
+                                 [f"{t}:{i}".encode() for i in range(100)])
+            self.assertEqual(sum(os.path.getsize(os.path.join(d, f)) > 0 for f in os.listdir(d)),
+                             len({stream_of(f"tenant-{t}", 4) for t in range(6)}))
+            # reopening continues the global LSN sequence
+            writer = MultiStreamWALWriter(d, streams=4, **knobs)
+            self.assertEqual(writer.submit("tenant-0", b"again"), 621)
+            writer.close()
+
+    def test_framed_log_read_back_and_torn_tail_recovery(self):
+        for knobs in ({}, {"staging_bytes": 4096}):
+            path = os.path.join(self.dir, f"framed_{len(knobs)}.log")
+            writer = WALWriter(path, framed=True, **knobs)
+            for i in range(100):
+                writer.submit_nowait(f"record-{i}".encode())
+            writer.submit(b"")
+            writer.close()
+            with LogReader(path) as reader:
+                records = [(lsn, bytes(p)) for lsn, p in reader]
+                self.assertFalse(reader.torn_tail)
+            self.assertEqual(records, [(i + 1, f"record-{i}".encode()) for i in range(100)] + [(101, b"")])
+
+            good = os.path.getsize(path)
+            with open(path, "ab") as f:
+                f.write(encode_frame_header(102, b"cut short by a crash") + b"cut short")
+            with LogReader(path) as reader:
+                self.assertEqual(sum(1 for _ in reader), 101)
+                self.assertTrue(reader.torn_tail)
+            writer = WALWriter(path, framed=True, **knobs)  # recovers before appending
+            self.assertEqual(os.path.getsize(path), good)
+            self.assertEqual(writer.submit(b"after"), 102)
+            writer.close()
+            with LogReader(path) as reader:
+                self.assertEqual([lsn for lsn, _ in reader][-2:], [101, 102])
+
+    def test_framed_staging_with_concurrent_producers(self):
+        writer = WALWriter(self.path, staging_bytes=256, framed=True)  # producers wait for swaps
+        returned = {}
+
+        def producer(t):
+            for i in range(300):
+                data = f"{t}:{i:03d}".encode().ljust(40, b"x")
+                returned[writer.submit(data)] = data
+
+        threads = [threading.Thread(target=producer, args=(t,)) for t in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        writer.close()
+        with LogReader(self.path) as reader:
+            records = [(lsn, bytes(p)) for lsn, p in reader]
+        self.assertEqual([lsn for lsn, _ in records], list(range(1, 2401)))
+        self.assertEqual(dict(records), returned)
+
+    def test_recover_log_truncates_zero_filled_tail(self):
+        writer = WALWriter(self.path, framed=True)
+        writer.submit(b"a")
+        writer.close()
+        with open(self.path, "ab") as f:
+            f.write(b"\0" * 100)
+        size = len(FRAMED_MAGIC) + 17
+        self.assertEqual(recover_log(self.path), {"records": 1, "last_lsn": 1, "valid_bytes": size,
+                                                  "truncated_bytes": 100})
+        self.assertEqual(os.path.getsize(self.path), size)
+
+    def test_framed_writer_refuses_other_files(self):
+        with open(self.path, "wb") as f:
+            f.write(b"plain unframed log line\n" * 40)
+        for open_log in (lambda: WALWriter(self.path, framed=True), lambda: recover_log(self.path)):
+            with self.assertRaises(ValueError):
+                open_log()
+        self.assertEqual(os.path.getsize(self.path), 960)
+        # a header cut short by a crash is the one partial file that is recovered
+        with open(self.path, "wb") as f:
+            f.write(FRAMED_MAGIC[:3])
+        writer = WALWriter(self.path, framed=True)
+        self.assertEqual(writer.submit(b"a"), 1)
+        writer.close()
+        with LogReader(self.path) as reader:
+            self.assertEqual([(lsn, bytes(p)) for lsn, p in reader], [(1, b"a")])
+
+    def test_histogram_percentiles(self):
+        h = Histogram()
+        h.record_many(range(1, 1001))
+        self.assertAlmostEqual(h.percentile(0.5), 500, delta=500 * 0.1)
+        self.assertAlmostEqual(h.percentile(0.99), 990, delta=990 * 0.1)
+        self.assertEqual(h.percentile(1.0), 1000)
+
+
+if __name__ == "__main__":
+    unittest.main()
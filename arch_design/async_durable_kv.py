@@ -0,0 +1,148 @@
+# async_durable_kv.py
+# asyncio front-end for DurableKV: writes issued from the event loop are group-committed
+# as one write_batch per partition on a worker thread, reads served from memory stay on
+# the loop.
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from durable_kv import DurableKV
+
+
+class AsyncDurableKV:
+    """
+    Awaitable get/put/delete/write_batch over a DurableKV (which the caller still owns
+    and closes).
+
+    Writes never block the loop: each call queues its ops and awaits a future. A flush
+    task collects everything queued (up to max_batch calls), groups it by partition and
+    logs each group as ONE WAL record with one fsync via DurableKV.write_batch on a
+    worker thread, then resolves every future of the group with the (wal_seq, entry_id)
+    of that record. Calls queued while a commit is in flight form the next batch, so
+    under load batches grow instead of fsyncs multiplying. A write_batch() call stays
+    atomic: it is merged whole into one group.
+    One caller's bad write never fails the others: every call is checked with
+    DurableKV.check_batch before it is queued (so an unencodable value raises in its own
+    caller), and if a merged commit still fails, the group's calls are committed again
+    one by one, in call order, so each gets its own result or exception.
+    Writes become visible to get() when their future resolves.
+
+    get() answers on the loop when DurableKV.peek() can (memtables, hash shards); only
+    lookups that need segment or value-log I/O go to a thread.
+    """
+    def __init__(self, kv: DurableKV, max_batch=1024):
+        self.kv = kv
+        self.max_batch = max_batch
+        self._pending = []        # (partition index, ops, future) in call order
+        self._flushing = False    # a flush task is scheduled or running
+        self._idle = None         # set while no flush is running (created on the loop)
+        self._executor = ThreadPoolExecutor(max_workers=min(len(kv.partitions), 8),
+                                            thread_name_prefix="async-kv")
+        self.commits = 0          # write_batch calls issued
+        self.ops_committed = 0
+
+    async def get(self, key):
+        found, value = self.kv.peek(key)
+        if found:
+            return value
+        return await asyncio.get_running_loop().run_in_executor(None, self.kv.get, key)
+
+    async def put(self, key, value):
+        return await self._submit([("PUT", key, value)])
+
+    async def delete(self, key):
+        return await self._submit([("DEL", key)])
+
+    async def write_batch(self, ops):
+        return await self._submit(list(ops))
+
+    def _submit(self, ops):
+        part = self.kv.check_batch(ops)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((part, ops, future))
+        if not self._flushing:
+            self._flushing = True
+            if self._idle is None:
+                self._idle = asyncio.Event()
+            self._idle.clear()
+            # runs on a later loop iteration, so every write issued this tick joins the batch
+            loop.create_task(self._flush())
+        return future
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._pending:
+                batch = self._pending[:self.max_batch]
+                del self._pending[:len(batch)]
+                groups = {}
+                for part, ops, future in batch:
+                    groups.setdefault(part, []).append((ops, future))
+                commits = [loop.run_in_executor(self._executor, self.kv.write_batch,
+                                                [op for ops, _ in group for op in ops])
+                           for group in groups.values()]
+                results = await asyncio.gather(*commits, return_exceptions=True)
+                for group, result in zip(groups.values(), results):
+                    self.commits += 1
+                    if isinstance(result, BaseException) and len(group) > 1:
+                        outcomes = await loop.run_in_executor(self._executor, self._commit_each,
+                                                              [ops for ops, _ in group])
+                        self.commits += len(group)
+                    else:
+                        outcomes = [result] * len(group)
+                    for (ops, future), outcome in zip(group, outcomes):
+                        if future.cancelled():
+                            continue
+                        if isinstance(outcome, BaseException):
+                            future.set_exception(outcome)
+                        else:
+                            self.ops_committed += len(ops)
+                            future.set_result(outcome)
+        finally:
+            self._flushing = False
+            self._idle.set()
+
+    def _commit_each(self, calls):
+        """Commit each call's ops on its own (worker thread). Returns a result or exception per call."""
+        outcomes = []
+        for ops in calls:
+            try:
+                outcomes.append(self.kv.write_batch(ops))
+            except Exception as e:
+                outcomes.append(e)
+        return outcomes
+
+    async def drain(self):
+        """Wait until every write queued so far is committed."""
+        while self._flushing:
+            await self._idle.wait()
+
+    async def close(self):
+        """Drain pending writes and stop the worker threads (the DurableKV stays open)."""
+        await self.drain()
+        self._executor.shutdown(wait=True)
+
+
+# ---------- Basic demo ----------
+if __name__ == "__main__":
+    import os
+    import shutil
+    import time
+
+    DATADIR = "./kvdata_async_demo"
+    if os.path.exists(DATADIR):
+        shutil.rmtree(DATADIR)
+
+    async def main():
+        kv = DurableKV(DATADIR, n_shards=8)
+        akv = AsyncDurableKV(kv)
+        t = time.perf_counter()
+        await asyncio.gather(*(akv.put(f"key-{i}", f"value-{i}") for i in range(10000)))
+        elapsed = time.perf_counter() - t
+        print(f"10000 puts in {elapsed:.2f}s over {akv.commits} commits")
+        print("get:", await akv.get("key-42"))
+        await akv.close()
+        kv.close()
+
+    asyncio.run(main())
+    shutil.rmtree(DATADIR)
@@ -0,0 +1,64 @@
+# bench_rwlock.py
+# Micro-benchmark: shard locks from durable_kv under mixed read/write ratios.
+# Each worker loops over acquire -> touch a dict -> release for a fixed duration and we
+# report total ops/s plus the worst time a writer waited for the lock.
+import argparse
+import threading
+import time
+
+from durable_kv import RWLock, WriterPreferringRWLock
+
+
+def run(lock, read_ratio, threads=8, duration=1.0):
+    data = {i: i for i in range(64)}
+    stop = threading.Event()
+    ops = [0] * threads
+    worst_write_wait = [0.0] * threads
+
+    def worker(n):
+        # deterministic per-thread op mix: out of every 100 ops, read_ratio*100 are reads
+        reads_per_100 = int(read_ratio * 100)
+        i = 0
+        while not stop.is_set():
+            if i % 100 < reads_per_100:
+                lock.acquire_read()
+                data.get(i & 63)
+                lock.release_read()
+            else:
+                t0 = time.perf_counter()
+                lock.acquire_write()
+                worst_write_wait[n] = max(worst_write_wait[n], time.perf_counter() - t0)
+                data[i & 63] = i
+                lock.release_write()
+            i += 1
+        ops[n] = i
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in workers:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in workers:
+        t.join()
+    return sum(ops) / duration, max(worst_write_wait)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="shard lock micro-benchmark")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=1.0)
+    args = parser.parse_args()
+    locks = {
+        "reader-preferring": RWLock,
+        "writer-preferring": WriterPreferringRWLock,
+        "fair": lambda: WriterPreferringRWLock(fair=True),
+    }
+    print(f"{'lock':<18} {'reads':>6} {'ops/s':>12} {'max write wait ms':>18}")
+    for read_ratio in (0.5, 0.9, 0.99):
+        for name, factory in locks.items():
+            rate, worst = run(factory(), read_ratio, args.threads, args.duration)
+            print(f"{name:<18} {read_ratio:>6.0%} {rate:>12,.0f} {worst * 1000:>18.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,16 @@ import json
 import threading
 import time
 import tempfile
+import struct
+import zlib
+import heapq
+import itertools
+import mmap
+import base64
+import bisect
+import collections
+import sys
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 # ---------- Simple readers-writer lock ----------
 class RWLock:
@@ -43,25 +53,1274 @@ class RWLock:
             self._read_ready.notify_all()
 
 
+class WriterPreferringRWLock:
+    """
+    Readers-writer lock that does not let a stream of readers starve writers:
+    - fair=False: once a writer is waiting, new readers queue behind it (writers may
+      then starve readers under a write flood, but shard writes are short).
+    - fair=True: waiters are granted strictly in arrival order; consecutive readers at
+      the head of the queue are admitted together.
+    The uncontended paths take the internal mutex once and touch no Condition.
+    Contention counters (acquisitions, contended acquisitions, total wait seconds,
+    current and max queue depth) are kept under the same mutex; see stats().
+    """
+    def __init__(self, fair=False):
+        self.fair = fair
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._writer = False
+        # fair=False: wait on conditions, counting who waits
+        self._read_ok = threading.Condition(self._lock)
+        self._write_ok = threading.Condition(self._lock)
+        self._waiting_readers = 0
+        self._waiting_writers = 0
+        # fair=True: FIFO of (is_writer, gate); a gate is a held Lock the granter releases
+        self._queue = collections.deque()
+        # contention counters
+        self._acquires = 0
+        self._contended = 0
+        self._wait_s = 0.0
+        self._max_depth = 0
+
+    def acquire_read(self):
+        lock = self._lock
+        lock.acquire()
+        self._acquires += 1
+        if not self._writer and not self._waiting_writers and not self._queue:
+            self._readers += 1
+            lock.release()
+            return
+        self._wait(False)
+
+    def release_read(self):
+        with self._lock:
+            self._readers -= 1
+            if self._readers == 0:
+                self._wake()
+
+    def acquire_write(self):
+        lock = self._lock
+        lock.acquire()
+        self._acquires += 1
+        if not self._writer and not self._readers and not self._queue:
+            self._writer = True
+            lock.release()
+            return
+        self._wait(True)
+
+    def release_write(self):
+        with self._lock:
+            self._writer = False
+            self._wake()
+
+    def _wait(self, is_writer):
+        # called with self._lock held; returns with it released and the lock granted
+        t0 = time.perf_counter()
+        self._contended += 1
+        if self.fair:
+            gate = threading.Lock()
+            gate.acquire()
+            self._queue.append((is_writer, gate))
+            self._max_depth = max(self._max_depth, len(self._queue))
+            self._lock.release()
+            gate.acquire()  # _wake() granted us (state already updated) before releasing it
+            with self._lock:
+                self._wait_s += time.perf_counter() - t0
+            return
+        if is_writer:
+            self._waiting_writers += 1
+            self._max_depth = max(self._max_depth, self._waiting_writers + self._waiting_readers)
+            while self._writer or self._readers:
+                self._write_ok.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        else:
+            self._waiting_readers += 1
+            self._max_depth = max(self._max_depth, self._waiting_writers + self._waiting_readers)
+            while self._writer or self._waiting_writers:
+                self._read_ok.wait()
+            self._waiting_readers -= 1
+            self._readers += 1
+        self._wait_s += time.perf_counter() - t0
+        self._lock.release()
+
+    def _wake(self):
+        # caller holds self._lock and has just made the lock free (or reader-only)
+        if self.fair:
+            queue = self._queue
+            if queue and queue[0][0]:
+                if not self._readers and not self._writer:
+                    self._writer = True
+                    queue.popleft()[1].release()
+            else:
+                while queue and not queue[0][0] and not self._writer:
+                    self._readers += 1
+                    queue.popleft()[1].release()
+        elif self._waiting_writers:
+            if not self._readers:
+                self._write_ok.notify()
+        elif self._waiting_readers:
+            self._read_ok.notify_all()
+
+    def stats(self):
+        with self._lock:
+            depth = len(self._queue) if self.fair else self._waiting_readers + self._waiting_writers
+            return {"acquires": self._acquires, "contended": self._contended,
+                    "wait_s": self._wait_s, "queue_depth": depth, "max_queue_depth": self._max_depth}
+
+
+# ---------- WAL record formats ----------
+# "json":   one JSON object per line (human readable, the original format).
+# "binary": file starts with WAL_MAGIC, then length-prefixed records:
+#           [u32 payload_len][u32 crc32(payload)][payload]
+#           payload = [u64 wal_seq][u64 entry_id][u8 op][key][value]
+#           key/value = [u8 tag][u32 len][bytes]  (tag says how to decode the bytes)
+# A write batch is a single record with op "BATCH", key None and the list of
+# (op, key, value) as its value (binary: [u8 op][key][value] repeated), so it is
+# written, checksummed and replayed as one unit.
+# Value-log mode adds "VPUT" (value = [file, offset, length] of the value in the value
+# log) and "VMOVE" (value = [old pointer, new pointer]: value-log GC moved the value;
+# applied only if the key still holds the old pointer).
+# "ZDICT" (binary only, value = dictionary bytes) registers a compression dictionary for
+# the records after it; readers consume it and never yield it.
+WAL_MAGIC = b"DKVWAL1\n"
+_REC_HEADER = struct.Struct("<II")
+_REC_BODY = struct.Struct("<QQB")
+_VAL_HEADER = struct.Struct("<BI")
+_OP_CODES = {"PUT": 1, "DEL": 2, "BATCH": 3, "VPUT": 4, "VMOVE": 5, "ZDICT": 6}
+_OP_NAMES = {code: name for name, code in _OP_CODES.items()}
+_TAG_NONE, _TAG_STR, _TAG_BYTES, _TAG_JSON, _TAG_TOMBSTONE, _TAG_BATCH = 0, 1, 2, 3, 4, 5
+_TAG_VPTR = 6
+_TAG_COMPRESSED = 7
+_VPTR = struct.Struct("<IQI")
+
+
+class _Tombstone:
+    """Deletion marker stored by the LSM engine so a delete can shadow older segments."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return "TOMBSTONE"
+
+
+TOMBSTONE = _Tombstone()
+_MISSING = object()
+
+# Where a value-log value lives: payload of length bytes at offset in vlog_{file}.dat
+ValuePointer = collections.namedtuple("ValuePointer", "file offset length")
+
+
+def _encode_value(value):
+    if value is TOMBSTONE:
+        tag, raw = _TAG_TOMBSTONE, b""
+    elif isinstance(value, ValuePointer):
+        tag, raw = _TAG_VPTR, _VPTR.pack(*value)
+    elif value is None:
+        tag, raw = _TAG_NONE, b""
+    elif isinstance(value, str):
+        tag, raw = _TAG_STR, value.encode("utf-8")
+    elif isinstance(value, (bytes, bytearray)):
+        tag, raw = _TAG_BYTES, bytes(value)
+    else:
+        tag, raw = _TAG_JSON, json.dumps(value).encode("utf-8")
+    return _VAL_HEADER.pack(tag, len(raw)) + raw
+
+
+def _decode_value(mv, pos):
+    """Decode a tagged value from memoryview mv at pos. Returns (value, next_pos)."""
+    tag, n = _VAL_HEADER.unpack_from(mv, pos)
+    start = pos + _VAL_HEADER.size
+    end = start + n
+    if tag == _TAG_NONE:
+        value = None
+    elif tag == _TAG_STR:
+        value = str(mv[start:end], "utf-8")
+    elif tag == _TAG_BYTES:
+        value = bytes(mv[start:end])
+    elif tag == _TAG_TOMBSTONE:
+        value = TOMBSTONE
+    elif tag == _TAG_VPTR:
+        value = ValuePointer(*_VPTR.unpack_from(mv, start))
+    elif tag == _TAG_COMPRESSED:
+        value = _decode_compressed(mv, start, end)
+    elif tag == _TAG_BATCH:
+        value = []
+        p = start
+        while p < end:
+            op = _OP_NAMES[mv[p]]
+            k, p = _decode_value(mv, p + 1)
+            v, p = _decode_value(mv, p)
+            value.append((op, k, v))
+    else:
+        value = json.loads(bytes(mv[start:end]))
+    return value, end
+
+
+def _encode_batch(ops):
+    raw = b"".join(bytes([_OP_CODES[op]]) + _encode_value(k) + _encode_value(v) for op, k, v in ops)
+    return _VAL_HEADER.pack(_TAG_BATCH, len(raw)) + raw
+
+
+def encode_binary_record(wal_seq, entry_id, op, key, value, codec=None, zdict=None):
+    """Encode one binary WAL record; with codec the value (or whole batch) is compressed."""
+    encoded = _encode_batch(value) if op == "BATCH" else _encode_value(value)
+    encoded = _compress_encoded(encoded, codec, zdict)
+    body = _REC_BODY.pack(wal_seq, entry_id, _OP_CODES[op]) + _encode_value(key) + encoded
+    return _REC_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+# ---------- Compression ----------
+# A compressed value is a _TAG_COMPRESSED value whose bytes are [u8 codec] (+ [u32 dict_id]
+# for "zlib-dict") followed by the compressed tagged encoding of the original value, so
+# readers decode compressed and plain values alike. "zlib-dict" primes zlib with a
+# dictionary trained on sample values; the dictionary travels with the file (a ZDICT
+# record at the head of each WAL file, the footer of a chunked snapshot) and is looked
+# up by its CRC-32.
+COMPRESSION_CODECS = ("zlib", "lzma", "bz2", "zlib-dict")
+_CODEC_IDS = {name: i for i, name in enumerate(COMPRESSION_CODECS, 1)}
+_CODEC_NAMES = {i: name for name, i in _CODEC_IDS.items()}
+_DICT_ID = struct.Struct("<I")
+_ZDICTS = {}  # dict_id -> dictionary bytes, filled by writers and by readers
+
+
+def train_zdict(samples, size=4 << 10):
+    """
+    Build a zlib preset dictionary from sample byte strings: distinct samples ordered by
+    frequency with the most common last (zlib matches nearer the end more cheaply),
+    truncated from the front to size bytes.
+    """
+    counts = collections.Counter(bytes(s) for s in samples)
+    zdict = b"".join(s for s, _ in sorted(counts.items(), key=lambda item: item[1]))
+    return zdict[-size:]
+
+
+def register_zdict(zdict):
+    """Make a dictionary known to decoders in this process. Returns its id."""
+    dict_id = zlib.crc32(zdict)
+    _ZDICTS[dict_id] = zdict
+    return dict_id
+
+
+def _compress(codec, data, zdict=None, level=6):
+    if codec == "zlib":
+        return zlib.compress(data, level)
+    if codec == "zlib-dict":
+        c = zlib.compressobj(level, zdict=zdict)
+        return c.compress(data) + c.flush()
+    if codec == "lzma":
+        import lzma
+        return lzma.compress(data)
+    if codec == "bz2":
+        import bz2
+        return bz2.compress(data)
+    raise ValueError(f"unknown compression codec: {codec!r}")
+
+
+def _decompress(codec, data, zdict=None):
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zlib-dict":
+        d = zlib.decompressobj(zdict=zdict)
+        return d.decompress(data) + d.flush()
+    if codec == "lzma":
+        import lzma
+        return lzma.decompress(data)
+    import bz2
+    return bz2.decompress(data)
+
+
+def _compress_encoded(encoded, codec, zdict=None, min_bytes=64):
+    """Wrap a tagged encoding as a compressed value when that makes it smaller."""
+    if codec is None or len(encoded) < min_bytes:
+        return encoded
+    if codec == "zlib-dict" and zdict is None:
+        codec = "zlib"  # dictionary not trained yet
+    head = bytes([_CODEC_IDS[codec]])
+    if codec == "zlib-dict":
+        head += _DICT_ID.pack(zlib.crc32(zdict))
+    raw = head + _compress(codec, encoded, zdict)
+    if len(raw) + _VAL_HEADER.size >= len(encoded):
+        return encoded
+    return _VAL_HEADER.pack(_TAG_COMPRESSED, len(raw)) + raw
+
+
+def _decode_compressed(mv, start, end):
+    codec = _CODEC_NAMES[mv[start]]
+    pos, zdict = start + 1, None
+    if codec == "zlib-dict":
+        (dict_id,) = _DICT_ID.unpack_from(mv, pos)
+        pos += _DICT_ID.size
+        try:
+            zdict = _ZDICTS[dict_id]
+        except KeyError:
+            raise ValueError(f"unknown compression dictionary {dict_id:#x}") from None
+    value, _ = _decode_value(memoryview(_decompress(codec, mv[pos:end], zdict)), 0)
+    return value
+
+
+class WALReader:
+    """
+    Iterate the entries of one WAL file as (wal_seq, entry_id, op, key, value) tuples.
+    The format is sniffed from the first bytes, so JSON and binary files can be mixed.
+
+    Reading stops at the first record that is incomplete or fails its CRC (or, for JSON,
+    does not parse): that is a torn tail from a crash mid-write. After iteration,
+    torn_tail tells whether that happened and valid_bytes is the offset just past the
+    last good record.
+
+    start resumes reading at a record boundary, e.g. the valid_bytes of an earlier pass
+    over a file that is still being appended to (a record cut short there is only
+    "torn" until its writer finishes it).
+    """
+    def __init__(self, path, block_size=1 << 20, start=0):
+        self.path = path
+        self.block_size = block_size
+        self.start = start
+        self.torn_tail = False
+        self.valid_bytes = 0
+
+    def __iter__(self):
+        with open(self.path, "rb") as f:
+            head = f.read(len(WAL_MAGIC))
+            if head == WAL_MAGIC:
+                self.valid_bytes = max(self.start, len(WAL_MAGIC))
+                f.seek(self.valid_bytes)
+                yield from self._iter_binary(f)
+            else:
+                self.valid_bytes = self.start
+                f.seek(self.start)
+                yield from self._iter_json(f)
+
+    def _iter_json(self, f):
+        for line in f:
+            if not line.rstrip(b"\x00"):
+                return  # preallocated, never written tail
+            if not line.strip():
+                self.valid_bytes += len(line)
+                continue
+            try:
+                if not line.endswith(b"\n"):
+                    raise ValueError("unterminated record")
+                entry = json.loads(line)
+            except ValueError:
+                self.torn_tail = True
+                return
+            self.valid_bytes += len(line)
+            value = entry["value"]
+            if entry["op"] == "BATCH":
+                value = [tuple(op) for op in value]
+            yield (entry["wal_seq"], entry["entry_id"], entry["op"], entry["key"], value)
+
+    def _iter_binary(self, f):
+        # read big blocks into one buffer and decode records in place through a memoryview
+        buf = bytearray()
+        block = bytearray(self.block_size)
+        eof = False
+        pos = 0
+        while True:
+            mv = memoryview(buf)
+            entries = []
+            while True:
+                if len(buf) - pos < _REC_HEADER.size:
+                    break
+                length, crc = _REC_HEADER.unpack_from(mv, pos)
+                if length == 0 and crc == 0:
+                    # preallocated, never written tail: clean end of log
+                    mv.release()
+                    yield from entries
+                    return
+                start = pos + _REC_HEADER.size
+                end = start + length
+                if end > len(buf):
+                    break
+                body = mv[start:end]
+                if length < _REC_BODY.size or zlib.crc32(body) != crc:
+                    body.release()
+                    mv.release()
+                    self.torn_tail = True
+                    yield from entries
+                    return
+                wal_seq, entry_id, op = _REC_BODY.unpack_from(body, 0)
+                key, p = _decode_value(body, _REC_BODY.size)
+                value, _ = _decode_value(body, p)
+                body.release()
+                if _OP_NAMES[op] == "ZDICT":
+                    register_zdict(value)  # needed by the records that follow
+                else:
+                    entries.append((wal_seq, entry_id, _OP_NAMES[op], key, value))
+                self.valid_bytes += end - pos
+                pos = end
+            mv.release()
+            yield from entries
+            if eof:
+                if any(buf[pos:]):
+                    self.torn_tail = True  # trailing partial record (zeros are preallocation)
+                return
+            del buf[:pos]
+            pos = 0
+            n = f.readinto(block)
+            if n == 0:
+                eof = True
+            else:
+                buf += memoryview(block)[:n]
+
+
+# ---------- Snapshot file formats ----------
+# "json":    one document {"meta": ..., "data": {k: v, ...}} (the original format).
+# "chunked": SNAP_MAGIC, then chunks [u32 payload_len][u32 crc32][payload] where payload is
+#            a run of tagged key/value pairs (same encoding as binary WAL values), then a
+#            JSON footer {"meta": ..., "chunks": [[offset, length, count], ...]} and a
+#            trailer [u64 footer_len][SNAP_MAGIC]. Writer and reader hold one chunk at a time.
+SNAP_MAGIC = b"DKVSNP1\n"
+_SNAP_TRAILER = struct.Struct("<Q")
+
+
+def write_chunked_snapshot(f, meta, shards, chunk_bytes=1 << 20, compression=None):
+    """
+    Stream the items of each dict in shards into binary file f, chunk by chunk. With
+    compression (see COMPRESSION_CODECS) every chunk payload is compressed as a block;
+    "zlib-dict" trains its dictionary on the first chunk and stores it in the footer.
+    """
+    if compression is not None and compression not in COMPRESSION_CODECS:
+        raise ValueError(f"unknown compression codec: {compression!r}")
+    f.write(SNAP_MAGIC)
+    offset = len(SNAP_MAGIC)
+    chunks = []
+    parts, size, count = [], 0, 0
+    zdict = None
+
+    def flush_chunk():
+        nonlocal offset, zdict
+        payload = b"".join(parts)
+        if compression == "zlib-dict" and zdict is None:
+            zdict = train_zdict(parts)
+        if compression is not None:
+            payload = _compress(compression, payload, zdict)
+        f.write(_REC_HEADER.pack(len(payload), zlib.crc32(payload)))
+        f.write(payload)
+        chunks.append([offset, _REC_HEADER.size + len(payload), count])
+        offset += _REC_HEADER.size + len(payload)
+
+    for shard in shards:
+        for k, v in shard.items():
+            rec = _encode_value(k) + _encode_value(v)
+            parts.append(rec)
+            size += len(rec)
+            count += 1
+            if size >= chunk_bytes:
+                flush_chunk()
+                parts, size, count = [], 0, 0
+    if parts:
+        flush_chunk()
+    footer = {"meta": meta, "chunks": chunks}
+    if compression is not None:
+        footer["compression"] = compression
+        if zdict is not None:
+            footer["zdict"] = base64.b64encode(zdict).decode("ascii")
+    footer = json.dumps(footer).encode("utf-8")
+    f.write(footer)
+    f.write(_SNAP_TRAILER.pack(len(footer)) + SNAP_MAGIC)
+
+
+class SnapshotReader:
+    """
+    Read a snapshot file of either format. meta is available right after construction;
+    iterating yields (key, value) pairs. Chunked snapshots are loaded one chunk at a time.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+        self._chunks = None
+        self.compression = None
+        with open(path, "rb") as f:
+            head = f.read(len(SNAP_MAGIC))
+            if head == SNAP_MAGIC:
+                trailer = _SNAP_TRAILER.size + len(SNAP_MAGIC)
+                f.seek(-trailer, os.SEEK_END)
+                tail = f.read(trailer)
+                if tail[_SNAP_TRAILER.size:] != SNAP_MAGIC:
+                    raise ValueError(f"snapshot {path} has no footer")
+                (footer_len,) = _SNAP_TRAILER.unpack_from(tail)
+                f.seek(-(trailer + footer_len), os.SEEK_END)
+                footer = json.loads(f.read(footer_len))
+                self.meta = footer["meta"]
+                self._chunks = footer["chunks"]
+                self.compression = footer.get("compression")
+                self._zdict = base64.b64decode(footer["zdict"]) if "zdict" in footer else None
+            else:
+                f.seek(0)
+                payload = json.load(f)
+                self.meta = payload["meta"]
+                self._data = payload["data"]
+                self._pointers = payload.get("value_pointers", {})
+
+    def __iter__(self):
+        if self._data is not None:
+            yield from self._data.items()
+            for k, ptr in self._pointers.items():
+                yield k, ValuePointer(*ptr)
+            return
+        with open(self.path, "rb") as f:
+            for offset, length, count in self._chunks:
+                f.seek(offset)
+                chunk = f.read(length)
+                payload_len, crc = _REC_HEADER.unpack_from(chunk)
+                mv = memoryview(chunk)[_REC_HEADER.size:]
+                if payload_len != len(mv) or zlib.crc32(mv) != crc:
+                    raise ValueError(f"snapshot {self.path}: corrupt chunk at offset {offset}")
+                if self.compression is not None:
+                    mv = memoryview(_decompress(self.compression, mv, self._zdict))
+                pos = 0
+                for _ in range(count):
+                    k, pos = _decode_value(mv, pos)
+                    v, pos = _decode_value(mv, pos)
+                    yield k, v
+
+
+def _replay_op(shard, op, k, value, lsm):
+    """Apply one replayed WAL op (not BATCH) to a shard dict."""
+    if op == "PUT":
+        shard[k] = value
+    elif op == "DEL":
+        if lsm:
+            shard[k] = TOMBSTONE
+        else:
+            shard.pop(k, None)
+    elif op == "VPUT":
+        shard[k] = ValuePointer(*value)
+    elif op == "VMOVE":
+        old, new = value
+        if shard.get(k) == ValuePointer(*old):
+            shard[k] = ValuePointer(*new)
+
+
+def _parse_wal_file(path):
+    """Parse a whole WAL file (process-pool friendly). Returns (entries, torn_tail)."""
+    reader = WALReader(path)
+    try:
+        entries = list(reader)
+    except FileNotFoundError:
+        return [], False
+    return entries, reader.torn_tail
+
+
+# ---------- Value log ----------
+# vlog_{n}.dat files hold [u32 payload_len][u32 crc32(payload)][payload] records, where
+# payload is one tagged value (see _encode_value). A ValuePointer addresses the payload.
+class ValueLog:
+    """
+    Append-only value files for key-value separation. Values are appended to the active
+    file (a new one is started every file_bytes) and read back through mmap. live_bytes
+    tracks, per file, how many payload bytes the index still points at; files that are
+    mostly garbage are relocated by DurableKV.gc_value_log() and deleted once a later
+    snapshot no longer needs them (see retire_after / remove).
+    """
+    def __init__(self, dirpath, file_bytes=64 << 20):
+        self.dirpath = dirpath
+        self.file_bytes = file_bytes
+        self._lock = threading.Lock()
+        self._maps = {}                          # file -> mmap (replaced when the file grows)
+        self.live_bytes = collections.Counter()  # file -> payload bytes still referenced
+        self.sizes = {}                          # file -> bytes written
+        self.retiring = {}                       # file -> wal seq of its last relocation
+        for fname in os.listdir(dirpath):
+            if fname.startswith("vlog_") and fname.endswith(".dat"):
+                path = os.path.join(dirpath, fname)
+                size = os.path.getsize(path)
+                if size:
+                    self.sizes[int(fname[5:-4])] = size
+                else:
+                    os.remove(path)
+        # never append after a previous run's tail, it may be torn
+        self.active = max(self.sizes, default=0) + 1
+        self._open_active()
+
+    def _path(self, file_no):
+        return os.path.join(self.dirpath, f"vlog_{file_no:06d}.dat")
+
+    def _open_active(self):
+        self._f = open(self._path(self.active), "ab")
+        self.sizes[self.active] = 0
+        self._unsynced = False
+
+    def append(self, value):
+        """Append one value and return its ValuePointer (written, not yet synced)."""
+        payload = _encode_value(value)
+        with self._lock:
+            if self.sizes[self.active] >= self.file_bytes:
+                self._f.flush()
+                os.fsync(self._f.fileno())
+                self._f.close()
+                self.active += 1
+                self._open_active()
+            offset = self.sizes[self.active] + _REC_HEADER.size
+            self._f.write(_REC_HEADER.pack(len(payload), zlib.crc32(payload)) + payload)
+            self._f.flush()
+            self._unsynced = True
+            self.sizes[self.active] = offset + len(payload)
+            ptr = ValuePointer(self.active, offset, len(payload))
+            self.live_bytes[ptr.file] += ptr.length
+        return ptr
+
+    def sync(self):
+        with self._lock:
+            if self._unsynced:
+                os.fsync(self._f.fileno())
+                self._unsynced = False
+
+    def _map(self, file_no, end):
+        mm = self._maps.get(file_no)
+        if mm is None or len(mm) < end:
+            with self._lock:
+                mm = self._maps.get(file_no)
+                if mm is None or len(mm) < end:
+                    # remap the grown file; readers still holding the old map keep it alive
+                    with open(self._path(file_no), "rb") as f:
+                        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    self._maps[file_no] = mm
+        return mm
+
+    def read(self, ptr):
+        """Return the value ptr points at, decoded straight from the mapped file."""
+        start = ptr.offset - _REC_HEADER.size
+        mv = memoryview(self._map(ptr.file, ptr.offset + ptr.length))[start:ptr.offset + ptr.length]
+        try:
+            length, crc = _REC_HEADER.unpack_from(mv, 0)
+            body = mv[_REC_HEADER.size:]
+            try:
+                if length != ptr.length or zlib.crc32(body) != crc:
+                    raise OSError(f"corrupt value log record at {ptr}")
+                value, _ = _decode_value(body, 0)
+            finally:
+                body.release()
+        finally:
+            mv.release()
+        return value
+
+    def release(self, ptr):
+        """ptr is no longer referenced by the index. Returns True if its file became GC-worthy."""
+        with self._lock:
+            self.live_bytes[ptr.file] -= ptr.length
+            return ptr.file != self.active and ptr.file not in self.retiring
+
+    def reset_live(self, pointers):
+        """Recompute live bytes from the pointers held by the index (after recovery)."""
+        with self._lock:
+            self.live_bytes = collections.Counter()
+            for ptr in pointers:
+                self.live_bytes[ptr.file] += ptr.length
+
+    def garbage_ratio(self, file_no):
+        size = self.sizes.get(file_no, 0)
+        return 1.0 - self.live_bytes[file_no] / size if size else 0.0
+
+    def gc_candidates(self, ratio):
+        """Sealed files, not already relocated, whose garbage share is at least ratio."""
+        with self._lock:
+            files = [n for n in self.sizes if n != self.active and n not in self.retiring]
+        return sorted(n for n in files if self.garbage_ratio(n) >= ratio)
+
+    def retire_after(self, file_no, wal_seq):
+        """
+        Delete sealed file_no after a snapshot with seq > wal_seq, if nothing references
+        it any more (live bytes also count values appended but not yet applied). Returns
+        whether it was marked (not if it already was, e.g. by a concurrent GC run).
+        """
+        with self._lock:
+            if self.live_bytes[file_no] > 0 or file_no in self.retiring:
+                return False
+            self.retiring[file_no] = wal_seq
+            return True
+
+    def remove(self, file_no):
+        with self._lock:
+            self.retiring.pop(file_no, None)
+            self.sizes.pop(file_no, None)
+            self.live_bytes.pop(file_no, None)
+            self._maps.pop(file_no, None)  # not closed: a reader may still hold it
+        try:
+            os.remove(self._path(file_no))
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            files = sorted(self.sizes)
+            return {"files": len(files), "bytes": sum(self.sizes.values()),
+                    "live_bytes": sum(self.live_bytes[n] for n in files),
+                    "retiring": len(self.retiring)}
+
+    def close(self):
+        with self._lock:
+            self._f.flush()
+            os.fsync(self._f.fileno())
+            self._f.close()
+
+
+# ---------- LSM segments ----------
+# Immutable sorted run written when a memtable is flushed (or by compaction):
+#   SEG_MAGIC, blocks of about block_bytes, each a run of records
+#   [u32 len][u32 crc32][key][value] in ascending key order,
+#   footer [min_key][max_key][meta][sparse index][bloom bits] (tagged values),
+#   trailer [u64 footer_len][SEG_MAGIC].
+# The sparse index holds the first key and (offset, length) of every block, so a lookup
+# reads exactly one block; the bloom filter lets most misses skip the file altogether.
+SEG_MAGIC = b"DKVSEG2\n"
+_INDEX_ENTRY = struct.Struct("<QI")
+
+
+def _key_bytes(key):
+    if isinstance(key, str):
+        return key.encode("utf-8")
+    if isinstance(key, (bytes, bytearray)):
+        return bytes(key)
+    return json.dumps(key).encode("utf-8")
+
+
+class BloomFilter:
+    """
+    Plain bloom filter over key bytes, k probes by double hashing two CRC-32s.
+    bits_per_key=10 gives about a 1% false-positive rate.
+    """
+    def __init__(self, n_bits, n_hashes, bits=None):
+        self.n_bits = max(n_bits, 8)
+        self.n_hashes = n_hashes
+        self.bits = bits if bits is not None else bytearray((self.n_bits + 7) // 8)
+
+    @classmethod
+    def for_keys(cls, n_keys, bits_per_key):
+        n_hashes = max(1, min(30, int(round(bits_per_key * 0.69))))  # k = bits/key * ln 2
+        return cls(n_keys * bits_per_key, n_hashes)
+
+    def _probes(self, data):
+        h1 = zlib.crc32(data)
+        h2 = zlib.crc32(data, 0x5BD1E995) | 1
+        m = self.n_bits
+        return [(h1 + i * h2) % m for i in range(self.n_hashes)]
+
+    def add(self, data):
+        for bit in self._probes(data):
+            self.bits[bit >> 3] |= 1 << (bit & 7)
+
+    def may_contain(self, data):
+        bits = self.bits
+        for bit in self._probes(data):
+            if not bits[bit >> 3] & (1 << (bit & 7)):
+                return False
+        return True
+
+
+def write_segment(path, items, meta=None, block_bytes=4096, bits_per_key=10, cache=None):
+    """Write (key, value) items, already sorted by key, to an immutable segment file."""
+    tmp_path = path + ".tmp"
+    count = 0
+    min_key = max_key = None
+    index = []        # (first_key, offset, length) per block
+    key_bytes = []    # bloom filter input, sized once the key count is known
+    with open(tmp_path, "wb") as f:
+        f.write(SEG_MAGIC)
+        offset = len(SEG_MAGIC)
+        block, block_size, first_key = [], 0, None
+
+        def flush_block():
+            nonlocal offset
+            f.write(b"".join(block))
+            index.append((first_key, offset, block_size))
+            offset += block_size
+
+        for k, v in items:
+            body = _encode_value(k) + _encode_value(v)
+            if not block:
+                first_key = k
+            block.append(_REC_HEADER.pack(len(body), zlib.crc32(body)))
+            block.append(body)
+            block_size += _REC_HEADER.size + len(body)
+            key_bytes.append(_key_bytes(k))
+            if count == 0:
+                min_key = k
+            max_key = k
+            count += 1
+            if block_size >= block_bytes:
+                flush_block()
+                block, block_size = [], 0
+        if block:
+            flush_block()
+        bloom = BloomFilter.for_keys(count, bits_per_key)
+        for kb in key_bytes:
+            bloom.add(kb)
+        index_blob = b"".join(_encode_value(k) + _INDEX_ENTRY.pack(off, n) for k, off, n in index)
+        meta = dict(meta or {}, count=count, blocks=len(index),
+                    bloom_bits=bloom.n_bits, bloom_hashes=bloom.n_hashes)
+        footer = (_encode_value(min_key) + _encode_value(max_key) + _encode_value(meta)
+                  + _encode_value(index_blob) + _encode_value(bytes(bloom.bits)))
+        f.write(footer)
+        f.write(_SNAP_TRAILER.pack(len(footer)) + SEG_MAGIC)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return Segment(path, cache)
+
+
+class LookupStats:
+    """Counters for point lookups that reach segment files (see DurableKV.lookup_stats)."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lookups = 0           # get() calls that had to consult segments
+        self.segment_probes = 0    # segments whose key range covered the key
+        self.bloom_negatives = 0   # probes the filter rejected without I/O
+        self.false_positives = 0   # filter said maybe, block did not hold the key
+        self.blocks_read = 0
+        self.bytes_read = 0
+
+    def record(self, trace):
+        with self._lock:
+            self.lookups += 1
+            self.segment_probes += trace[0]
+            self.bloom_negatives += trace[1]
+            self.false_positives += trace[2]
+            self.blocks_read += trace[3]
+            self.bytes_read += trace[4]
+
+    def snapshot(self):
+        with self._lock:
+            negatives = self.false_positives + self.bloom_negatives
+            return {
+                "lookups": self.lookups,
+                "segment_probes": self.segment_probes,
+                "bloom_negatives": self.bloom_negatives,
+                "false_positives": self.false_positives,
+                "false_positive_rate": self.false_positives / negatives if negatives else 0.0,
+                "blocks_read": self.blocks_read,
+                "bytes_read": self.bytes_read,
+                "bytes_per_lookup": self.bytes_read / self.lookups if self.lookups else 0.0,
+            }
+
+
+class BlockCache:
+    """
+    Byte-budgeted, thread-safe cache of segment blocks using 2Q eviction (Johnson &
+    Shasha): a block seen once sits in a FIFO (a1in, about a quarter of the budget); if it
+    is requested again after falling out of the FIFO (its key is still remembered in the
+    a1out ghost list) it is promoted to an LRU (am). One-off reads such as scans only
+    churn the FIFO, so they cannot flush the hot set out of am.
+    Keys are (file_id, block_no); invalidate(file_id) drops a replaced file's blocks.
+    """
+    def __init__(self, capacity_bytes, in_fraction=0.25, out_fraction=0.5):
+        self.capacity = capacity_bytes
+        self._in_limit = int(capacity_bytes * in_fraction)
+        self._out_limit = int(capacity_bytes * out_fraction)
+        self._lock = threading.Lock()
+        self._a1in = collections.OrderedDict()   # key -> block, FIFO
+        self._am = collections.OrderedDict()     # key -> block, LRU (most recent last)
+        self._a1out = collections.OrderedDict()  # key -> block size, ghost FIFO (no data)
+        self._in_bytes = self._am_bytes = self._out_bytes = 0
+        self.hits = self.misses = self.evictions = self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            block = self._am.get(key)
+            if block is not None:
+                self._am.move_to_end(key)
+                self.hits += 1
+                return block
+            block = self._a1in.get(key)
+            if block is not None:
+                self.hits += 1  # 2Q leaves a1in order alone on a hit
+                return block
+            self.misses += 1
+            return None
+
+    def put(self, key, block):
+        size = len(block)
+        if size > self.capacity:
+            return
+        with self._lock:
+            if key in self._am or key in self._a1in:
+                return
+            if key in self._a1out:
+                self._out_bytes -= self._a1out.pop(key)
+                self._am[key] = block
+                self._am_bytes += size
+            else:
+                self._a1in[key] = block
+                self._in_bytes += size
+            while self._in_bytes + self._am_bytes > self.capacity:
+                if self._a1in and (self._in_bytes > self._in_limit or not self._am):
+                    old_key, old = self._a1in.popitem(last=False)
+                    self._in_bytes -= len(old)
+                    self._a1out[old_key] = len(old)
+                    self._out_bytes += len(old)
+                    while self._out_bytes > self._out_limit:
+                        self._out_bytes -= self._a1out.popitem(last=False)[1]
+                else:
+                    _, old = self._am.popitem(last=False)
+                    self._am_bytes -= len(old)
+                self.evictions += 1
+
+    def invalidate(self, file_id):
+        """Forget every block (and ghost entry) of file_id."""
+        with self._lock:
+            for queue in (self._a1in, self._am, self._a1out):
+                stale = [k for k in queue if k[0] == file_id]
+                for k in stale:
+                    entry = queue.pop(k)
+                    n = entry if queue is self._a1out else len(entry)
+                    if queue is self._a1in:
+                        self._in_bytes -= n
+                    elif queue is self._am:
+                        self._am_bytes -= n
+                    else:
+                        self._out_bytes -= n
+                if queue is not self._a1out:
+                    self.invalidations += len(stale)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses,
+                    "hit_rate": self.hits / lookups if lookups else 0.0,
+                    "evictions": self.evictions, "invalidations": self.invalidations,
+                    "bytes": self._in_bytes + self._am_bytes, "capacity": self.capacity,
+                    "blocks": len(self._a1in) + len(self._am)}
+
+
+_segment_ids = itertools.count(1)  # cache identity of a Segment, never reused
+
+
+class Segment:
+    """
+    Read side of a segment file: range check, bloom filter, sparse index, block reads.
+    Blocks go through cache (a BlockCache) when one is given.
+    """
+    def __init__(self, path, cache=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.cache = cache
+        self.cache_id = next(_segment_ids)
+        self._fd = os.open(path, os.O_RDONLY)
+        size = os.fstat(self._fd).st_size
+        trailer = _SNAP_TRAILER.size + len(SEG_MAGIC)
+        tail = os.pread(self._fd, trailer, size - trailer)
+        if tail[_SNAP_TRAILER.size:] != SEG_MAGIC:
+            os.close(self._fd)
+            raise ValueError(f"segment {path} has no footer")
+        (footer_len,) = _SNAP_TRAILER.unpack_from(tail)
+        self.data_end = size - trailer - footer_len
+        footer = memoryview(os.pread(self._fd, footer_len, self.data_end))
+        self.min_key, pos = _decode_value(footer, 0)
+        self.max_key, pos = _decode_value(footer, pos)
+        self.meta, pos = _decode_value(footer, pos)
+        index_blob, pos = _decode_value(footer, pos)
+        bloom_bits, _ = _decode_value(footer, pos)
+        self.count = self.meta["count"]
+        self.size = size
+        self.bloom = BloomFilter(self.meta["bloom_bits"], self.meta["bloom_hashes"], bytearray(bloom_bits))
+        # sparse index, kept in memory: first key of each block and where the block lives
+        self.block_keys, self.block_offsets, self.block_lengths = [], [], []
+        mv, pos = memoryview(index_blob), 0
+        while pos < len(mv):
+            k, pos = _decode_value(mv, pos)
+            off, n = _INDEX_ENTRY.unpack_from(mv, pos)
+            pos += _INDEX_ENTRY.size
+            self.block_keys.append(k)
+            self.block_offsets.append(off)
+            self.block_lengths.append(n)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __del__(self):
+        # readers may still hold the object after compaction retired the file, so the
+        # descriptor lives until the last reference goes away
+        try:
+            self.close()
+        except OSError:
+            pass
+
+    def get(self, key, trace=None):
+        """
+        Return the stored value (possibly TOMBSTONE) or _MISSING. If given, trace is a
+        5-item list [probes, bloom_negatives, false_positives, blocks_read, bytes_read]
+        that is incremented in place.
+        """
+        if self.count == 0 or key < self.min_key or key > self.max_key:
+            return _MISSING
+        if trace is not None:
+            trace[0] += 1
+        if not self.bloom.may_contain(_key_bytes(key)):
+            if trace is not None:
+                trace[1] += 1
+            return _MISSING
+        b = bisect.bisect_right(self.block_keys, key) - 1
+        block, from_disk = self._block(b)
+        if trace is not None and from_disk:
+            trace[3] += 1
+            trace[4] += len(block)
+        for k, v in self._iter_block(block, b):
+            if k == key:
+                return v
+            if k > key:
+                break
+        if trace is not None:
+            trace[2] += 1
+        return _MISSING
+
+    def _read_block(self, b):
+        return os.pread(self._fd, self.block_lengths[b], self.block_offsets[b])
+
+    def _block(self, b, fill=True):
+        """Block b through the cache. Returns (block, read_from_disk)."""
+        if self.cache is None:
+            return self._read_block(b), True
+        key = (self.cache_id, b)
+        block = self.cache.get(key)
+        if block is not None:
+            return block, False
+        block = self._read_block(b)
+        if fill:
+            self.cache.put(key, block)
+        return block, True
+
+    def _iter_block(self, block, b):
+        mv = memoryview(block)
+        pos = 0
+        while pos < len(mv):
+            length, crc = _REC_HEADER.unpack_from(mv, pos)
+            body = mv[pos + _REC_HEADER.size:pos + _REC_HEADER.size + length]
+            if zlib.crc32(body) != crc:
+                raise ValueError(f"segment {self.path}: corrupt record in block {b}")
+            k, p = _decode_value(body, 0)
+            v, _ = _decode_value(body, p)
+            yield k, v
+            pos += _REC_HEADER.size + length
+
+    def items(self):
+        """Yield (key, value) in key order, tombstones included. Bypasses the cache."""
+        for b in range(len(self.block_offsets)):
+            yield from self._iter_block(self._read_block(b), b)
+
+    def iter_range(self, start=None, end=None):
+        """Yield (key, value) with start <= key < end, seeking to the first block via the index."""
+        if self.count == 0:
+            return
+        b = 0 if start is None else max(bisect.bisect_right(self.block_keys, start) - 1, 0)
+        for b in range(b, len(self.block_offsets)):
+            for k, v in self._iter_block(self._block(b)[0], b):
+                if start is not None and k < start:
+                    continue
+                if end is not None and k >= end:
+                    return
+                yield k, v
+
+
+def _merge_newest_wins(runs):
+    """
+    Merge sorted (key, value) iterators, runs[0] being the newest. For each key only the
+    newest value is yielded.
+    """
+    tagged = [((k, rank, v) for k, v in run) for rank, run in enumerate(runs)]
+    last = _MISSING
+    for k, _, v in heapq.merge(*tagged, key=lambda t: (t[0], t[1])):
+        if k == last:
+            continue
+        last = k
+        yield k, v
+
+
+_SCAN_BATCH = 64  # keys examined per shard-lock acquisition during scans
+
+
+def _prefix_end(p):
+    """Smallest key greater than every key starting with p (None if unbounded)."""
+    while p:
+        last = p[-1]
+        if isinstance(p, str):
+            if ord(last) < 0x10FFFF:
+                return p[:-1] + chr(ord(last) + 1)
+        elif last < 0xFF:
+            return p[:-1] + bytes([last + 1])
+        p = p[:-1]
+    return None
+
+
+def _keys_in_range(keys, start, end):
+    """Sorted copy of the keys with start <= key < end (None means unbounded)."""
+    if start is None and end is None:
+        return sorted(keys)
+    return sorted(k for k in keys if (start is None or k >= start) and (end is None or k < end))
+
+
+def _approx_size(key, value):
+    """Rough in-memory footprint of one memtable entry, used for the flush threshold."""
+    n = len(key) if isinstance(key, (str, bytes)) else 16
+    n += len(value) if isinstance(value, (str, bytes, bytearray)) else 16
+    return n + 64  # dict slot and object headers
+
+
+def stable_hash(key):
+    """
+    Process-independent key hash (CRC-32 of the key's bytes). Unlike hash(), it does not
+    change between runs, so it can decide which on-disk partition a key belongs to.
+    """
+    return zlib.crc32(_key_bytes(key))
+
+
+def _fsync_dir(dirpath):
+    """Make renames/creates/deletes in dirpath durable (no-op where directories can't be opened)."""
+    try:
+        fd = os.open(dirpath, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
 # ---------- WAL Manager ----------
+_fdatasync = getattr(os, "fdatasync", os.fsync)  # macOS has no fdatasync
+DURABILITY_MODES = ("always", "interval", "bytes", "fdatasync")
+_SYNC_MODES = ("always", "fdatasync")
+
+
 class WALManager:
     """
     Manage append-only WAL file rotation.
     WAL files named: wal_{seq}.log (seq is integer).
     Each WAL line: JSON { "seq": <wal_seq>, "entry_id": <monotonic entry id>, "op": "PUT"/"DEL", "key": <k>, "value": <v or null> }
+    With record_format="binary" the same fields are written as CRC-checked binary records
+    (see encode_binary_record); only newly opened files use the selected format.
+
+    With group_commit=True appends are not written by the caller. They are queued and a
+    single committer thread writes up to max_batch queued records with one write+fsync,
+    waiting at most max_linger seconds for a batch to fill. Every caller still returns
+    only after its own record is durable.
+
+    durability picks when the file is synced:
+      "always"    - fsync before every append (or group commit batch) returns.
+      "interval"  - appends return once written; a background flusher fsyncs every
+                    sync_interval_ms, so a crash loses at most that window.
+      "bytes"     - appends return once written; fsync whenever sync_bytes are unsynced.
+      "fdatasync" - like "always" but with fdatasync on segments preallocated to
+                    preallocate_bytes, so appends do not change the file size and the
+                    sync skips the inode metadata flush.
+    append(..., durability=mode) overrides the mode for one record: "always"/"fdatasync"
+    sync before returning, "interval"/"bytes" return once written and are synced by the
+    WAL's own policy (or the next synced append, rotate or close). durability_lag()
+    reports how much acknowledged data is not yet on disk.
+
+    segment_bytes rotates to the next wal_{seq+1}.log once the current file holds that
+    many bytes; segments are then preallocated to segment_bytes unless preallocate_bytes
+    says otherwise. retire(seq) deletes the segments a snapshot has made redundant.
+    Because rotation can happen between a caller's append and its apply to memory, the
+    caller reports applied(wal_seq) once the record is in memory, and snapshot_fence()
+    never moves past the oldest segment still holding an unapplied record.
+
+    compression (binary records only: "zlib", "lzma", "bz2" or "zlib-dict") compresses
+    each record's value, or a batch's whole op list, when that makes it smaller. In
+    "zlib-dict" mode the first zdict_samples values are compressed with plain zlib and
+    used to train a dictionary, which is then written as a ZDICT record at the head of
+    every WAL file.
     """
-    def __init__(self, dirpath):
+    def __init__(self, dirpath, group_commit=False, max_batch=256, max_linger=0.002,
+                 record_format="json", durability="always", sync_interval_ms=100,
+                 sync_bytes=1 << 20, preallocate_bytes=None, segment_bytes=None,
+                 compression=None, zdict_samples=64):
+        if record_format not in ("json", "binary"):
+            raise ValueError(f"unknown WAL record format: {record_format!r}")
+        if compression is not None and compression not in COMPRESSION_CODECS:
+            raise ValueError(f"unknown compression codec: {compression!r}")
+        if compression is not None and record_format != "binary":
+            raise ValueError("WAL compression requires record_format='binary'")
+        if durability not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability mode: {durability!r}")
         os.makedirs(dirpath, exist_ok=True)
         self.dirpath = dirpath
+        self.record_format = record_format
+        # ---- durability policy ----
+        self.durability = durability
+        self.sync_interval = sync_interval_ms / 1000.0
+        self.sync_bytes = sync_bytes
+        self.segment_bytes = segment_bytes
+        if preallocate_bytes is None:
+            if segment_bytes:
+                preallocate_bytes = segment_bytes
+            else:
+                preallocate_bytes = 64 << 20 if durability == "fdatasync" else 0
+        self.preallocate_bytes = preallocate_bytes
+        self._sync_fn = _fdatasync if durability == "fdatasync" else os.fsync
+        self.compression = compression
+        self.zdict_samples = zdict_samples
+        self._zdict = None              # trained dictionary ("zlib-dict")
+        self._samples = []              # values collected for training
+        self._write_offset = 0          # end of written data in the current file
+        self._unsynced_bytes = 0        # written but not yet synced (under _meta_lock)
+        self._oldest_unsynced = None    # monotonic time of the oldest unsynced write
+        self._unsynced_ticket = 0       # last ticket written to the file
         self._meta_lock = threading.Lock()    # protects rotation and current wal handle
         self._append_lock = threading.Lock()  # serialize appends so they are ordered in file
+        self._unapplied = collections.Counter()  # wal seq -> records appended but not yet applied
+        self._unapplied_lock = threading.Lock()
         self.current_seq = self._discover_latest_seq()
-        self.wal_file = open(self._wal_path(self.current_seq), "a+b")
+        self.wal_file = self._open_wal(self.current_seq)
         self.entry_counter = 0
+        # ---- group commit state ----
+        self.group_commit = group_commit
+        self.max_batch = max_batch
+        self.max_linger = max_linger
+        self._pending = []                                   # encoded records not yet written
+        self._pending_ready = threading.Condition(self._append_lock)
+        self._durable = threading.Condition()                # waiters for their ticket
+        self._next_ticket = 0                                # ticket of the last queued record
+        self._written_ticket = 0                             # every ticket <= this is in the file
+        self._durable_ticket = 0                             # every ticket <= this is synced
+        self._sync_wanted = 0                                # last ticket whose writer waits for sync
+        self._commit_error = None                            # sticky: a failed fsync poisons the log
+        self._closed = False
+        self._committer = None
+        if group_commit:
+            self._committer = threading.Thread(target=self._commit_loop, daemon=True)
+            self._committer.start()
+        self._stop_flusher = threading.Event()
+        self._flusher = None
+        if durability == "interval":
+            self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self._flusher.start()
 
     def _wal_path(self, seq):
         return os.path.join(self.dirpath, f"wal_{seq}.log")
 
+    def _open_wal(self, seq):
+        path = self._wal_path(seq)
+        f = open(path, "a+b")
+        if self.record_format == "binary" and f.tell() == 0:
+            f.write(WAL_MAGIC)
+            if self._zdict is not None:
+                f.write(encode_binary_record(seq, 0, "ZDICT", None, self._zdict))
+            f.flush()
+        offset = f.tell()
+        if self.preallocate_bytes and hasattr(os, "posix_fallocate"):
+            # O_APPEND would write after the preallocated zeros: switch to positioned writes.
+            # Readers treat the zero tail as end of log; close/rotate trim it.
+            f.close()
+            f = open(path, "r+b")
+            os.posix_fallocate(f.fileno(), offset, self.preallocate_bytes)
+            os.fsync(f.fileno())  # persist the new size once, later syncs are data-only
+            f.seek(offset)
+        self._write_offset = offset
+        return f
+
+    def _close_wal_locked(self):
+        # caller holds _meta_lock
+        if self.preallocate_bytes:
+            self.wal_file.truncate(self._write_offset)
+        self.wal_file.flush()
+        os.fsync(self.wal_file.fileno())
+        self.wal_file.close()
+        self._unsynced_bytes = 0
+        self._oldest_unsynced = None
+
     def _discover_latest_seq(self):
         # find largest wal_N.log; if none, start at 1
         files = os.listdir(self.dirpath)
@@ -69,43 +1328,242 @@ class WALManager:
                 for fname in files if fname.startswith("wal_") and fname.endswith(".log")]
         return max(seqs) + 1 if seqs else 1
 
-    def append(self, op, key, value):
+    def append(self, op, key, value, durability=None):
         """
-        Append a WAL entry and ensure it's flushed to disk (fsync).
-        Returns a (wal_seq, entry_id) tuple.
+        Append a WAL entry and ensure it's flushed to disk (fsync) as the durability
+        mode requires. Returns a (wal_seq, entry_id) tuple; the caller must call
+        applied(wal_seq) once the entry is applied to memory.
         """
+        mode = durability or self.durability
+        if mode not in DURABILITY_MODES:
+            raise ValueError(f"unknown durability mode: {mode!r}")
         with self._append_lock:
+            if self._commit_error is not None or self._closed:
+                raise OSError("WAL is not accepting appends") from self._commit_error
+            if self.segment_bytes and self._write_offset >= self.segment_bytes:
+                # size-based rotation (queued group commit records are not counted yet)
+                self._rotate_locked(self.current_seq + 1)
             self.entry_counter += 1
-            entry = {
-                "wal_seq": self.current_seq,
-                "entry_id": self.entry_counter,
-                "op": op,
-                "key": key,
-                "value": value
-            }
-            line = (json.dumps(entry) + "\n").encode("utf-8")
+            if self.record_format == "binary":
+                line = encode_binary_record(self.current_seq, self.entry_counter, op, key, value,
+                                            self.compression, self._zdict)
+                if self.compression == "zlib-dict" and self._zdict is None:
+                    line = self._train_locked(op, value) + line
+            else:
+                entry = {
+                    "wal_seq": self.current_seq,
+                    "entry_id": self.entry_counter,
+                    "op": op,
+                    "key": key,
+                    "value": value
+                }
+                line = (json.dumps(entry) + "\n").encode("utf-8")
+            result = (self.current_seq, self.entry_counter)
+            self._next_ticket += 1
+            ticket = self._next_ticket
+            if mode in _SYNC_MODES:
+                self._sync_wanted = ticket
+            if not self.group_commit:
+                with self._meta_lock:
+                    self._write_locked([line], ticket)
+                    durable = self._sync_locked() if self._needs_sync() else None
+                self._mark(ticket, durable)
+                self._pin(self.current_seq)
+                return result
+            # ids are assigned and queued under the same lock, so queue order == file order
+            self._pending.append(line)
+            self._pending_ready.notify()
+            self._pin(self.current_seq)  # before releasing the lock: rotation may follow
+        try:
+            self._wait(ticket, durable=mode in _SYNC_MODES)
+        except BaseException:
+            self.applied(result[0])
+            raise
+        return result
+
+    def _pin(self, seq):
+        with self._unapplied_lock:
+            self._unapplied[seq] += 1
+
+    def applied(self, wal_seq):
+        """The record append() returned wal_seq for is now applied to memory."""
+        with self._unapplied_lock:
+            self._unapplied[wal_seq] -= 1
+            if not self._unapplied[wal_seq]:
+                del self._unapplied[wal_seq]
+
+    def snapshot_fence(self):
+        """
+        Oldest WAL seq a snapshot of the current memory state must replay from: the
+        current segment, or an older one still holding a record that is appended but
+        not applied yet (its writer has not reached the shard lock). Call it while
+        holding the write locks of every shard this WAL logs for.
+        """
+        with self._append_lock, self._unapplied_lock:
+            return min(self._unapplied, default=self.current_seq)
+
+    def _train_locked(self, op, value):
+        """Collect a training sample; once there are enough, return the ZDICT record to log."""
+        # caller holds _append_lock
+        self._samples.append(_encode_batch(value) if op == "BATCH" else _encode_value(value))
+        if len(self._samples) < self.zdict_samples:
+            return b""
+        self._zdict = train_zdict(self._samples)
+        self._samples = []
+        register_zdict(self._zdict)
+        # records after this one in the file may use the dictionary
+        return encode_binary_record(self.current_seq, 0, "ZDICT", None, self._zdict)
+
+    # ---------- write / sync accounting ----------
+    def _write_locked(self, lines, last_ticket):
+        # caller holds _meta_lock
+        data = b"".join(lines)
+        self.wal_file.write(data)
+        self.wal_file.flush()
+        self._write_offset += len(data)
+        self._unsynced_bytes += len(data)
+        if self._oldest_unsynced is None:
+            self._oldest_unsynced = time.monotonic()
+        self._unsynced_ticket = last_ticket
+
+    def _needs_sync(self):
+        # caller holds _meta_lock: some writer waits for durability, or the byte budget is spent
+        if self._sync_wanted > self._durable_ticket:
+            return True
+        return self.durability == "bytes" and self._unsynced_bytes >= self.sync_bytes
+
+    def _sync_locked(self):
+        """Sync the current file (caller holds _meta_lock). Returns the ticket now durable."""
+        if self._unsynced_bytes:
+            self._sync_fn(self.wal_file.fileno())
+            self._unsynced_bytes = 0
+            self._oldest_unsynced = None
+        return self._unsynced_ticket
+
+    def _flush_loop(self):
+        """Background flusher for durability="interval"."""
+        while not self._stop_flusher.wait(self.sync_interval):
+            error, durable = None, None
             with self._meta_lock:
-                self.wal_file.write(line)
-                self.wal_file.flush()
-                os.fsync(self.wal_file.fileno())
-            return (self.current_seq, self.entry_counter)
+                try:
+                    durable = self._sync_locked()
+                except Exception as e:
+                    error = e
+            self._mark(None, durable, error)
+
+    def durability_lag(self):
+        """
+        How far the disk is behind acknowledged writes: unsynced bytes and records, and
+        the age in seconds of the oldest write that is not yet synced.
+        """
+        with self._meta_lock:
+            oldest = self._oldest_unsynced
+            lag = time.monotonic() - oldest if oldest is not None else 0.0
+            unsynced_bytes = self._unsynced_bytes
+        with self._durable:
+            unsynced_records = self._written_ticket - self._durable_ticket
+        return {"unsynced_bytes": unsynced_bytes, "unsynced_records": unsynced_records,
+                "lag_seconds": lag}
+
+    # ---------- group commit ----------
+    def _commit_loop(self):
+        """
+        Committer thread: take a batch off the queue, write it with one write(+fsync),
+        then release every caller whose record was in the batch.
+        """
+        while True:
+            with self._append_lock:
+                while not self._pending and not self._closed:
+                    self._pending_ready.wait()
+                if not self._pending:
+                    return  # closed and drained
+                # linger a little so concurrent writers can join this batch
+                deadline = time.monotonic() + self.max_linger
+                while len(self._pending) < self.max_batch and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._pending_ready.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+                last_ticket = self._next_ticket - len(self._pending)
+                # hand-over-hand: take the file lock before letting the next batch be cut,
+                # so batches reach the file in the order they were queued
+                self._meta_lock.acquire()
+            error, written, durable = None, None, None
+            try:
+                if batch:
+                    self._write_locked(batch, last_ticket)
+                    written = last_ticket
+                    if self._needs_sync():
+                        durable = self._sync_locked()
+            except Exception as e:
+                error = e
+            finally:
+                self._meta_lock.release()
+            self._mark(written, durable, error)
+
+    def _mark(self, written, durable, error=None):
+        with self._durable:
+            if error is not None and self._commit_error is None:
+                self._commit_error = error
+            if written is not None and written > self._written_ticket:
+                self._written_ticket = written
+            if durable is not None and durable > self._durable_ticket:
+                self._durable_ticket = durable
+            self._durable.notify_all()
+
+    def _wait(self, ticket, durable):
+        with self._durable:
+            while self._commit_error is None:
+                reached = self._durable_ticket if durable else self._written_ticket
+                if reached >= ticket:
+                    return
+                self._durable.wait()
+            raise OSError("WAL group commit failed") from self._commit_error
 
     def rotate(self, new_seq=None):
         """
         Rotate WAL: close current file and open a new one with higher sequence.
         Caller must ensure snapshot coordination.
         """
-        with self._meta_lock:
-            self.wal_file.flush()
-            os.fsync(self.wal_file.fileno())
-            self.wal_file.close()
+        with self._append_lock:
             if new_seq is None:
                 new_seq = self.current_seq + 1
+            return self._rotate_locked(new_seq)
+
+    def _rotate_locked(self, new_seq):
+        # caller holds _append_lock
+        with self._meta_lock:
+            # records already stamped with current_seq must land in the current file
+            last_ticket = self._next_ticket
+            if self._pending:
+                self._write_locked(self._pending, last_ticket)
+                self._pending.clear()
+            self._close_wal_locked()
             self.current_seq = new_seq
-            self.wal_file = open(self._wal_path(self.current_seq), "a+b")
+            self.wal_file = self._open_wal(self.current_seq)
             # reset entry counter for readability (optional)
             self.entry_counter = 0
-            return self.current_seq
+        self._mark(last_ticket, last_ticket)
+        return new_seq
+
+    def retire(self, below_seq):
+        """
+        Delete WAL segments with seq < below_seq (never the open one). The caller must
+        have made their contents durable elsewhere, e.g. in a snapshot. Returns the
+        number of files removed.
+        """
+        removed = 0
+        for seq in self.list_wal_seqs():
+            if seq >= below_seq or seq >= self.current_seq:
+                break
+            try:
+                os.remove(self._wal_path(seq))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
 
     def list_wal_seqs(self):
         files = os.listdir(self.dirpath)
@@ -114,111 +1572,1190 @@ class WALManager:
         return seqs
 
     def close(self):
+        if self._committer is not None:
+            with self._append_lock:
+                self._closed = True
+                self._pending_ready.notify_all()
+            self._committer.join()
+        if self._flusher is not None:
+            self._stop_flusher.set()
+            self._flusher.join()
         with self._meta_lock:
             try:
-                self.wal_file.flush()
-                os.fsync(self.wal_file.fileno())
-                self.wal_file.close()
+                self._close_wal_locked()
             except:
                 pass
+        with self._append_lock:
+            self._closed = True
+        self._mark(self._unsynced_ticket, self._unsynced_ticket)
 
 # ---------- KV Store ----------
+LAYOUT_FILE = "layout.json"
+
+
+MANIFEST_FILE = "MANIFEST.json"
+
+
+class _Partition:
+    """A directory with its own WAL and snapshot files, owning some shard indexes."""
+    def __init__(self, dirpath, shard_ids, wal_kwargs, vlog_file_bytes=None):
+        self.dirpath = dirpath
+        self.shard_ids = shard_ids
+        self.wal = WALManager(dirpath, **wal_kwargs)
+        self.vlog = ValueLog(dirpath, vlog_file_bytes) if vlog_file_bytes else None
+        # ---- LSM engine bookkeeping ----
+        self.manifest_lock = threading.Lock()  # serializes segment list changes + MANIFEST writes
+        self.wal_fence = 1                     # WALs below this are fully flushed to segments
+        self.next_segment_id = 1
+        self.flush_scheduled = False
+
+
+_VERSION_GC_KEYS = 128  # keys with old versions per shard that schedule a gc_versions() pass
+
+
+def _version_seq(version):
+    return version[0]
+
+
+class ReadView:
+    """
+    Point-in-time view of a DurableKV opened with mvcc=True (see DurableKV.read_view).
+    Reads take no lock and see exactly the writes (and whole batches) committed at or
+    before self.seq. Close the view (or use it as a context manager) so the versions it
+    pins can be garbage collected.
+    """
+    def __init__(self, kv, seq):
+        self._kv = kv
+        self.seq = seq
+        self.closed = False
+
+    def get(self, key, default=None):
+        kv = self._kv
+        idx = kv._shard_index(key)
+        value = kv._version_at(idx, key, self.seq)
+        return default if value is _MISSING or value is TOMBSTONE else kv._resolve(idx, value)
+
+    def scan(self, start=None, end=None, limit=None):
+        """Yield (key, value) with start <= key < end in key order, as of self.seq."""
+        kv = self._kv
+        n = 0
+        keys = []
+        for versions in kv._versions:
+            keys.extend(k for k in list(versions)
+                        if (start is None or k >= start) and (end is None or k < end))
+        for k in sorted(keys):
+            if limit is not None and n >= limit:
+                return
+            idx = kv._shard_index(k)
+            value = kv._version_at(idx, k, self.seq)
+            if value is not _MISSING and value is not TOMBSTONE:
+                n += 1
+                yield k, kv._resolve(idx, value)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self._kv._release_view(self.seq)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
 class DurableKV:
-    def __init__(self, data_dir, n_shards=16):
+    def __init__(self, data_dir, n_shards=16, group_commit=False, max_batch=256, max_linger=0.002,
+                 wal_format="json", snapshot_format="json", snapshot_chunk_bytes=1 << 20,
+                 partitioned=False, engine="hash", memtable_bytes=4 << 20, compaction_trigger=4,
+                 segment_block_bytes=4096, bloom_bits_per_key=10, ordered_index=False,
+                 durability="always", sync_interval_ms=100, sync_bytes=1 << 20,
+                 preallocate_bytes=None, wal_segment_bytes=None, retire_wals=True,
+                 lock_policy="writer", mvcc=False, value_log_threshold=None,
+                 value_log_file_bytes=64 << 20, value_log_gc_ratio=0.5,
+                 block_cache_bytes=8 << 20, wal_compression=None, snapshot_compression=None):
+        """
+        partitioned=True gives every shard its own directory shard_NNN/ with a private WAL
+        and snapshot files, so appends, fsyncs, snapshots and recovery proceed per shard.
+        Keys are placed with stable_hash(), and the shard count is recorded in layout.json
+        because it can no longer change once data is on disk.
+
+        engine="lsm" turns the shard dicts into memtables: once a shard holds about
+        memtable_bytes, the partition's memtables are frozen and flushed to immutable
+        sorted segment files (seg_SSS_NNNNNN.sst) listed in MANIFEST.json, and the WALs
+        they cover are no longer replayed. get() checks the memtable, then frozen
+        memtables still being flushed, then segments newest to oldest. When a shard has
+        compaction_trigger segments a background compaction merges them into one and drops
+        tombstones. snapshot() on an LSM store is a flush.
+        Segments carry a bloom filter (bloom_bits_per_key) and a sparse index over blocks
+        of segment_block_bytes, so a miss usually reads nothing and a hit reads one block;
+        lookup_stats() reports the filter's false-positive rate and bytes read per lookup.
+        Segment blocks are cached in one BlockCache of block_cache_bytes (2Q eviction,
+        shared by all shards; 0 disables it). Compaction invalidates the blocks of the
+        files it replaces; block_cache_stats() exports hits, misses and evictions.
+
+        wal_compression (binary WAL) compresses each record's value and
+        snapshot_compression (chunked snapshots) each chunk, with "zlib", "lzma", "bz2" or
+        "zlib-dict" (zlib primed with a dictionary trained on sample values, for many
+        small similar values). Readers detect compression per record / per file, so
+        recover() handles any mix of compressed and plain files.
+
+        ordered_index=True keeps a sorted key list next to every shard dict so scan() and
+        prefix() can walk keys in order without sorting; it makes inserting a new key
+        O(shard size) (a list memmove) instead of O(1). Without it every scan()/prefix()
+        call copies and sorts each shard's keys in the range, O(N log N) per call however
+        small limit is, so turn it on for stores that are paged through with scan().
+
+        durability, sync_interval_ms, sync_bytes and preallocate_bytes set the WAL sync
+        policy (see WALManager); put/delete/write_batch take a durability= override for a
+        single write, and durability_lag() reports unsynced data across all WALs.
+
+        wal_segment_bytes rotates (and preallocates) WAL segments by size between
+        snapshots. With retire_wals=True, once a snapshot (LSM: a MANIFEST fence) is
+        durable, a background thread deletes the WAL segments and older snapshots it
+        supersedes, so disk usage and replay work stay bounded.
+
+        lock_policy picks the shard lock: "writer" (WriterPreferringRWLock, the default),
+        "fair" (the same lock in FIFO mode) or "reader" (the original reader-preferring
+        RWLock). lock_stats() reports per-shard contention for the first two.
+
+        mvcc=True (hash engine only) also keeps, per key, a chain of immutable
+        (commit_seq, value) versions. Every put/delete/batch gets one commit seq, and a
+        seq becomes visible only once all earlier ones are applied, so read_view() pins
+        a consistent point in time that never shows part of a batch, and get() reads
+        the latest visible version without taking the shard lock. Versions hidden from
+        every open view are dropped as keys are rewritten and by gc_versions(), which
+        runs in the background when the oldest view closes, and, while no view is open,
+        whenever a shard has _VERSION_GC_KEYS keys with old versions (so deleted keys
+        do not linger); version_stats() reports the memory they cost.
+
+        value_log_threshold=N (hash engine only) turns on key-value separation: str/bytes
+        values of N or more bytes are appended once to a value log (vlog_NNNNNN.dat, a new
+        file every value_log_file_bytes) and the WAL, the shard dicts and snapshots only
+        hold a ValuePointer(file, offset, length); reads decode the value through mmap.
+        The value log is synced before the WAL record when the write's durability mode
+        syncs; with relaxed modes a crash can lose both. When a sealed file's garbage
+        share reaches value_log_gc_ratio a background gc_value_log() copies its live
+        values forward (logged as VMOVE records); the file itself is deleted once a
+        later snapshot no longer refers to it (with retire_wals=True).
+        """
+        if engine not in ("hash", "lsm"):
+            raise ValueError(f"unknown engine: {engine!r}")
+        if value_log_threshold is not None and engine != "hash":
+            raise ValueError("value_log_threshold requires engine='hash'")
+        if mvcc and engine != "hash":
+            raise ValueError("mvcc requires engine='hash'")
+        if lock_policy not in ("reader", "writer", "fair"):
+            raise ValueError(f"unknown lock policy: {lock_policy!r}")
+        if snapshot_format not in ("json", "chunked"):
+            raise ValueError(f"unknown snapshot format: {snapshot_format!r}")
+        if snapshot_compression is not None and snapshot_format != "chunked":
+            raise ValueError("snapshot compression requires snapshot_format='chunked'")
         self.data_dir = data_dir
+        self.snapshot_format = snapshot_format
+        self.snapshot_chunk_bytes = snapshot_chunk_bytes
+        self.snapshot_compression = snapshot_compression
         os.makedirs(data_dir, exist_ok=True)
         self.n_shards = n_shards
+        self.partitioned = partitioned
+        self.engine = engine
+        self._lsm = engine == "lsm"
+        self.memtable_bytes = memtable_bytes
+        self.compaction_trigger = compaction_trigger
+        self.segment_block_bytes = segment_block_bytes
+        self.bloom_bits_per_key = bloom_bits_per_key
+        self._lookup_stats = LookupStats()
+        self.block_cache = BlockCache(block_cache_bytes) if block_cache_bytes else None
+        self.ordered_index = ordered_index
+        self._check_layout()
         self.shards = [dict() for _ in range(n_shards)]
-        self.shard_locks = [RWLock() for _ in range(n_shards)]
-        self.wal = WALManager(data_dir)
+        if lock_policy == "reader":
+            self.shard_locks = [RWLock() for _ in range(n_shards)]
+        else:
+            self.shard_locks = [WriterPreferringRWLock(fair=lock_policy == "fair")
+                                for _ in range(n_shards)]
+        # copy-on-write flags: a frozen shard dict belongs to an in-flight snapshot and the
+        # next writer must copy it before mutating (see _writable_shard)
+        self._frozen = [False] * n_shards
+        self._snapshot_lock = threading.Lock()  # one freeze/rotate at a time
+        self._snapshot_executor = None          # lazily created background snapshot thread
+        # LSM engine state (lists are replaced, never mutated, so readers can grab them)
+        self._immutables = [[] for _ in range(n_shards)]  # frozen memtables, newest first
+        self._segments = [[] for _ in range(n_shards)]    # Segment objects, newest first
+        self._mem_bytes = [0] * n_shards
+        self._sorted_keys = [[] for _ in range(n_shards)]  # with ordered_index: shard keys, sorted
+        self._flush_executor = None
+        self._compaction_executor = None
+        self.retire_wals = retire_wals
+        self._retire_executor = None
+        # MVCC state: per-shard {key: [(commit_seq, value), ...]} chains, oldest first.
+        # Chains are replaced, never mutated, so readers walk them without a lock.
+        self.mvcc = mvcc
+        self._versions = [dict() for _ in range(n_shards)]
+        self._history = [set() for _ in range(n_shards)]  # keys whose chain has > 1 version
+        self._mvcc_lock = threading.Lock()
+        self._last_seq = 0           # last commit seq handed out
+        self._visible_seq = 0        # every commit <= this is fully applied
+        self._inflight = set()       # commit seqs being applied
+        self._views = collections.Counter()  # pinned seq -> open views
+        self._gc_horizon = 0         # no open view reads below this seq
+        self._gc_executor = None     # background MVCC / value-log garbage collection
+        self._gc_lock = threading.Lock()
+        self.value_log_threshold = value_log_threshold
+        self.value_log_gc_ratio = value_log_gc_ratio
+        self._vlog_gc_scheduled = False
+        self._version_gc_scheduled = False
+        vlog_file_bytes = value_log_file_bytes if value_log_threshold is not None else None
+        wal_kwargs = dict(group_commit=group_commit, max_batch=max_batch,
+                          max_linger=max_linger, record_format=wal_format,
+                          durability=durability, sync_interval_ms=sync_interval_ms,
+                          sync_bytes=sync_bytes, preallocate_bytes=preallocate_bytes,
+                          segment_bytes=wal_segment_bytes, compression=wal_compression)
+        if partitioned:
+            self.partitions = [_Partition(os.path.join(data_dir, f"shard_{i:03d}"), [i], wal_kwargs,
+                                          vlog_file_bytes)
+                               for i in range(n_shards)]
+            self.wal = None
+        else:
+            self.partitions = [_Partition(data_dir, list(range(n_shards)), wal_kwargs, vlog_file_bytes)]
+            self.wal = self.partitions[0].wal
+        # WAL that logs writes for each shard index
+        self._shard_wals = [part.wal for part in self.partitions for _ in part.shard_ids]
+        self._shard_vlogs = [part.vlog for part in self.partitions for _ in part.shard_ids]
         self._key_lock = threading.Lock()  # protects helper operations if needed
+        self.torn_wal_files = []           # WAL files whose tail was torn, filled by recover()
+        self.last_recovery_stats = {}      # per-phase timings of the last recover()
+
+    def _check_layout(self):
+        path = os.path.join(self.data_dir, LAYOUT_FILE)
+        layout = {"partitioned": self.partitioned, "n_shards": self.n_shards, "hash": "crc32",
+                  "engine": self.engine}
+        if os.path.exists(path):
+            with open(path) as f:
+                existing = json.load(f)
+            if existing["partitioned"] != self.partitioned:
+                raise ValueError(f"{self.data_dir} was created with partitioned={existing['partitioned']}")
+            if self.partitioned and existing["n_shards"] != self.n_shards:
+                raise ValueError(f"{self.data_dir} is partitioned into {existing['n_shards']} shards")
+            if existing.get("engine", "hash") != self.engine:
+                raise ValueError(f"{self.data_dir} was created with engine={existing.get('engine', 'hash')!r}")
+            if self.engine == "lsm" and existing["n_shards"] != self.n_shards:
+                raise ValueError(f"{self.data_dir} stores segments for {existing['n_shards']} shards")
+            return
+        if (self.partitioned or self._lsm) and any(
+                f.startswith(("wal_", "snapshot_")) for f in os.listdir(self.data_dir)):
+            raise ValueError(f"{self.data_dir} holds data written without a layout file")
+        with open(path, "w") as f:
+            json.dump(layout, f)
+            f.flush()
+            os.fsync(f.fileno())
 
     def _shard_index(self, key):
-        return hash(key) % self.n_shards
+        return stable_hash(key) % self.n_shards
+
+    def _writable_shard(self, idx):
+        """Return shard idx ready for mutation. Caller holds the shard write lock."""
+        if self._frozen[idx]:
+            self.shards[idx] = dict(self.shards[idx])
+            self._frozen[idx] = False
+        return self.shards[idx]
 
     # ---------- public API ----------
     def get(self, key):
         idx = self._shard_index(key)
+        if self.mvcc:
+            value = self._version_at(idx, key, self._visible_seq)
+            return None if value is _MISSING or value is TOMBSTONE else self._resolve(idx, value)
         lock = self.shard_locks[idx]
         lock.acquire_read()
         try:
-            return self.shards[idx].get(key, None)
+            if not self._lsm:
+                value = self.shards[idx].get(key, None)
+            else:
+                value = self.shards[idx].get(key, _MISSING)
+                immutables = self._immutables[idx]
+                segments = self._segments[idx]
         finally:
             lock.release_read()
+        if not self._lsm:
+            return self._resolve(idx, value)  # value-log reads go through mmap, unlocked
+        # LSM: frozen memtables, then segments newest -> oldest (no lock held for file I/O)
+        for mem in immutables:
+            if value is not _MISSING:
+                break
+            value = mem.get(key, _MISSING)
+        if value is _MISSING and segments:
+            trace = [0, 0, 0, 0, 0]
+            for seg in segments:
+                value = seg.get(key, trace)
+                if value is not _MISSING:
+                    break
+            self._lookup_stats.record(trace)
+        return None if value is _MISSING or value is TOMBSTONE else value
 
-    def put(self, key, value):
+    def peek(self, key):
+        """
+        Memory-only get(): (True, value) when the answer is known without file I/O (value
+        None if absent), (False, None) when get() would have to read a segment or the
+        value log.
+        """
+        idx = self._shard_index(key)
+        if self.mvcc:
+            value = self._version_at(idx, key, self._visible_seq)
+        else:
+            lock = self.shard_locks[idx]
+            lock.acquire_read()
+            try:
+                value = self.shards[idx].get(key, _MISSING)
+                if self._lsm:
+                    immutables = self._immutables[idx]
+                    segments = self._segments[idx]
+            finally:
+                lock.release_read()
+            if self._lsm:
+                for mem in immutables:
+                    if value is not _MISSING:
+                        break
+                    value = mem.get(key, _MISSING)
+                if value is _MISSING and segments:
+                    return False, None
+        if isinstance(value, ValuePointer):
+            return False, None
+        return True, None if value is _MISSING or value is TOMBSTONE else value
+
+    def partition_index(self, key):
+        """Index into self.partitions of the partition (WAL) that logs key."""
+        return self._shard_index(key) if self.partitioned else 0
+
+    def put(self, key, value, durability=None):
         """
         Write path:
-        1. Append to WAL and fsync (to ensure durability).
+        1. Append to WAL and fsync (as the durability mode requires).
         2. Acquire shard write lock and apply to memory.
         """
+        idx = self._shard_index(key)
+        op, value = self._separate(idx, "PUT", value)
         # 1) append WAL (serialize append across writers)
-        wal_seq, entry_id = self.wal.append("PUT", key, value)
+        try:
+            if op == "VPUT":
+                self._sync_value_log(idx, durability)
+            wal_seq, entry_id = self._shard_wals[idx].append(op, key, value, durability)
+        except BaseException:
+            self._unseparate(idx, [value])
+            raise
         # 2) apply in-memory under shard lock (short critical section)
-        idx = self._shard_index(key)
         lock = self.shard_locks[idx]
         lock.acquire_write()
+        seq = self._begin_commit() if self.mvcc else None
         try:
-            self.shards[idx][key] = value
+            self._apply_locked(idx, "PUT", key, value, seq)
         finally:
             lock.release_write()
+            if seq is not None:
+                self._end_commit(seq)
+            self._shard_wals[idx].applied(wal_seq)
+        if self._lsm and self._mem_bytes[idx] >= self.memtable_bytes:
+            self._schedule_flush(idx)
         return (wal_seq, entry_id)
 
-    def delete(self, key):
-        wal_seq, entry_id = self.wal.append("DEL", key, None)
+    def delete(self, key, durability=None):
         idx = self._shard_index(key)
+        wal_seq, entry_id = self._shard_wals[idx].append("DEL", key, None, durability)
         lock = self.shard_locks[idx]
         lock.acquire_write()
+        seq = self._begin_commit() if self.mvcc else None
         try:
-            self.shards[idx].pop(key, None)
+            self._apply_locked(idx, "DEL", key, None, seq)
         finally:
             lock.release_write()
+            if seq is not None:
+                self._end_commit(seq)
+            self._shard_wals[idx].applied(wal_seq)
         return (wal_seq, entry_id)
 
-    # ---------- snapshot ----------
-    def snapshot(self):
+    def write_batch(self, ops, durability=None):
         """
-        Create a consistent snapshot:
-        - Acquire all shard write locks in a fixed order (to block writers briefly).
-        - Dump in-memory map to a temp file.
-        - fsync and atomically rename to snapshot_{seq}.snap (seq = current wal seq)
-        - Rotate the WAL after snapshot to start a new WAL file.
+        Atomically apply a list of ("PUT", key, value) / ("DEL", key) operations.
+        The batch is logged as ONE WAL record (one encode, one fsync) and applied with a
+        single write-lock acquisition per affected shard, taken in shard order; recovery
+        replays a batch all-or-nothing because its record is either intact or torn.
+        A partitioned store has one WAL per shard, so there a batch must stay inside a
+        single shard (ValueError otherwise).
+        Returns the (wal_seq, entry_id) of the batch record.
+        """
+        items = []
+        for item in ops:
+            op, key = item[0], item[1]
+            if op not in ("PUT", "DEL"):
+                raise ValueError(f"unknown batch op: {op!r}")
+            items.append((self._shard_index(key), op, key, item[2] if op == "PUT" else None))
+        if not items:
+            raise ValueError("empty write batch")
+        wals = {id(self._shard_wals[idx]): self._shard_wals[idx] for idx, _, _, _ in items}
+        if len(wals) > 1:
+            raise ValueError("a write batch cannot span partitions")
+        # validated: only now move large values to the value log
+        normalized = []
+        by_shard = {}
+        for idx, op, key, value in items:
+            log_op, value = self._separate(idx, op, value)
+            normalized.append((log_op, key, value))
+            by_shard.setdefault(idx, []).append((op, key, value))
+        wal = next(iter(wals.values()))
+        first = items[0][0]
+        try:
+            if any(op == "VPUT" for op, _, _ in normalized):
+                self._sync_value_log(first, durability)
+            wal_seq, entry_id = wal.append("BATCH", None, normalized, durability)
+        except BaseException:
+            self._unseparate(first, [value for _, _, value in normalized])
+            raise
+        shard_ids = sorted(by_shard)
+        for idx in shard_ids:
+            self.shard_locks[idx].acquire_write()
+        seq = self._begin_commit() if self.mvcc else None  # one commit seq for the whole batch
+        try:
+            for idx in shard_ids:
+                for op, key, value in by_shard[idx]:
+                    self._apply_locked(idx, op, key, value, seq)
+        finally:
+            for idx in reversed(shard_ids):
+                self.shard_locks[idx].release_write()
+            if seq is not None:
+                self._end_commit(seq)
+            wal.applied(wal_seq)
+        if self._lsm:
+            for idx in shard_ids:
+                if self._mem_bytes[idx] >= self.memtable_bytes:
+                    self._schedule_flush(idx)
+        return (wal_seq, entry_id)
+
+    def check_batch(self, ops):
+        """
+        Raise what write_batch(ops) would raise before logging anything: ValueError for an
+        empty batch, an unknown op or one spanning partitions, TypeError for a key or
+        value the WAL record format cannot encode. Returns the partition index the batch
+        goes to. Lets callers that merge batches (AsyncDurableKV) reject one bad batch
+        without failing the others.
+        """
+        if not ops:
+            raise ValueError("empty write batch")
+        parts = set()
+        for item in ops:
+            op, key = item[0], item[1]
+            if op not in ("PUT", "DEL"):
+                raise ValueError(f"unknown batch op: {op!r}")
+            idx = self._shard_index(key)
+            parts.add(self.partition_index(key))
+            value = item[2] if op == "PUT" else None
+            threshold = self.value_log_threshold
+            if (threshold is not None and isinstance(value, (str, bytes, bytearray))
+                    and len(value) >= threshold):
+                value = None  # logged as a value-log pointer
+            if self._shard_wals[idx].record_format == "binary":
+                _encode_value(key)
+                _encode_value(value)
+            else:
+                json.dumps([key, value])
+        if len(parts) > 1:
+            raise ValueError("a write batch cannot span partitions")
+        return parts.pop()
+
+    def apply_log_entry(self, entry):
+        """
+        Apply one (wal_seq, entry_id, op, key, value) entry read from ANOTHER store's WAL
+        to memory without logging it here (replication, see replication.Follower). A
+        BATCH is applied like write_batch: all its shard locks at once, one commit seq.
+        Value-log entries are rejected: their pointers name files of the other store.
+        """
+        _, _, op, key, value = entry
+        ops = value if op == "BATCH" else [(op, key, value)]
+        by_shard = {}
+        for sub_op, sub_key, sub_value in ops:
+            if sub_op not in ("PUT", "DEL") or isinstance(sub_value, ValuePointer):
+                raise ValueError(f"cannot apply a replicated {sub_op} entry")
+            by_shard.setdefault(self._shard_index(sub_key), []).append((sub_op, sub_key, sub_value))
+        shard_ids = sorted(by_shard)
+        for idx in shard_ids:
+            self.shard_locks[idx].acquire_write()
+        seq = self._begin_commit() if self.mvcc else None
+        try:
+            for idx in shard_ids:
+                for sub_op, sub_key, sub_value in by_shard[idx]:
+                    self._apply_locked(idx, sub_op, sub_key, sub_value, seq)
+        finally:
+            for idx in reversed(shard_ids):
+                self.shard_locks[idx].release_write()
+            if seq is not None:
+                self._end_commit(seq)
+        if self._lsm:
+            for idx in shard_ids:
+                if self._mem_bytes[idx] >= self.memtable_bytes:
+                    self._schedule_flush(idx)
+
+    def _apply_locked(self, idx, op, key, value, seq=None):
+        """
+        Apply one PUT/DEL to shard idx. Caller holds the shard write lock. With mvcc, seq
+        is the commit seq the new version is published under.
+        """
+        if seq is not None:
+            self._add_version(idx, key, seq, TOMBSTONE if op == "DEL" else value)
+        shard = self._writable_shard(idx)
+        if self.value_log_threshold is not None:
+            old = shard.get(key)
+            if isinstance(old, ValuePointer) and old != value:
+                self._release_pointer(idx, old)
+        if op == "DEL":
+            if not self._lsm:
+                if shard.pop(key, _MISSING) is not _MISSING and self.ordered_index:
+                    keys = self._sorted_keys[idx]
+                    del keys[bisect.bisect_left(keys, key)]
+                return
+            # a tombstone, not a pop: the key may still live in an older segment
+            value = TOMBSTONE
+        if self.ordered_index and key not in shard:
+            bisect.insort(self._sorted_keys[idx], key)
+        shard[key] = value
+        if self._lsm:
+            self._mem_bytes[idx] += _approx_size(key, value)
+
+    # ---------- value log ----------
+    def _separate(self, idx, op, value):
+        """
+        Move a large PUT value to the value log (written, not synced: see
+        _sync_value_log). Returns the (op, value) to log and apply.
+        """
+        threshold = self.value_log_threshold
+        if (op != "PUT" or threshold is None or not isinstance(value, (str, bytes, bytearray))
+                or len(value) < threshold):
+            return op, value
+        return "VPUT", self._shard_vlogs[idx].append(value)
+
+    def _unseparate(self, idx, values):
+        # the write that separated values failed before it was logged: they are garbage
+        for value in values:
+            if isinstance(value, ValuePointer):
+                self._shard_vlogs[idx].release(value)
+
+    def _sync_value_log(self, idx, durability):
+        # the value must be on disk before a synced WAL record can point at it
+        if (durability or self._shard_wals[idx].durability) in _SYNC_MODES:
+            self._shard_vlogs[idx].sync()
+
+    def _resolve(self, idx, value):
+        if isinstance(value, ValuePointer):
+            return self._shard_vlogs[idx].read(value)
+        return value
+
+    def _release_pointer(self, idx, ptr):
+        # caller holds the shard write lock; ptr was just replaced or deleted
+        vlog = self._shard_vlogs[idx]
+        if vlog.release(ptr) and vlog.garbage_ratio(ptr.file) >= self.value_log_gc_ratio:
+            with self._gc_lock:
+                if self._vlog_gc_scheduled:
+                    return
+                self._vlog_gc_scheduled = True
+            self._submit_gc(self.gc_value_log)
+
+    def _submit_gc(self, fn):
+        # not _snapshot_lock: callers may hold a shard write lock
+        with self._gc_lock:
+            if self._gc_executor is None:
+                self._gc_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="gc")
+        return self._gc_executor.submit(fn)
+
+    def gc_value_log(self):
+        """
+        Copy the live values of every sealed value-log file whose garbage share is at
+        least value_log_gc_ratio to the active file, repointing the index with VMOVE
+        records, then mark the file for deletion after the next snapshot. A file still
+        referenced after that (a put whose value went to it was not applied yet) is left
+        for a later run. Runs in the background on its own when a file crosses the
+        ratio. Returns the number of values moved.
+        """
+        with self._gc_lock:
+            self._vlog_gc_scheduled = False
+        moved = 0
+        for part in self.partitions:
+            vlog = part.vlog
+            for file_no in vlog.gc_candidates(self.value_log_gc_ratio):
+                moved += self._relocate_values(part, file_no)
+                if vlog.live_bytes[file_no]:
+                    # a put applied after the scan still points here: move it as well
+                    moved += self._relocate_values(part, file_no)
+                # WALs up to here may still point into file_no; rotating makes any later
+                # snapshot's seq strictly greater, which is when the file can go
+                with self._snapshot_lock:
+                    moved_seq = part.wal.current_seq
+                    if vlog.retire_after(file_no, moved_seq):
+                        part.wal.rotate()
+        return moved
+
+    def _relocate_values(self, part, file_no):
+        """Move every value the index holds in file_no to the active file. Returns how many."""
+        vlog = part.vlog
+        moved = 0
+        for idx in part.shard_ids:
+            lock = self.shard_locks[idx]
+            lock.acquire_read()
+            try:
+                victims = [(k, v) for k, v in self.shards[idx].items()
+                           if isinstance(v, ValuePointer) and v.file == file_no]
+            finally:
+                lock.release_read()
+            for key, old in victims:
+                new = vlog.append(vlog.read(old))
+                vlog.sync()
+                # VMOVE is conditional on replay too, so a racing put wins either way
+                wal_seq, _ = part.wal.append("VMOVE", key, [old, new])
+                lock.acquire_write()
+                seq = None
+                try:
+                    if self.shards[idx].get(key) == old:
+                        seq = self._begin_commit() if self.mvcc else None
+                        self._apply_locked(idx, "PUT", key, new, seq)
+                        moved += 1
+                    else:
+                        vlog.release(new)
+                finally:
+                    lock.release_write()
+                    if seq is not None:
+                        self._end_commit(seq)
+                    part.wal.applied(wal_seq)
+        return moved
+
+    def value_log_stats(self):
+        """Value-log files, bytes on disk, bytes still referenced and files awaiting deletion."""
+        total = collections.Counter()
+        for part in self.partitions:
+            if part.vlog is not None:
+                total.update(part.vlog.stats())
+        return dict(total)
+
+    # ---------- MVCC ----------
+    def read_view(self):
+        """Open a lock-free ReadView pinned to the latest fully committed seq (mvcc=True)."""
+        if not self.mvcc:
+            raise ValueError("read_view() requires mvcc=True")
+        with self._mvcc_lock:
+            seq = self._visible_seq
+            self._views[seq] += 1
+        return ReadView(self, seq)
+
+    def _release_view(self, seq):
+        with self._mvcc_lock:
+            self._views[seq] -= 1
+            if self._views[seq]:
+                return
+            del self._views[seq]
+            was_oldest = seq <= self._gc_horizon
+            self._gc_horizon = min(self._views) if self._views else self._visible_seq
+        if was_oldest:
+            self._submit_gc(self.gc_versions)
+
+    def _begin_commit(self):
+        # caller holds the write lock of every shard it will touch, so per key the
+        # chain order is the commit order
+        with self._mvcc_lock:
+            self._last_seq += 1
+            self._inflight.add(self._last_seq)
+            return self._last_seq
+
+    def _end_commit(self, seq):
+        with self._mvcc_lock:
+            self._inflight.discard(seq)
+            # publish up to the oldest commit still being applied
+            self._visible_seq = min(self._inflight) - 1 if self._inflight else self._last_seq
+            if not self._views:
+                self._gc_horizon = self._visible_seq
+
+    def _version_at(self, idx, key, seq):
+        """Value of key as of commit seq: _MISSING, TOMBSTONE or the value. No lock."""
+        chain = self._versions[idx].get(key)
+        if chain is None:
+            return _MISSING
+        i = bisect.bisect_right(chain, seq, key=_version_seq)
+        return chain[i - 1][1] if i else _MISSING
+
+    def _add_version(self, idx, key, seq, value):
+        # caller holds the shard write lock; copy the chain, readers may be walking it
+        versions = self._versions[idx]
+        chain = versions.get(key)
+        if chain is None:
+            if value is not TOMBSTONE:
+                versions[key] = [(seq, value)]
+            return
+        # versions older than the newest one at or below the horizon are invisible to all
+        keep = max(bisect.bisect_right(chain, self._gc_horizon, key=_version_seq) - 1, 0)
+        versions[key] = chain[keep:] + [(seq, value)]
+        history = self._history[idx]
+        history.add(key)
+        # the old version must outlive this commit (get() reads it until it is visible),
+        # so without views nothing else would ever drop it or a delete's chain
+        if len(history) >= _VERSION_GC_KEYS and not self._views:
+            with self._gc_lock:
+                if self._version_gc_scheduled:
+                    return
+                self._version_gc_scheduled = True
+            self._submit_gc(self.gc_versions)
+
+    def gc_versions(self):
+        """
+        Drop versions no open view can see (and keys whose only visible version is a
+        delete). Runs automatically in the background when the oldest view closes and
+        when old versions pile up with no view open. Returns the number of versions freed.
         """
-        # Acquire all shard write locks IN ORDER to get a consistent view
-        for lock in self.shard_locks:
+        with self._gc_lock:
+            self._version_gc_scheduled = False
+        freed = 0
+        for idx in range(self.n_shards):
+            lock = self.shard_locks[idx]
             lock.acquire_write()
+            try:
+                horizon = self._gc_horizon
+                versions = self._versions[idx]
+                history = self._history[idx]
+                for key in list(history):
+                    chain = versions[key]
+                    keep = max(bisect.bisect_right(chain, horizon, key=_version_seq) - 1, 0)
+                    chain = chain[keep:]
+                    if len(chain) == 1:
+                        history.discard(key)
+                        if chain[0][1] is TOMBSTONE and chain[0][0] <= horizon:
+                            del versions[key]
+                            freed += keep + 1
+                            continue
+                    if keep:
+                        versions[key] = chain
+                        freed += keep
+            finally:
+                lock.release_write()
+        return freed
+
+    def version_stats(self):
+        """
+        MVCC memory report: keys, versions, open views, and the bytes the version chains
+        cost on top of the values themselves (chain lists, version tuples, seq ints and
+        the per-shard version dicts), in total and per version.
+        """
+        keys = n_versions = 0
+        overhead = 0
+        for versions in self._versions:
+            overhead += sys.getsizeof(versions)
+            for chain in list(versions.values()):
+                keys += 1
+                n_versions += len(chain)
+                overhead += sys.getsizeof(chain)
+                overhead += sum(sys.getsizeof(v) + sys.getsizeof(v[0]) for v in chain)
+        with self._mvcc_lock:
+            views = sum(self._views.values())
+            oldest = min(self._views) if self._views else None
+            visible = self._visible_seq
+        return {"keys": keys, "versions": n_versions, "open_views": views,
+                "oldest_view_seq": oldest, "visible_seq": visible,
+                "overhead_bytes": overhead,
+                "overhead_bytes_per_version": overhead / n_versions if n_versions else 0.0}
+
+    # ---------- ordered scans ----------
+    def scan(self, start=None, end=None, limit=None):
+        """
+        Lazily yield (key, value) pairs with start <= key < end in ascending key order
+        (None means unbounded), at most limit of them. Keys must be mutually comparable.
+
+        Each shard is walked with a cursor that re-takes the shard read lock for every
+        batch of _SCAN_BATCH keys, and the shard cursors are merged through a heap. With
+        ordered_index=True the cursors bisect the shards' sorted key lists, so a scan
+        costs O(log N + limit) and no key set is copied. Without it each call first
+        copies and sorts every shard's keys in [start, end): O(N log N) per call even for
+        a small limit, so paging through a large store needs ordered_index=True.
+        Consistency: read-committed, not a point-in-time snapshot. Every key is yielded
+        at most once and in order; a key present for the whole scan is always yielded,
+        with a value it held at some moment during the scan; keys written or deleted
+        while the scan is running may or may not be seen. On an LSM store, writes that
+        land after a memtable flush starts are not seen by scans already running.
+        """
+        runs = [self._shard_run(i, start, end) for i in range(self.n_shards)]
+        for n, (k, v) in enumerate(heapq.merge(*runs, key=lambda kv: kv[0])):
+            if limit is not None and n >= limit:
+                return
+            if isinstance(v, ValuePointer):
+                v = self._resolve(self._shard_index(k), v)
+            yield k, v
+
+    def prefix(self, p, limit=None):
+        """Lazily yield (key, value) for every key starting with p, in key order."""
+        return self.scan(p, _prefix_end(p), limit)
+
+    def _shard_run(self, idx, start, end):
+        lock = self.shard_locks[idx]
+        if not self._lsm:
+            # hash engine: follow the live shard (COW copies replace the dict object)
+            keys = None
+            if not self.ordered_index:
+                lock.acquire_read()
+                try:
+                    keys = _keys_in_range(self.shards[idx], start, end)
+                finally:
+                    lock.release_read()
+            yield from self._memtable_run(idx, start, end, None, keys)
+            return
+        # LSM: pin the memtable and the sources behind it; a flush swaps in new objects
+        lock.acquire_read()
         try:
-            # Choose snapshot seq to be wal.current_seq (so this snapshot includes all entries
-            # up to wal.current_seq - 1 that have been applied)
-            snapshot_seq = self.wal.current_seq
-            tmp_fd, tmp_path = tempfile.mkstemp(dir=self.data_dir, prefix="snaptmp_")
-            os.close(tmp_fd)
-            snap_info = {
-                "snapshot_seq": snapshot_seq,
-                "created_at": time.time()
-            }
-            # Dump entire store as JSON (for demo; for large systems prefer binary/formatted snapshots)
+            mem = self.shards[idx]
+            keys = self._sorted_keys[idx] if self.ordered_index else _keys_in_range(mem, start, end)
+            immutables = self._immutables[idx]
+            segments = self._segments[idx]
+        finally:
+            lock.release_read()
+        runs = [self._memtable_run(idx, start, end, mem, keys)]
+        for frozen in immutables:
+            runs.append((k, frozen[k]) for k in _keys_in_range(frozen, start, end))
+        runs.extend(seg.iter_range(start, end) for seg in segments)
+        for k, v in _merge_newest_wins(runs):
+            if v is not TOMBSTONE:
+                yield k, v
+
+    def _memtable_run(self, idx, start, end, mem, keys):
+        """
+        Cursor over one shard dict in key order. mem/keys None means "the live shard /
+        the live ordered index", re-read under the lock for every batch.
+        """
+        lock = self.shard_locks[idx]
+        last = _MISSING
+        while True:
+            lock.acquire_read()
+            try:
+                shard = self.shards[idx] if mem is None else mem
+                sorted_keys = self._sorted_keys[idx] if keys is None else keys
+                if last is _MISSING:
+                    i = 0 if start is None else bisect.bisect_left(sorted_keys, start)
+                else:
+                    i = bisect.bisect_right(sorted_keys, last)
+                window = sorted_keys[i:i + _SCAN_BATCH]
+                done = len(window) < _SCAN_BATCH
+                batch = []
+                for k in window:
+                    if end is not None and k >= end:
+                        done = True
+                        break
+                    v = shard.get(k, _MISSING)
+                    if v is not _MISSING:
+                        batch.append((k, v))
+                    last = k
+            finally:
+                lock.release_read()
+            yield from batch
+            if done:
+                return
+
+    # ---------- snapshot ----------
+    def snapshot(self, background=False):
+        """
+        Create a consistent snapshot:
+        - Acquire all shard write locks in a fixed order, only long enough to freeze the
+          current shard dicts (copy-on-write: the next writer to a shard copies it).
+        - Rotate the WAL so new writes go to wal_{seq+1}.log; recovery replays wal_{seq}
+          onwards, which covers anything applied after the freeze.
+        - Dump the frozen shards to a temp file, fsync and atomically rename to
+          snapshot_{seq}.snap (seq = wal seq at freeze time, or the older seq of a write
+          that was logged but not yet applied when the shards were frozen).
+        Returns the snapshot path. With background=True the dump runs on a background
+        thread and a concurrent.futures.Future resolving to the path is returned instead;
+        writers are never blocked by serialization or fsync in either mode.
+        A partitioned store snapshots every shard against its own WAL and returns (or
+        resolves to) the list of per-shard snapshot paths, written in parallel.
+        On an LSM store a snapshot is a flush of every memtable; it returns the MANIFEST
+        path (one per partition when partitioned) once the segments are durable.
+        """
+        if self._lsm:
+            futures = [self._submit_flush(part) for part in self.partitions]
+            if self.partitioned:
+                job = lambda: [f.result() for f in futures]
+            else:
+                job = futures[0].result
+            return self._ensure_snapshot_executor().submit(job) if background else job()
+        frozen = [(part,) + self._freeze(part) for part in self.partitions]
+        if not background:
+            return self._write_snapshots(frozen)
+        return self._ensure_snapshot_executor().submit(self._write_snapshots, frozen)
+
+    def _ensure_snapshot_executor(self):
+        with self._snapshot_lock:
+            if self._snapshot_executor is None:
+                self._snapshot_executor = ThreadPoolExecutor(max_workers=1,
+                                                             thread_name_prefix="snapshot")
+            return self._snapshot_executor
+
+    def _freeze(self, part):
+        """Pin a consistent view of a partition's shards. Returns (snapshot_seq, shard views)."""
+        locks = [self.shard_locks[i] for i in part.shard_ids]
+        with self._snapshot_lock:
+            # Acquire all shard write locks IN ORDER to get a consistent view
+            for lock in locks:
+                lock.acquire_write()
+            try:
+                # not current_seq: a write appended to an older segment (rotated by size
+                # since) may not have reached its shard yet, and recovery must replay it
+                snapshot_seq = part.wal.snapshot_fence()
+                views = [self.shards[i] for i in part.shard_ids]
+                for i in part.shard_ids:
+                    self._frozen[i] = True
+            finally:
+                for lock in reversed(locks):
+                    lock.release_write()
+            part.wal.rotate()  # size-based rotation may already have moved past snapshot_seq
+        return snapshot_seq, views
+
+    def _write_snapshots(self, frozen):
+        def write(part, snapshot_seq, views):
+            path = self._write_snapshot(part.dirpath, snapshot_seq, views)
+            self._schedule_retire(part, snapshot_seq)
+            return path
+
+        if not self.partitioned:
+            return write(*frozen[0])
+        with ThreadPoolExecutor(max_workers=min(len(frozen), os.cpu_count() or 1)) as pool:
+            return list(pool.map(lambda args: write(*args), frozen))
+
+    def _write_snapshot(self, dirpath, snapshot_seq, views):
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=dirpath, prefix="snaptmp_")
+        os.close(tmp_fd)
+        snap_info = {
+            "snapshot_seq": snapshot_seq,
+            "created_at": time.time()
+        }
+        if self.snapshot_format == "chunked":
+            # stream shard by shard; only one chunk is buffered at a time
+            with open(tmp_path, "wb") as f:
+                write_chunked_snapshot(f, snap_info, views, self.snapshot_chunk_bytes,
+                                       self.snapshot_compression)
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            # Dump entire store as JSON (for demo; for large systems prefer the chunked format)
             aggregate = {}
-            for shard in self.shards:
+            for shard in views:
                 aggregate.update(shard)
+            payload = {"meta": snap_info, "data": aggregate}
+            if self.value_log_threshold is not None:
+                # pointers go in their own section so they can't be mistaken for values
+                payload["value_pointers"] = {k: v for k, v in aggregate.items()
+                                             if isinstance(v, ValuePointer)}
+                for k in payload["value_pointers"]:
+                    del aggregate[k]
             with open(tmp_path, "w") as f:
                 # write metadata + data
-                f.write(json.dumps({"meta": snap_info, "data": aggregate}))
+                f.write(json.dumps(payload))
                 f.flush()
                 os.fsync(f.fileno())
-            # atomically move into place
-            final_name = os.path.join(self.data_dir, f"snapshot_{snapshot_seq}.snap")
-            os.replace(tmp_path, final_name)
-            # Now that snapshot is durable, rotate WAL so new writes go into wal_{snapshot_seq+1}.log
-            new_wal_seq = snapshot_seq + 1
-            self.wal.rotate(new_seq=new_wal_seq)
-            return final_name
-        finally:
-            for lock in reversed(self.shard_locks):
+        # atomically move into place
+        final_name = os.path.join(dirpath, f"snapshot_{snapshot_seq}.snap")
+        os.replace(tmp_path, final_name)
+        _fsync_dir(dirpath)  # the rename must be durable before any WAL is retired
+        return final_name
+
+    # ---------- WAL retirement ----------
+    def _schedule_retire(self, part, below_seq):
+        """Retire part's WALs below below_seq (and older snapshots) on a background thread."""
+        if not self.retire_wals:
+            return None
+        with self._snapshot_lock:
+            if self._retire_executor is None:
+                self._retire_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retire")
+        return self._retire_executor.submit(self._retire, part, below_seq)
+
+    def _retire(self, part, below_seq):
+        removed = part.wal.retire(below_seq)
+        if part.vlog is not None and not self._views:
+            # relocated value-log files are unreachable once a snapshot postdates the move
+            for file_no, moved_seq in list(part.vlog.retiring.items()):
+                if moved_seq < below_seq:
+                    part.vlog.remove(file_no)
+                    removed += 1
+        if not self._lsm:
+            for fname in os.listdir(part.dirpath):
+                if fname.startswith("snapshot_") and fname.endswith(".snap"):
+                    if int(fname.split("_")[1].split(".")[0]) < below_seq:
+                        os.remove(os.path.join(part.dirpath, fname))
+                        removed += 1
+        return removed
+
+    # ---------- LSM flush / compaction ----------
+    def _schedule_flush(self, idx):
+        part = self.partitions[idx] if self.partitioned else self.partitions[0]
+        with part.manifest_lock:
+            if part.flush_scheduled:
+                return
+            part.flush_scheduled = True
+        self._submit_flush(part)
+
+    def _submit_flush(self, part):
+        # a single flush thread keeps MANIFEST fences in freeze order
+        with self._snapshot_lock:
+            if self._flush_executor is None:
+                self._flush_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flush")
+        return self._flush_executor.submit(self._flush_partition, part)
+
+    def _flush_partition(self, part):
+        """
+        Freeze the partition's memtables at a WAL fence, write each to a segment, then
+        publish the segments and the new fence in MANIFEST.json. Returns the MANIFEST path.
+        """
+        with part.manifest_lock:
+            part.flush_scheduled = False
+        locks = [self.shard_locks[i] for i in part.shard_ids]
+        frozen = {}
+        with self._snapshot_lock:
+            for lock in locks:
+                lock.acquire_write()
+            try:
+                fence = part.wal.snapshot_fence()  # see _freeze
+                for i in part.shard_ids:
+                    if self.shards[i]:
+                        frozen[i] = self.shards[i]
+                        self._immutables[i] = [self.shards[i]] + self._immutables[i]
+                        self.shards[i] = {}
+                        self._sorted_keys[i] = []
+                        self._mem_bytes[i] = 0
+            finally:
+                for lock in reversed(locks):
+                    lock.release_write()
+            part.wal.rotate()
+
+        written = {}
+        for i, mem in frozen.items():
+            with part.manifest_lock:
+                seg_id = part.next_segment_id
+                part.next_segment_id += 1
+            path = os.path.join(part.dirpath, f"seg_{i:03d}_{seg_id:06d}.sst")
+            written[i] = write_segment(path, sorted(mem.items()), {"wal_fence": fence},
+                                       self.segment_block_bytes, self.bloom_bits_per_key,
+                                       self.block_cache)
+
+        with part.manifest_lock:
+            for i, seg in written.items():
+                lock = self.shard_locks[i]
+                lock.acquire_write()
+                try:
+                    self._segments[i] = [seg] + self._segments[i]
+                    self._immutables[i] = [m for m in self._immutables[i] if m is not frozen[i]]
+                finally:
+                    lock.release_write()
+            # WALs before the fence are now covered by segments (wal_{fence} is still replayed)
+            part.wal_fence = fence
+            manifest = self._write_manifest(part)
+        self._schedule_retire(part, fence)
+        for i in written:
+            if len(self._segments[i]) >= self.compaction_trigger:
+                self._submit_compaction(part, i)
+        return manifest
+
+    def _write_manifest(self, part):
+        # caller holds part.manifest_lock
+        manifest = {
+            "wal_fence": part.wal_fence,
+            "next_segment_id": part.next_segment_id,
+            "segments": {str(i): [seg.name for seg in self._segments[i]] for i in part.shard_ids},
+        }
+        path = os.path.join(part.dirpath, MANIFEST_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        _fsync_dir(part.dirpath)
+        return path
+
+    def _submit_compaction(self, part, idx, force=False):
+        with self._snapshot_lock:
+            if self._compaction_executor is None:
+                self._compaction_executor = ThreadPoolExecutor(max_workers=1,
+                                                               thread_name_prefix="compaction")
+        return self._compaction_executor.submit(self._compact_shard, part, idx, force)
+
+    def _compact_shard(self, part, idx, force=False):
+        """
+        Tiered compaction: merge all current segments of shard idx into one. The merged
+        set always includes the oldest segment, so tombstones can be dropped.
+        """
+        inputs = self._segments[idx]
+        if len(inputs) < (2 if force else self.compaction_trigger):
+            return None
+        with part.manifest_lock:
+            seg_id = part.next_segment_id
+            part.next_segment_id += 1
+        path = os.path.join(part.dirpath, f"seg_{idx:03d}_{seg_id:06d}.sst")
+        merged = _merge_newest_wins([seg.items() for seg in inputs])
+        live = ((k, v) for k, v in merged if v is not TOMBSTONE)
+        new_seg = write_segment(path, live, {"compacted_from": [seg.name for seg in inputs]},
+                                self.segment_block_bytes, self.bloom_bits_per_key,
+                                self.block_cache)
+        with part.manifest_lock:
+            lock = self.shard_locks[idx]
+            lock.acquire_write()
+            try:
+                # flushes may have prepended newer segments meanwhile; replace only our inputs
+                current = self._segments[idx]
+                newer = current[:len(current) - len(inputs)]
+                self._segments[idx] = newer + [new_seg]
+            finally:
                 lock.release_write()
+            self._write_manifest(part)
+        for seg in inputs:
+            if self.block_cache is not None:
+                self.block_cache.invalidate(seg.cache_id)
+            try:
+                os.remove(seg.path)
+            except FileNotFoundError:
+                pass
+        return new_seg
+
+    def lookup_stats(self):
+        """
+        Segment lookup counters since startup: bloom false-positive rate (false positives
+        over all probes for keys a segment did not hold) and bytes read per lookup.
+        """
+        return self._lookup_stats.snapshot()
+
+    def lock_stats(self):
+        """
+        Per-shard lock contention: a list (indexed by shard) of acquires, contended
+        acquires, seconds spent waiting and current/max waiter queue depth. Entries are
+        None with lock_policy="reader", whose lock keeps no counters.
+        """
+        return [lock.stats() if hasattr(lock, "stats") else None for lock in self.shard_locks]
+
+    def block_cache_stats(self):
+        """Block cache hits, misses, hit rate, evictions, invalidations and bytes held."""
+        return self.block_cache.stats() if self.block_cache is not None else None
+
+    def durability_lag(self):
+        """
+        WAL durability lag summed over partitions: unsynced bytes and records, and the
+        age of the oldest unsynced write (max over partitions).
+        """
+        lag = {"unsynced_bytes": 0, "unsynced_records": 0, "lag_seconds": 0.0}
+        for part in self.partitions:
+            l = part.wal.durability_lag()
+            lag["unsynced_bytes"] += l["unsynced_bytes"]
+            lag["unsynced_records"] += l["unsynced_records"]
+            lag["lag_seconds"] = max(lag["lag_seconds"], l["lag_seconds"])
+        return lag
+
+    def compact(self):
+        """Run a compaction for every shard that has more than one segment and wait for it."""
+        futures = []
+        for part in self.partitions:
+            for i in part.shard_ids:
+                if len(self._segments[i]) > 1:
+                    futures.append(self._submit_compaction(part, i, force=True))
+        for f in futures:
+            f.result()
 
     # ---------- recovery ----------
-    def recover(self):
+    def recover(self, parallel=False, workers=None, executor="thread"):
         """
         1. Find latest snapshot (largest snapshot_N).
         2. Load it into memory.
@@ -232,57 +2769,166 @@ class DurableKV:
            For safety in this code we'll:
              - load snapshot.meta.snapshot_seq -> s
              - apply all wal files with seq >= s and >= 1, in ascending order.
+
+        parallel=True parses the WAL files concurrently on a pool of `workers` threads or
+        processes (executor="thread" | "process"), buckets entries per shard in
+        (wal_seq, entry_id) order and replays each shard on its own thread. The result is
+        identical to sequential replay because every key lives in exactly one shard.
+        Per-phase timings are left in self.last_recovery_stats.
+        A partitioned store recovers each shard from its own directory (snapshot loads run
+        concurrently when parallel=True) and returns the list of per-shard snapshot seqs.
         """
-        # clear current memory
-        for idx in range(self.n_shards):
-            self.shards[idx].clear()
+        stats = {"snapshot_load_s": 0.0, "wal_parse_s": None, "apply_s": None,
+                 "wal_replay_s": 0.0, "wal_files": 0, "wal_entries": 0}
+        t0 = time.perf_counter()
+        # clear current memory (fresh dicts: frozen ones may still be read by a snapshot)
+        self.shards = [dict() for _ in range(self.n_shards)]
+        self._frozen = [False] * self.n_shards
+        self._immutables = [[] for _ in range(self.n_shards)]
+        if self.block_cache is not None:
+            for segments in self._segments:
+                for seg in segments:
+                    self.block_cache.invalidate(seg.cache_id)
+        self._segments = [[] for _ in range(self.n_shards)]
 
-        # find latest snapshot
-        files = os.listdir(self.data_dir)
-        snaps = [fname for fname in files if fname.startswith("snapshot_") and fname.endswith(".snap")]
-        if snaps:
-            # choose largest seq
-            def snap_seq(name): return int(name.split("_")[1].split(".")[0])
-            latest_snap = max(snaps, key=snap_seq)
-            snap_path = os.path.join(self.data_dir, latest_snap)
-            with open(snap_path, "r") as f:
-                payload = json.load(f)
-            meta = payload["meta"]
-            snapshot_seq = meta["snapshot_seq"]
-            data = payload["data"]
-            # load into shards
-            for k, v in data.items():
-                idx = self._shard_index(k)
-                self.shards[idx][k] = v
+        # load the latest snapshot (LSM: the manifest) of every partition, independently,
+        # so in parallel if asked
+        loader = self._load_manifest if self._lsm else self._load_latest_snapshot
+        if parallel and self.partitioned:
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+                snapshot_seqs = list(pool.map(loader, self.partitions))
         else:
-            snapshot_seq = 1  # no snapshot, start from 1
-
-        # apply WALs with seq >= snapshot_seq
-        wal_seqs = self.wal.list_wal_seqs()
-        wal_seqs = [s for s in wal_seqs if s >= snapshot_seq]
-        wal_seqs.sort()
-        for s in wal_seqs:
-            p = os.path.join(self.data_dir, f"wal_{s}.log")
-            try:
-                with open(p, "r") as f:
-                    for line in f:
-                        if not line.strip():
-                            continue
-                        entry = json.loads(line)
-                        op = entry["op"]
-                        k = entry["key"]
-                        if op == "PUT":
-                            idx = self._shard_index(k)
-                            self.shards[idx][k] = entry["value"]
-                        elif op == "DEL":
-                            idx = self._shard_index(k)
-                            self.shards[idx].pop(k, None)
-            except FileNotFoundError:
-                continue
-        return snapshot_seq
+            snapshot_seqs = [loader(part) for part in self.partitions]
+        t1 = time.perf_counter()
+        stats["snapshot_load_s"] = t1 - t0
+
+        # apply WALs with seq >= snapshot_seq; paths stay in wal seq order per partition,
+        # which is all the per-shard ordering replay needs
+        paths = []
+        for part, snapshot_seq in zip(self.partitions, snapshot_seqs):
+            wal_seqs = [s for s in part.wal.list_wal_seqs() if s >= snapshot_seq]
+            wal_seqs.sort()
+            paths.extend(os.path.join(part.dirpath, f"wal_{s}.log") for s in wal_seqs)
+        stats["wal_files"] = len(paths)
+        self.torn_wal_files = []
+        if parallel:
+            stats.update(self._replay_parallel(paths, workers, executor))
+        else:
+            for p in paths:
+                reader = WALReader(p)
+                try:
+                    for entry in reader:
+                        self._apply_entry(entry)
+                        stats["wal_entries"] += 1
+                except FileNotFoundError:
+                    continue
+                if reader.torn_tail:
+                    self.torn_wal_files.append(p)
+        if self._lsm:
+            self._mem_bytes = [sum(_approx_size(k, v) for k, v in shard.items()) for shard in self.shards]
+        self._sorted_keys = [sorted(shard) if self.ordered_index else [] for shard in self.shards]
+        for part in self.partitions:
+            if part.vlog is not None:
+                part.vlog.reset_live(v for i in part.shard_ids for v in self.shards[i].values()
+                                     if isinstance(v, ValuePointer))
+        if self.mvcc:
+            # recovered state is one committed version per key (history is not persisted)
+            with self._mvcc_lock:
+                seq = self._visible_seq
+            self._versions = [{k: [(seq, v)] for k, v in shard.items()} for shard in self.shards]
+            self._history = [set() for _ in range(self.n_shards)]
+        stats["wal_replay_s"] = time.perf_counter() - t1
+        self.last_recovery_stats = stats
+        return snapshot_seqs if self.partitioned else snapshot_seqs[0]
+
+    def _load_latest_snapshot(self, part):
+        """Load the newest snapshot in part.dirpath into the shards. Returns its seq (1 if none)."""
+        files = os.listdir(part.dirpath)
+        snaps = [fname for fname in files if fname.startswith("snapshot_") and fname.endswith(".snap")]
+        if not snaps:
+            return 1  # no snapshot, start from 1
+        # choose largest seq
+        def snap_seq(name): return int(name.split("_")[1].split(".")[0])
+        latest_snap = max(snaps, key=snap_seq)
+        reader = SnapshotReader(os.path.join(part.dirpath, latest_snap))
+        # load into shards
+        for k, v in reader:
+            idx = self._shard_index(k)
+            self.shards[idx][k] = v
+        return reader.meta["snapshot_seq"]
+
+    def _load_manifest(self, part):
+        """LSM: open the segments listed in the partition's MANIFEST. Returns its WAL fence."""
+        path = os.path.join(part.dirpath, MANIFEST_FILE)
+        listed = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            part.wal_fence = manifest["wal_fence"]
+            part.next_segment_id = manifest["next_segment_id"]
+            for i in part.shard_ids:
+                names = manifest["segments"].get(str(i), [])
+                self._segments[i] = [Segment(os.path.join(part.dirpath, n), self.block_cache)
+                                     for n in names]
+                listed.update(names)
+        # drop output of flushes/compactions that never reached the manifest
+        for fname in os.listdir(part.dirpath):
+            if fname.startswith("seg_") and fname not in listed:
+                os.remove(os.path.join(part.dirpath, fname))
+        return part.wal_fence
+
+    def _apply_entry(self, entry):
+        _, _, op, k, value = entry
+        if op == "BATCH":
+            for sub_op, sub_k, sub_v in value:
+                self._apply_entry((None, None, sub_op, sub_k, sub_v))
+            return
+        _replay_op(self.shards[self._shard_index(k)], op, k, value, self._lsm)
+
+    def _replay_parallel(self, paths, workers, executor):
+        if executor not in ("thread", "process"):
+            raise ValueError(f"unknown executor: {executor!r}")
+        pool_cls = ProcessPoolExecutor if executor == "process" else ThreadPoolExecutor
+        workers = workers or min(len(paths), os.cpu_count() or 1) or 1
+        t0 = time.perf_counter()
+        # parse files concurrently; map() hands results back in wal_seq order, so each
+        # per-shard bucket ends up sorted by (wal_seq, entry_id)
+        buckets = [[] for _ in range(self.n_shards)]
+        n_entries = 0
+        with pool_cls(max_workers=workers) as pool:
+            for p, (entries, torn) in zip(paths, pool.map(_parse_wal_file, paths)):
+                for entry in entries:
+                    if entry[2] == "BATCH":
+                        for op, k, v in entry[4]:
+                            buckets[self._shard_index(k)].append((entry[0], entry[1], op, k, v))
+                    else:
+                        buckets[self._shard_index(entry[3])].append(entry)
+                n_entries += len(entries)
+                if torn:
+                    self.torn_wal_files.append(p)
+        t1 = time.perf_counter()
+
+        lsm = self._lsm
+
+        def apply_shard(idx):
+            shard = self.shards[idx]
+            for _, _, op, k, value in buckets[idx]:
+                _replay_op(shard, op, k, value, lsm)
+
+        with ThreadPoolExecutor(max_workers=min(self.n_shards, workers)) as pool:
+            list(pool.map(apply_shard, range(self.n_shards)))
+        return {"wal_parse_s": t1 - t0, "apply_s": time.perf_counter() - t1,
+                "wal_entries": n_entries}
 
     def close(self):
-        self.wal.close()
+        for executor in (self._snapshot_executor, self._flush_executor, self._compaction_executor,
+                         self._retire_executor, self._gc_executor):
+            if executor is not None:
+                executor.shutdown(wait=True)
+        for part in self.partitions:
+            part.wal.close()
+            if part.vlog is not None:
+                part.vlog.close()
 
 
 # ---------- Basic demo ----------
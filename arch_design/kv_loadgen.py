@@ -0,0 +1,120 @@
+# kv_loadgen.py
+# Load generator for kv_server: T client threads share one pooled KVClient, each keeping
+# up to --pipeline requests in flight, and issue a get/put mix over a fixed key space.
+# Reports throughput and p50/p99/p99.9 request latency (send -> response).
+#
+#   python kv_loadgen.py --spawn                        # start a throwaway server
+#   python kv_loadgen.py --address unix:/tmp/kv.sock    # use a running server
+import argparse
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from kv_server import KVClient
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+def run(address, threads, connections, ops, pipeline, read_ratio, keys, value_size):
+    client = KVClient(address, pool_size=connections)
+    value = "x" * value_size
+    latencies = [[] for _ in range(threads)]
+
+    def worker(n):
+        rng = random.Random(n)
+        window = threading.Semaphore(pipeline)
+        done = threading.Event()
+        remaining = [ops]
+        lock = threading.Lock()
+        lat = latencies[n]
+
+        def finished(t0):
+            def callback(future):
+                lat.append(time.perf_counter() - t0)
+                window.release()
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        done.set()
+            return callback
+
+        for _ in range(ops):
+            window.acquire()
+            key = f"key:{rng.randrange(keys)}"
+            t0 = time.perf_counter()
+            if rng.random() < read_ratio:
+                future = client.send("get", key)
+            else:
+                future = client.send("put", key, value)
+            future.add_done_callback(finished(t0))
+        done.wait()
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    t0 = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    client.close()
+    lat = sorted(x for per_thread in latencies for x in per_thread)
+    return {"ops_s": len(lat) / elapsed, "p50_ms": percentile(lat, 0.50) * 1000,
+            "p99_ms": percentile(lat, 0.99) * 1000, "p999_ms": percentile(lat, 0.999) * 1000}
+
+
+def spawn_server(durability):
+    d = tempfile.mkdtemp(prefix="kv_loadgen_")
+    sock = os.path.join(d, "kv.sock")
+    here = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen([sys.executable, os.path.join(here, "kv_server.py"),
+                             "--data-dir", os.path.join(d, "data"), "--unix", sock,
+                             "--durability", durability], stdout=subprocess.PIPE, text=True)
+    proc.stdout.readline()  # "serving ..." once the socket is listening
+    return proc, d, f"unix:{sock}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="kv_server load generator")
+    parser.add_argument("--address", help="unix:/path or host:port of a running server")
+    parser.add_argument("--spawn", action="store_true", help="start a server in a temp dir")
+    parser.add_argument("--durability", default="always", help="durability of a spawned server")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=20000, help="requests per thread")
+    parser.add_argument("--pipeline", type=int, default=32, help="in-flight requests per thread")
+    parser.add_argument("--read-ratio", type=float, default=0.5)
+    parser.add_argument("--keys", type=int, default=100000)
+    parser.add_argument("--value-size", type=int, default=100)
+    args = parser.parse_args()
+    if not args.spawn and not args.address:
+        parser.error("give --address or --spawn")
+
+    proc = None
+    address = args.address
+    if args.spawn:
+        proc, tmp, address = spawn_server(args.durability)
+    try:
+        r = run(address, args.threads, args.connections, args.ops, args.pipeline,
+                args.read_ratio, args.keys, args.value_size)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+            shutil.rmtree(tmp, ignore_errors=True)
+    print(f"{args.threads} threads x {args.ops} ops, pipeline {args.pipeline}, "
+          f"{args.connections} connections, {args.read_ratio:.0%} reads")
+    print(f"{r['ops_s']:>12,.0f} ops/s   p50 {r['p50_ms']:.2f} ms   "
+          f"p99 {r['p99_ms']:.2f} ms   p99.9 {r['p999_ms']:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+# kv_server.py
+# Serve one DurableKV to many processes over a Unix or TCP socket.
+#
+# Framing (all integers little endian):
+#   request:  [u32 body_len][u32 request_id][u8 op][body]
+#   response: [u32 body_len][u32 request_id][u8 status][body]
+# Keys and values in bodies use DurableKV's tagged value encoding ([u8 tag][u32 len][bytes]),
+# so str, bytes, None and JSON values travel as they are stored. Only those four tags
+# (and a BATCH list of PUT/DEL ops as the body of BATCH) are accepted from clients:
+# the storage-internal ones (value pointers, tombstones, compressed values) are
+# answered with ERROR. A client may send any
+# number of requests without waiting (pipelining); responses carry the request id and
+# can come back out of order, e.g. a get overtakes a put waiting for its WAL commit.
+#
+#   GET   body: key                           -> OK value | NOT_FOUND
+#   PUT   body: key value                     -> OK
+#   DEL   body: key                           -> OK
+#   SCAN  body: start end limit               -> OK [u32 n] (key value) * n
+#   BATCH body: encoded ("PUT"/"DEL", k, v) list -> OK
+#   errors                                    -> ERROR utf-8 message
+#
+# Run a server:  python kv_server.py --data-dir ./kvdata --unix /tmp/kv.sock
+#                python kv_server.py --data-dir ./kvdata --tcp 127.0.0.1:7070
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import socket
+import struct
+import threading
+from concurrent.futures import Future
+
+from durable_kv import (DurableKV, _encode_value, _decode_value, _encode_batch, _VAL_HEADER,
+                        _OP_NAMES, _TAG_NONE, _TAG_STR, _TAG_BYTES, _TAG_JSON, _TAG_BATCH)
+from async_durable_kv import AsyncDurableKV
+
+FRAME = struct.Struct("<IIB")
+_COUNT = struct.Struct("<I")
+OP_GET, OP_PUT, OP_DEL, OP_SCAN, OP_BATCH = 1, 2, 3, 4, 5
+STATUS_OK, STATUS_NOT_FOUND, STATUS_ERROR = 0, 1, 2
+MAX_FRAME = 64 << 20
+
+
+class KVServerError(Exception):
+    """The server answered a request with an error."""
+
+
+def parse_address(address):
+    """'unix:/path/to.sock' or '/path/to.sock' -> path str; 'host:port' -> (host, port)."""
+    if isinstance(address, tuple):
+        return address
+    if address.startswith("unix:"):
+        return address[len("unix:"):]
+    if "/" in address:
+        return address
+    host, _, port = address.rpartition(":")
+    return (host or "127.0.0.1", int(port))
+
+
+_CLIENT_TAGS = (_TAG_NONE, _TAG_STR, _TAG_BYTES, _TAG_JSON)
+
+
+def _decode_client_value(mv, pos):
+    """_decode_value for untrusted input: plain value tags only."""
+    tag, n = _VAL_HEADER.unpack_from(mv, pos)
+    if tag not in _CLIENT_TAGS:
+        raise ValueError(f"value tag {tag} is not accepted from clients")
+    if pos + _VAL_HEADER.size + n > len(mv):
+        raise ValueError("truncated value")
+    return _decode_value(mv, pos)
+
+
+def _decode_args(body, n):
+    mv = memoryview(body)
+    args, pos = [], 0
+    for _ in range(n):
+        value, pos = _decode_client_value(mv, pos)
+        args.append(value)
+    return args
+
+
+def _decode_batch(body):
+    """Decode a BATCH body into [(op, key, value), ...], checking every op and value."""
+    mv = memoryview(body)
+    tag, n = _VAL_HEADER.unpack_from(mv, 0)
+    end = _VAL_HEADER.size + n
+    if tag != _TAG_BATCH or end > len(mv):
+        raise ValueError("BATCH body must be an encoded op list")
+    ops, pos = [], _VAL_HEADER.size
+    while pos < end:
+        op = _OP_NAMES.get(mv[pos])
+        if op not in ("PUT", "DEL"):
+            raise ValueError(f"unknown batch op: {op!r}")
+        key, pos = _decode_client_value(mv, pos + 1)
+        value, pos = _decode_client_value(mv, pos)
+        ops.append((op, key, value))
+    if pos != end:
+        raise ValueError("truncated BATCH body")
+    return ops
+
+
+# ---------- server ----------
+class KVServer:
+    """
+    asyncio server over one DurableKV. Requests on a connection are dispatched as they
+    arrive (up to max_inflight per connection), so pipelined requests run concurrently.
+    Writes from every connection go through one AsyncDurableKV, which merges everything
+    queued in a loop tick into shared WAL commits.
+    """
+    def __init__(self, kv, address, max_batch=1024, max_inflight=1024):
+        self.kv = kv
+        self.address = parse_address(address)
+        self.akv = AsyncDurableKV(kv, max_batch)
+        self.max_inflight = max_inflight
+        self._server = None
+
+    async def start(self):
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._server = await asyncio.start_unix_server(self._handle, path=self.address)
+        else:
+            host, port = self.address
+            self._server = await asyncio.start_server(self._handle, host, port)
+            self.address = self._server.sockets[0].getsockname()[:2]  # resolves port 0
+        return self.address
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self.akv.close()
+
+    async def _handle(self, reader, writer):
+        slots = asyncio.Semaphore(self.max_inflight)
+        tasks = set()
+        try:
+            while True:
+                length, req_id, op = FRAME.unpack(await reader.readexactly(FRAME.size))
+                if length > MAX_FRAME:
+                    break
+                body = await reader.readexactly(length)
+                await slots.acquire()
+                task = asyncio.ensure_future(self._dispatch(req_id, op, body, writer))
+                tasks.add(task)
+                task.add_done_callback(lambda t: (tasks.discard(t), slots.release()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            writer.close()
+
+    async def _dispatch(self, req_id, op, body, writer):
+        try:
+            status, payload = await self._execute(op, body)
+        except Exception as e:
+            status, payload = STATUS_ERROR, f"{type(e).__name__}: {e}".encode("utf-8")
+        if writer.is_closing():
+            return
+        writer.write(FRAME.pack(len(payload), req_id, status) + payload)
+        await writer.drain()
+
+    async def _execute(self, op, body):
+        if op == OP_GET:
+            (key,) = _decode_args(body, 1)
+            value = await self.akv.get(key)
+            if value is None:
+                return STATUS_NOT_FOUND, b""
+            return STATUS_OK, _encode_value(value)
+        if op == OP_PUT:
+            key, value = _decode_args(body, 2)
+            await self.akv.put(key, value)
+            return STATUS_OK, b""
+        if op == OP_DEL:
+            (key,) = _decode_args(body, 1)
+            await self.akv.delete(key)
+            return STATUS_OK, b""
+        if op == OP_BATCH:
+            await self.akv.write_batch(_decode_batch(body))
+            return STATUS_OK, b""
+        if op == OP_SCAN:
+            start, end, limit = _decode_args(body, 3)
+            # a scan may touch many blocks: keep it off the loop
+            items = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: list(self.kv.scan(start, end, limit)))
+            out = [_COUNT.pack(len(items))]
+            for k, v in items:
+                out.append(_encode_value(k))
+                out.append(_encode_value(v))
+            return STATUS_OK, b"".join(out)
+        raise ValueError(f"unknown op {op}")
+
+
+# ---------- client ----------
+class _Connection:
+    """One socket with a reader thread that completes futures by request id."""
+    def __init__(self, address):
+        if isinstance(address, str):
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.connect(address)
+        self._send_lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._waiting = {}  # request id -> (Future, decode)
+        self._closed = False
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+        self._reader.start()
+
+    def send(self, op, body, decode):
+        future = Future()
+        with self._send_lock:
+            if self._closed:
+                raise ConnectionError("connection closed")
+            req_id = next(self._ids) & 0xFFFFFFFF
+            self._waiting[req_id] = (future, decode)
+            self.sock.sendall(FRAME.pack(len(body), req_id, op) + body)
+        return future
+
+    def _read_loop(self):
+        f = self.sock.makefile("rb")
+        error = ConnectionError("connection closed")
+        try:
+            while True:
+                header = f.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    break
+                length, req_id, status = FRAME.unpack(header)
+                body = f.read(length)
+                future, decode = self._waiting.pop(req_id)
+                if status == STATUS_ERROR:
+                    future.set_exception(KVServerError(body.decode("utf-8")))
+                    continue
+                try:
+                    future.set_result(decode(status, body))
+                except Exception as e:
+                    future.set_exception(e)
+        except OSError as e:
+            error = e
+        finally:
+            with self._send_lock:
+                self._closed = True
+                waiting, self._waiting = self._waiting, {}
+            for future, _ in waiting.values():
+                future.set_exception(error)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self._reader.join()
+
+
+def _decode_get(status, body):
+    if status == STATUS_NOT_FOUND:
+        return None
+    return _decode_value(memoryview(body), 0)[0]
+
+
+def _decode_ok(status, body):
+    return None
+
+
+def _decode_scan(status, body):
+    mv = memoryview(body)
+    (n,) = _COUNT.unpack_from(mv, 0)
+    pos, items = _COUNT.size, []
+    for _ in range(n):
+        k, pos = _decode_value(mv, pos)
+        v, pos = _decode_value(mv, pos)
+        items.append((k, v))
+    return items
+
+
+class KVClient:
+    """
+    Thread-safe client with a pool of pool_size connections (requests are spread round
+    robin). send(op, *args) pipelines: it returns a concurrent.futures.Future at once.
+    get/put/delete/scan/batch are the blocking forms.
+    """
+    def __init__(self, address, pool_size=4):
+        address = parse_address(address)
+        self._pool = [_Connection(address) for _ in range(pool_size)]
+        self._rr = itertools.count()
+
+    def send(self, op, *args):
+        conn = self._pool[next(self._rr) % len(self._pool)]
+        if op == "get":
+            return conn.send(OP_GET, _encode_value(args[0]), _decode_get)
+        if op == "put":
+            return conn.send(OP_PUT, _encode_value(args[0]) + _encode_value(args[1]), _decode_ok)
+        if op == "delete":
+            return conn.send(OP_DEL, _encode_value(args[0]), _decode_ok)
+        if op == "scan":
+            start, end, limit = (list(args) + [None, None, None])[:3]
+            body = _encode_value(start) + _encode_value(end) + _encode_value(limit)
+            return conn.send(OP_SCAN, body, _decode_scan)
+        if op == "batch":
+            ops = [(item[0], item[1], item[2] if item[0] == "PUT" else None) for item in args[0]]
+            return conn.send(OP_BATCH, _encode_batch(ops), _decode_ok)
+        raise ValueError(f"unknown op: {op!r}")
+
+    def get(self, key):
+        return self.send("get", key).result()
+
+    def put(self, key, value):
+        return self.send("put", key, value).result()
+
+    def delete(self, key):
+        return self.send("delete", key).result()
+
+    def scan(self, start=None, end=None, limit=None):
+        return self.send("scan", start, end, limit).result()
+
+    def batch(self, ops):
+        return self.send("batch", ops).result()
+
+    def close(self):
+        for conn in self._pool:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- entry point ----------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a DurableKV over a socket")
+    parser.add_argument("--data-dir", required=True)
+    where = parser.add_mutually_exclusive_group(required=True)
+    where.add_argument("--unix", help="Unix socket path")
+    where.add_argument("--tcp", help="host:port")
+    parser.add_argument("--n-shards", type=int, default=16)
+    parser.add_argument("--wal-format", default="binary", choices=("json", "binary"))
+    parser.add_argument("--engine", default="hash", choices=("hash", "lsm"))
+    parser.add_argument("--durability", default="always")
+    parser.add_argument("--max-batch", type=int, default=1024)
+    args = parser.parse_args(argv)
+
+    kv = DurableKV(args.data_dir, n_shards=args.n_shards, wal_format=args.wal_format,
+                   engine=args.engine, durability=args.durability)
+    kv.recover()
+
+    async def serve():
+        server = KVServer(kv, f"unix:{args.unix}" if args.unix else args.tcp, args.max_batch)
+        address = await server.start()
+        print(f"serving {args.data_dir} on {address}", flush=True)
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await stop.wait()
+        await server.close()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        kv.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# replication.py
+# WAL-shipping read replicas for DurableKV. A Follower lives in any process that can see
+# the leader's data directory: it loads the leader's latest snapshot, then tails the
+# leader's WAL files and applies every entry to an in-memory DurableKV of its own, so
+# reads scale out across processes at bounded staleness.
+#
+# Demo (leader and follower in two processes):  python replication.py
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from durable_kv import DurableKV, WALReader, SnapshotReader, LAYOUT_FILE
+
+_BOOTSTRAP_BATCH = 1024  # snapshot items applied per lock round
+
+
+class _Retired(Exception):
+    """A file the follower still needed was retired by the leader: bootstrap again."""
+
+
+class _Cursor:
+    """Replication position in one leader WAL directory."""
+    __slots__ = ("dirpath", "wal_seq", "offset")
+
+    def __init__(self, dirpath, wal_seq, offset=0):
+        self.dirpath = dirpath
+        self.wal_seq = wal_seq
+        self.offset = offset
+
+
+def _file_seq(name):
+    return int(name.split("_")[1].split(".")[0])
+
+
+def _wal_seqs(dirpath):
+    return sorted(_file_seq(f) for f in os.listdir(dirpath) if f.startswith("wal_") and f.endswith(".log"))
+
+
+class Follower:
+    """
+    Read replica of the DurableKV in leader_dir (hash engine, binary or JSON WAL, plain
+    or partitioned layout). The leader needs no changes and may run in another process.
+
+    Bootstrap: the newest snapshot of every leader partition is loaded into a fresh
+    in-memory DurableKV (built with kv_options; its own directory is a scratch dir that
+    is never written), and each partition's cursor starts at the WAL the snapshot fences.
+    Streaming: poll(), or the background thread of start(), reads every WAL from its
+    cursor (WALReader with start=) and applies the entries in log order through
+    DurableKV.apply_log_entry, moving to the next WAL once the leader has rotated. A
+    record still being written is picked up by the next poll.
+
+    Staleness: a poll that starts at time t applies everything the leader had written
+    by t, so reads trail the leader by at most about poll_interval plus the length of a
+    poll; lag() reports the current distance. Entries the leader has written but not
+    yet synced (relaxed durability modes) are replicated too.
+
+    If the leader retires a WAL (or snapshot) the follower has not read yet, the
+    follower bootstraps again from the newer snapshot into a second store and swaps it
+    in once caught up; reads keep using the old one until then.
+    Leaders with a value log (value_log_threshold) cannot be followed: their WAL and
+    snapshots hold pointers into files only the leader manages.
+    """
+    def __init__(self, leader_dir, poll_interval=0.01, **kv_options):
+        with open(os.path.join(leader_dir, LAYOUT_FILE)) as f:
+            layout = json.load(f)
+        if layout.get("engine", "hash") != "hash":
+            raise ValueError("only engine='hash' stores can be followed")
+        self.leader_dir = leader_dir
+        self.poll_interval = poll_interval
+        kv_options.setdefault("n_shards", layout["n_shards"])
+        self._kv_options = kv_options
+        if layout["partitioned"]:
+            self._dirs = [os.path.join(leader_dir, f"shard_{i:03d}") for i in range(layout["n_shards"])]
+        else:
+            self._dirs = [leader_dir]
+        self._lock = threading.Lock()  # one poll at a time; guards the cursors
+        self.kv = None
+        self._kv_dir = None
+        self._cursors = None
+        self._caught_up_at = None      # monotonic start of the last poll that reached the log end
+        self.entries_applied = 0
+        self.bootstraps = 0
+        self.error = None              # exception that stopped the background thread
+        self._stop = threading.Event()
+        self._thread = None
+        self._bootstrap()
+
+    # ---------- reads ----------
+    def get(self, key):
+        return self.kv.get(key)
+
+    def peek(self, key):
+        return self.kv.peek(key)
+
+    def scan(self, start=None, end=None, limit=None):
+        return self.kv.scan(start, end, limit)
+
+    def prefix(self, p, limit=None):
+        return self.kv.prefix(p, limit)
+
+    def read_view(self):
+        """Point-in-time view of the replica (needs mvcc=True in kv_options)."""
+        return self.kv.read_view()
+
+    # ---------- replication ----------
+    def _bootstrap(self):
+        while True:
+            t0 = time.monotonic()
+            kv_dir = tempfile.mkdtemp(prefix="follower_")
+            kv = DurableKV(kv_dir, **self._kv_options)
+            try:
+                cursors = [self._load_snapshot(kv, d) for d in self._dirs]
+                applied = self._catch_up(kv, cursors)
+                break
+            except _Retired:
+                kv.close()
+                shutil.rmtree(kv_dir, ignore_errors=True)
+        old, old_dir = self.kv, self._kv_dir
+        self.kv, self._kv_dir, self._cursors = kv, kv_dir, cursors
+        self._caught_up_at = t0
+        self.entries_applied += applied
+        self.bootstraps += 1
+        if old is not None:
+            old.close()
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def _load_snapshot(self, kv, dirpath):
+        """Load the newest snapshot in dirpath into kv. Returns the cursor to stream from."""
+        snaps = [f for f in os.listdir(dirpath) if f.startswith("snapshot_") and f.endswith(".snap")]
+        if not snaps:
+            return _Cursor(dirpath, 1)
+        try:
+            reader = SnapshotReader(os.path.join(dirpath, max(snaps, key=_file_seq)))
+            batch = []
+            for k, v in reader:
+                batch.append(("PUT", k, v))
+                if len(batch) == _BOOTSTRAP_BATCH:
+                    kv.apply_log_entry((None, None, "BATCH", None, batch))
+                    batch = []
+            if batch:
+                kv.apply_log_entry((None, None, "BATCH", None, batch))
+        except FileNotFoundError:
+            raise _Retired(dirpath)
+        return _Cursor(dirpath, reader.meta["snapshot_seq"])
+
+    def _catch_up(self, kv, cursors):
+        """Apply every complete WAL entry past the cursors. Returns how many were applied."""
+        applied = 0
+        for c in cursors:
+            while True:
+                # list before reading: a later WAL that exists now means ours is complete
+                seqs = _wal_seqs(c.dirpath)
+                later = [s for s in seqs if s > c.wal_seq]
+                if c.wal_seq not in seqs:
+                    if later:
+                        raise _Retired(c.dirpath)
+                    break  # the leader has not created it yet
+                reader = WALReader(os.path.join(c.dirpath, f"wal_{c.wal_seq}.log"), start=c.offset)
+                try:
+                    for entry in reader:
+                        kv.apply_log_entry(entry)
+                        applied += 1
+                except FileNotFoundError:
+                    raise _Retired(c.dirpath)
+                c.offset = reader.valid_bytes
+                if not later:
+                    break
+                c.wal_seq, c.offset = later[0], 0
+        return applied
+
+    def poll(self):
+        """Apply everything the leader has logged so far. Returns the number of entries applied."""
+        with self._lock:
+            t0 = time.monotonic()
+            before = self.entries_applied
+            try:
+                self.entries_applied += self._catch_up(self.kv, self._cursors)
+                self._caught_up_at = t0
+            except _Retired:
+                self._bootstrap()
+            return self.entries_applied - before
+
+    def lag(self):
+        """
+        {"entries": complete entries in the leader's WAL not applied yet, "seconds": time
+        since the start of the last poll that reached the end of the leader's log (0.0
+        when nothing is pending)}. Counting reads the pending part of the WAL.
+        """
+        with self._lock:
+            cursors = [_Cursor(c.dirpath, c.wal_seq, c.offset) for c in self._cursors]
+            caught_up_at = self._caught_up_at
+        entries = 0
+        for c in cursors:
+            for seq in (s for s in _wal_seqs(c.dirpath) if s >= c.wal_seq):
+                start = c.offset if seq == c.wal_seq else 0
+                try:
+                    entries += sum(1 for _ in WALReader(os.path.join(c.dirpath, f"wal_{seq}.log"), start=start))
+                except FileNotFoundError:
+                    continue
+        seconds = time.monotonic() - caught_up_at if entries else 0.0
+        return {"entries": entries, "seconds": seconds}
+
+    def start(self):
+        """Poll in a background thread every poll_interval seconds."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="follower", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.error = e
+                return
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.kv.close()
+        shutil.rmtree(self._kv_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ---------- Two-process demo ----------
+def _leader(data_dir, n, ready):
+    kv = DurableKV(data_dir, n_shards=8, wal_format="binary", durability="interval",
+                   wal_segment_bytes=256 << 10)
+    for i in range(n):
+        kv.put(f"key-{i}", {"i": i})
+        if i == n // 4:
+            kv.snapshot()
+            ready.set()
+    kv.close()
+
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    DATADIR = "./kvdata_replication_demo"
+    N = 200000
+    if os.path.exists(DATADIR):
+        shutil.rmtree(DATADIR)
+    ready = multiprocessing.Event()
+    leader = multiprocessing.Process(target=_leader, args=(DATADIR, N, ready))
+    leader.start()
+    ready.wait()
+    follower = Follower(DATADIR, poll_interval=0.005).start()
+    while leader.is_alive():
+        lag = follower.lag()
+        print(f"applied {follower.entries_applied:>7}  lag {lag['entries']:>6} entries "
+              f"{lag['seconds'] * 1000:7.1f} ms")
+        time.sleep(0.25)
+    leader.join()
+    follower.poll()
+    print("caught up:", follower.lag(), "key-12345 ->", follower.get("key-12345"),
+          f"({follower.bootstraps} bootstrap)")
+    follower.close()
+    shutil.rmtree(DATADIR)
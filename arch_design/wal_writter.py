@@ -1,40 +1,655 @@
-import threading, queue, os
+import threading, os, time, math, collections, heapq, itertools, asyncio, struct, zlib, mmap, contextlib
+from concurrent.futures import Future
+
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 1024
+
+# Framed records: [u32 crc32][u32 payload length][u64 LSN][payload]. The CRC covers
+# everything after it, so a half-written or zero-filled tail never checks out. A framed
+# log starts with FRAMED_MAGIC, so a file of another kind is refused, never truncated.
+FRAMED_MAGIC = b"WALFRM1\n"
+FRAME = struct.Struct("<IIQ")
+_FRAME_BODY = struct.Struct("<IQ")
+
+
+def encode_frame_header(lsn, data):
+    """Header to write in front of data as record lsn."""
+    return FRAME.pack(zlib.crc32(data, zlib.crc32(_FRAME_BODY.pack(len(data), lsn))), len(data), lsn)
+
+
+class Histogram:
+    """
+    Log-scale histogram of positive values (latencies in µs, batch sizes): 8 buckets per
+    power of two (~9% wide), so percentiles are accurate to a bucket without keeping
+    samples.
+    """
+    SUB_BUCKETS = 8
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = collections.Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def _bucket(self, value):
+        return int(math.log2(value) * self.SUB_BUCKETS) if value > 1 else 0
+
+    def _upper(self, bucket):
+        return 2 ** ((bucket + 1) / self.SUB_BUCKETS)
+
+    def record(self, value, n=1):
+        """Record value n times (e.g. one latency standing for a whole batch)."""
+        with self.lock:
+            self.counts[self._bucket(value)] += n
+            self.count += n
+            self.total += value * n
+            if value > self.max:
+                self.max = value
+
+    def record_many(self, values):
+        with self.lock:
+            for v in values:
+                self.counts[self._bucket(v)] += 1
+                self.count += 1
+                self.total += v
+                if v > self.max:
+                    self.max = v
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th fraction of the values (p in 0..1)."""
+        with self.lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, math.ceil(p * self.count))
+            seen = 0
+            for b in sorted(self.counts):
+                seen += self.counts[b]
+                if seen >= rank:
+                    return min(self._upper(b), self.max)
+            return self.max
+
+    def buckets(self):
+        """[(bucket upper bound, count), ...] in ascending order, for plotting or export."""
+        with self.lock:
+            return [(self._upper(b), self.counts[b]) for b in sorted(self.counts)]
+
+    def summary(self):
+        return {"count": self.count, "p50": self.percentile(0.50), "p99": self.percentile(0.99),
+                "max": self.max, "avg": self.total / self.count if self.count else 0.0}
+
+    def reset(self):
+        with self.lock:
+            self.counts.clear()
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+
+def writev_all(fd, buffers):
+    """os.writev every buffer, IOV_MAX at a time, resuming after short writes."""
+    buffers = [memoryview(b) for b in buffers]
+    i = 0
+    while i < len(buffers):
+        n = os.writev(fd, buffers[i:i + IOV_MAX])
+        while n:
+            if n >= len(buffers[i]):
+                n -= len(buffers[i])
+                i += 1
+            else:
+                buffers[i] = buffers[i][n:]
+                n = 0
+        while i < len(buffers) and not len(buffers[i]):
+            i += 1
+
 
 class WALWriter:
-    def __init__(self, file_path):
-        self.log_file = open(file_path, "ab", buffering=0)
-        self.queue = queue.Queue()
+    """
+    Group-commit log writer: submit() returns once its bytes are fsynced.
+
+    Producers append to a pending deque under a condition; the writer thread sleeps on
+    that condition (no polling) and wakes when there is work. A batch is closed when it
+    holds max_batch_records records or max_batch_bytes bytes, or when its first record
+    has waited max_linger_us microseconds (0: take whatever is pending right away, so
+    the next batch forms while the current one is being synced). The batch is written
+    with one os.writev and one fsync, then every record in it is acknowledged at once.
+
+    staging_bytes=N switches to double buffering: two bytearrays of N bytes are
+    preallocated and producers copy their record into the active one under the lock
+    (no deque entry, tuple or timestamp per record). The writer swaps the buffers and
+    flushes the full one with a single write + fsync while producers fill the other;
+    a producer that finds the active buffer full waits for the next swap (an asyncio
+    producer never waits: its record is parked with its LSN and the writer stages it
+    into the fresh buffer right after the swap, ahead of any later record). Records
+    must fit in one buffer, and commit latency is measured from the first record of
+    each buffer, which bounds the latency of the rest.
+
+    Every record gets an LSN (1, 2, 3, ... in log order) when it is submitted.
+    submit_nowait() returns at once with a concurrent.futures.Future whose .lsn is set
+    and whose result is that LSN once the record is durable, so one producer can keep
+    many records in flight; flush_until(lsn) blocks until a prefix of the log is durable.
+    AsyncWALWriter offers the same to asyncio code.
+
+    framed=True writes FRAMED_MAGIC and then every record as a FRAME (CRC, length, LSN)
+    so the log can be read back with LogReader; opening an existing framed log first
+    runs recover_log() on it, which truncates a torn tail, and LSNs continue after its
+    last record. A non-empty file without the magic is refused (ValueError).
+
+    commit_latency is a Histogram of submit -> durable times in µs and batch_sizes one
+    of records per batch; stats() summarizes both for tuning the knobs.
+    """
+    def __init__(self, file_path, max_batch_bytes=1 << 20, max_batch_records=1024, max_linger_us=0,
+                 staging_bytes=None, framed=False):
+        self.framed = framed
+        last_lsn = recover_log(file_path)["last_lsn"] if framed and os.path.exists(file_path) else 0
+        self.fd = os.open(file_path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if framed and not os.fstat(self.fd).st_size:
+            os.write(self.fd, FRAMED_MAGIC)
+            os.fsync(self.fd)
+        self.max_batch_bytes = max_batch_bytes
+        self.max_batch_records = max_batch_records
+        self.max_linger = max_linger_us / 1e6
         self.lock = threading.Lock()
+        self.has_work = threading.Condition(self.lock)   # writer waits here
+        self.committed = threading.Condition(self.lock)  # blocking producers wait here
+        self.pending = collections.deque()  # (data, submit time, future or None, frame header or None)
+        self.pending_bytes = 0
+        # double-buffered staging: producers fill `active`, the writer flushes `spare`
+        self.staging_bytes = staging_bytes
+        if staging_bytes:
+            self.active = bytearray(staging_bytes)
+            self.spare = bytearray(staging_bytes)
+            self.has_space = threading.Condition(self.lock)  # producers wait for a swap
+        self.staged = 0          # bytes used in the active buffer
+        self.staged_records = 0
+        self.staged_since = 0.0  # submit time of the first record in the active buffer
+        self.staged_futures = []
+        self.parked = collections.deque()  # (data, future, frame header, size) waiting for a swap
+        self.submitted = last_lsn   # last LSN handed out
+        self.durable = last_lsn     # every LSN <= durable is on disk
+        self.barriers = []   # heap of (lsn, n, asyncio future) from AsyncWALWriter.flush_until
+        self.barrier_ids = itertools.count()
+        self.error = None    # sticky: once a write or fsync fails the log is unusable
+        self.closed = False
+        self.commit_latency = Histogram()
+        self.batch_sizes = Histogram()
+        self.batches = 0
+        self.bytes_written = 0
         self.thread = threading.Thread(target=self._writer_loop, daemon=True)
         self.thread.start()
 
+    def _enqueue(self, data, future, frame_lsn=None, wait=True):
+        # caller holds lock; frame_lsn overrides the LSN written in the frame (multi-stream);
+        # wait=False parks the record instead of waiting for staging space (event loops)
+        if self.error is not None:
+            raise self.error
+        if self.closed:
+            raise ValueError("WALWriter is closed")
+        if self.staging_bytes:
+            return self._stage(data, future, frame_lsn, wait)
+        header = encode_frame_header(frame_lsn or self.submitted + 1, data) if self.framed else None
+        self.pending.append((data, time.perf_counter(), future, header))
+        self.pending_bytes += len(data) + (FRAME.size if header else 0)
+        self.submitted += 1
+        if len(self.pending) == 1 or self._batch_full():
+            self.has_work.notify()
+        return self.submitted
+
+    def _check_fits(self, n):
+        if n > self.staging_bytes:
+            raise ValueError(f"record of {n} bytes does not fit the {self.staging_bytes} byte staging buffer")
+
+    def _reserve(self, n):
+        # caller holds lock (staging mode): wait until n more bytes fit in the active buffer
+        # and no parked record is ahead of this one
+        self._check_fits(n)
+        while self.parked or self.staged + n > self.staging_bytes:
+            self.has_work.notify()
+            self.has_space.wait()
+            if self.error is not None:
+                raise self.error
+
+    def _stage(self, data, future, frame_lsn=None, wait=True):
+        # caller holds lock: copy (frame header and) data into the active buffer
+        n = len(data) + (FRAME.size if self.framed else 0)
+        if not wait and (self.parked or self.staged + n > self.staging_bytes):
+            self._check_fits(n)
+            header = encode_frame_header(frame_lsn or self.submitted + 1, data) if self.framed else None
+            self.parked.append((data, future, header, n))
+            self.submitted += 1
+            self.has_work.notify()
+            return self.submitted
+        self._reserve(n)
+        # only now: _reserve may release the lock, and other producers take LSNs meanwhile
+        header = encode_frame_header(frame_lsn or self.submitted + 1, data) if self.framed else None
+        self._copy(data, future, header, n)
+        self.submitted += 1
+        return self.submitted
+
+    def _copy(self, data, future, header, n):
+        # caller holds lock and has made room for n bytes
+        if not self.staged:
+            self.staged_since = time.perf_counter()
+        if header:
+            self.active[self.staged:self.staged + FRAME.size] = header
+            self.active[self.staged + FRAME.size:self.staged + n] = data
+        else:
+            self.active[self.staged:self.staged + n] = data
+        self.staged += n
+        self.staged_records += 1
+        if future is not None:
+            self.staged_futures.append(future)
+        if self.staged == n or self._batch_full():
+            self.has_work.notify()
+
     def submit(self, data: bytes):
-        event = threading.Event()
-        self.queue.put((data, event))
-        event.wait()   # wait until fsync done
+        """Append data and wait until it is durable. Returns its LSN."""
+        with self.lock:
+            lsn = self._enqueue(data, None)
+            self._wait_durable(lsn)   # wait until fsync done
+        return lsn
+
+    def submit_nowait(self, data: bytes):
+        """Append data without waiting: the returned Future has .lsn and resolves to it once durable."""
+        future = Future()
+        future.set_running_or_notify_cancel()  # queued records cannot be taken back
+        with self.lock:
+            future.lsn = self._enqueue(data, future)
+        return future
+
+    def flush_until(self, lsn, timeout=None):
+        """Block until every record up to lsn is durable (False on timeout)."""
+        with self.lock:
+            if lsn > self.submitted:
+                raise ValueError(f"LSN {lsn} has not been assigned yet")
+            return self._wait_durable(lsn, timeout)
+
+    def _wait_durable(self, lsn, timeout=None):
+        # caller holds lock
+        if not self.committed.wait_for(lambda: self.durable >= lsn or self.error is not None, timeout):
+            return False
+        if self.durable < lsn:
+            raise self.error
         return True
 
+    def _has_pending(self):
+        return self.staged or self.pending
+
+    def _oldest(self):
+        return self.staged_since if self.staging_bytes else self.pending[0][1]
+
+    def _batch_full(self):
+        if self.staging_bytes:
+            return self.staged_records >= self.max_batch_records or self.staged >= self.max_batch_bytes
+        return len(self.pending) >= self.max_batch_records or self.pending_bytes >= self.max_batch_bytes
+
+    def _take_batch(self):
+        """
+        Caller holds lock; always takes at least one record. Returns (buffers, size,
+        records, submit times or None, time of the first record, futures).
+        """
+        if self.staging_bytes:
+            full, size = self.active, self.staged
+            self.active, self.spare = self.spare, full
+            batch = ([memoryview(full)[:size]], size, self.staged_records, None,
+                     self.staged_since, self.staged_futures)
+            self.staged = self.staged_records = 0
+            self.staged_futures = []
+            # parked records hold the next LSNs: they go first into the fresh buffer
+            while self.parked and self.staged + self.parked[0][3] <= self.staging_bytes:
+                self._copy(*self.parked.popleft())
+            self.has_space.notify_all()
+            return batch
+        records, buffers, size = [], [], 0
+        while self.pending and len(records) < self.max_batch_records:
+            record = self.pending[0]
+            n = len(record[0]) + (FRAME.size if record[3] else 0)
+            if records and size + n > self.max_batch_bytes:
+                break
+            self.pending.popleft()
+            records.append(record)
+            if record[3]:
+                buffers.append(record[3])
+            buffers.append(record[0])
+            size += n
+        self.pending_bytes -= size
+        return (buffers, size, len(records), [r[1] for r in records],
+                records[0][1], [r[2] for r in records if r[2] is not None])
+
     def _writer_loop(self):
         while True:
-            # batch collect
-            batch = []
-            try:
-                data, event = self.queue.get(timeout=0.01)
-                batch.append((data, event))
-            except queue.Empty:
-                continue
+            with self.lock:
+                while not self._has_pending() and not self.closed:
+                    self.has_work.wait()
+                if not self._has_pending():
+                    return
+                if self.max_linger and not self.closed:
+                    deadline = self._oldest() + self.max_linger
+                    while not self._batch_full() and not self.closed:
+                        left = deadline - time.perf_counter()
+                        if left <= 0:
+                            break
+                        self.has_work.wait(left)
+                buffers, size, count, times, first, futures = self._take_batch()
+                first_lsn = self.durable + 1
 
-            # drain rest of queue for batching
-            while not self.queue.empty():
-                batch.append(self.queue.get_nowait())
+            # sequential write: the whole batch in one writev, one fsync
+            try:
+                writev_all(self.fd, buffers)
+                os.fsync(self.fd)
+            except OSError as e:
+                self._fail(e, futures)
+                return
 
-            # sequential write
+            now = time.perf_counter()
+            if times is None:
+                self.commit_latency.record((now - first) * 1e6, count)
+            else:
+                self.commit_latency.record_many([(now - t) * 1e6 for t in times])
+            self.batch_sizes.record(count)
             with self.lock:
-                for data, _ in batch:
-                    self.log_file.write(data)
-                self.log_file.flush()
-                os.fsync(self.log_file.fileno())
-
-            # notify all threads in batch
-            for _, event in batch:
-                event.set()
+                self.durable = first_lsn + count - 1
+                self.batches += 1
+                self.bytes_written += size
+                # notify all threads in batch
+                self.committed.notify_all()
+                barriers = []
+                while self.barriers and self.barriers[0][0] <= self.durable:
+                    barriers.append(heapq.heappop(self.barriers)[2])
+            _resolve([(f, f.lsn) for f in futures] + [(f, True) for f in barriers])
+
+    def _fail(self, error, futures):
+        with self.lock:
+            self.error = error
+            self.committed.notify_all()
+            if self.staging_bytes:
+                self.has_space.notify_all()
+            failed = futures + [r[2] for r in self.pending if r[2] is not None] + self.staged_futures
+            failed += [r[1] for r in self.parked if r[1] is not None]
+            failed += [b[2] for b in self.barriers]
+            self.pending.clear()
+            self.parked.clear()
+            self.staged_futures = []
+            self.barriers = []
+        _resolve([(f, None) for f in failed], error)
+
+    def stats(self):
+        latency = self.commit_latency.summary()
+        return {"records": latency["count"], "batches": self.batches, "bytes": self.bytes_written,
+                "avg_batch_records": latency["count"] / self.batches if self.batches else 0.0,
+                "p50_batch_records": self.batch_sizes.percentile(0.50),
+                "p50_commit_us": latency["p50"], "p99_commit_us": latency["p99"],
+                "max_commit_us": latency["max"]}
+
+    def close(self):
+        """Commit everything submitted so far, stop the writer and close the file."""
+        with self.lock:
+            self.closed = True
+            self.has_work.notify()
+        self.thread.join()
+        os.close(self.fd)
+
+
+def _resolve(results, error=None):
+    """
+    Complete futures from the writer thread. concurrent futures are set directly;
+    asyncio futures are handed to their loop with ONE call_soon_threadsafe per loop.
+    """
+    by_loop = {}
+    for future, value in results:
+        if isinstance(future, asyncio.Future):
+            by_loop.setdefault(future.get_loop(), []).append((future, value))
+        elif error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+    for loop, items in by_loop.items():
+        try:
+            loop.call_soon_threadsafe(_resolve_on_loop, items, error)
+        except RuntimeError:
+            pass  # the loop is closed: nobody is waiting any more
+
+
+def _resolve_on_loop(items, error):
+    for future, value in items:
+        if future.done():
+            continue  # cancelled by its awaiter
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(value)
+
+
+class AsyncWALWriter:
+    """
+    asyncio front-end over a WALWriter (which the caller still owns and closes).
+    Nothing blocks the loop: records are queued like submit_nowait() (parked, in
+    staging mode, while the active buffer is full) and the writer thread resolves
+    their asyncio futures through loop.call_soon_threadsafe.
+    """
+    def __init__(self, writer: WALWriter):
+        self.writer = writer
+
+    def submit_nowait(self, data: bytes):
+        """Queue data; returns an asyncio future (with .lsn) resolving to the LSN once durable."""
+        future = asyncio.get_running_loop().create_future()
+        with self.writer.lock:
+            future.lsn = self.writer._enqueue(data, future, wait=False)
+        return future
+
+    async def submit(self, data: bytes):
+        """Append data; returns its LSN once durable."""
+        return await self.submit_nowait(data)
+
+    async def flush_until(self, lsn):
+        """Wait until every record up to lsn is durable."""
+        w = self.writer
+        future = asyncio.get_running_loop().create_future()
+        with w.lock:
+            if lsn > w.submitted:
+                raise ValueError(f"LSN {lsn} has not been assigned yet")
+            if w.error is not None:
+                raise w.error
+            if w.durable >= lsn:
+                return
+            heapq.heappush(w.barriers, (lsn, next(w.barrier_ids), future))
+        await future
+
+
+# ---------- Reading and recovering framed logs ----------
+class LogReader:
+    """
+    Zero-copy reader of a framed log (WALWriter(framed=True) or a MultiStreamWALWriter
+    stream). The file is mmapped and iteration lazily yields (lsn, payload) where
+    payload is a memoryview into the mapping: no read() buffers and no copy of any
+    record, the CRC is checked straight off the mapped pages, and the kernel streams
+    them in (MADV_SEQUENTIAL), so replay runs at page-cache/disk speed. Payload views
+    are valid until close(); copy (bytes(payload)) whatever must outlive the reader.
+
+    Iteration stops at the first frame that is incomplete or fails its CRC. Afterwards
+    valid_bytes is the end of the last good record (or of the magic) and torn_tail
+    tells whether bytes follow it. A file that does not start with FRAMED_MAGIC raises
+    ValueError, unless it is a prefix of it (a header cut short by a crash: no records,
+    torn tail).
+    """
+    def __init__(self, path):
+        self.path = path
+        self.valid_bytes = 0
+        self.torn_tail = False
+        with open(path, "rb") as f:
+            self.size = os.fstat(f.fileno()).st_size
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if self.size else None
+        if self._mm is not None and hasattr(self._mm, "madvise"):
+            self._mm.madvise(mmap.MADV_SEQUENTIAL)
+        self._mv = memoryview(self._mm) if self._mm is not None else memoryview(b"")
+        head = bytes(self._mv[:len(FRAMED_MAGIC)])
+        if head == FRAMED_MAGIC:
+            self._start = self.valid_bytes = len(FRAMED_MAGIC)
+        elif FRAMED_MAGIC.startswith(head):
+            self._start = self.size
+        else:
+            self.close()
+            raise ValueError(f"{path} is not a framed log")
+
+    def __iter__(self):
+        mv, end, pos = self._mv, len(self._mv), self._start
+        unpack, header, crc32 = FRAME.unpack_from, FRAME.size, zlib.crc32
+        while pos + header <= end:
+            crc, n, lsn = unpack(mv, pos)
+            stop = pos + header + n
+            if stop > end:
+                break
+            body = mv[pos + 4:stop]
+            if crc32(body) != crc:
+                body.release()
+                break
+            pos = stop
+            self.valid_bytes = pos
+            yield lsn, body[header - 4:]
+            body.release()
+        self.torn_tail = self.valid_bytes < end
+
+    def close(self):
+        self._mv.release()
+        if self._mm is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # a caller still holds a payload view: the mapping goes with it
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def recover_log(path):
+    """
+    Crash recovery for a framed log: scan it, and if it ends in a torn record (a write
+    cut short by the crash) truncate the file after the last good record and fsync.
+    Raises ValueError, touching nothing, if the file is not a framed log.
+    Returns {"records", "last_lsn", "valid_bytes", "truncated_bytes"}.
+    """
+    records, last_lsn = 0, 0
+    with LogReader(path) as reader:
+        for lsn, payload in reader:
+            payload.release()
+            records += 1
+            last_lsn = lsn
+        valid, size = reader.valid_bytes, reader.size
+    if valid < size:
+        with open(path, "r+b") as f:
+            f.truncate(valid)
+            os.fsync(f.fileno())
+    return {"records": records, "last_lsn": last_lsn, "valid_bytes": valid,
+            "truncated_bytes": size - valid}
+
+
+# ---------- Multi-stream logs ----------
+def stream_of(key, streams):
+    """Stream index for a partition key (str or bytes), stable across processes."""
+    if isinstance(key, str):
+        key = key.encode("utf-8")
+    return zlib.crc32(key) % streams
+
+
+class MultiStreamWALWriter:
+    """
+    N independent logs (stream_0.log ... stream_{N-1}.log in dir_path), each a WALWriter
+    with its own writer thread, batching and fsync, so commits to different streams
+    proceed in parallel. submit(key, data) routes by partition key (stream_of), so all
+    records of one key stay in one stream, in order.
+
+    Streams are framed logs whose frames carry a global LSN, taken from one counter
+    while holding the stream's lock, so LSNs increase within each stream file and
+    replay(dir_path) can merge the streams back into one log order. After a crash the
+    merged log may have holes: LSNs that were in flight in a stream whose batch never
+    reached disk. Reopening truncates torn stream tails and resumes after the highest
+    LSN on disk.
+
+    submit_nowait() futures resolve to the global LSN; flush_until(lsn) waits until
+    every record with that LSN or lower is durable in every stream.
+    writer_kwargs (max_batch_records, max_linger_us, staging_bytes, ...) apply to each
+    stream.
+    """
+    def __init__(self, dir_path, streams=4, **writer_kwargs):
+        os.makedirs(dir_path, exist_ok=True)
+        self.dir_path = dir_path
+        self.writers = [WALWriter(os.path.join(dir_path, f"stream_{i}.log"), framed=True, **writer_kwargs)
+                        for i in range(streams)]
+        self.lsn_lock = threading.Lock()
+        # a framed writer resumes at the last LSN in its file, which here is a global one
+        self.last_lsn = max(w.submitted for w in self.writers)
+
+    def _enqueue(self, key, data, future):
+        w = self.writers[stream_of(key, len(self.writers))]
+        with w.lock:
+            if w.staging_bytes:
+                # make room first: the LSN must not be taken while the lock is released
+                w._reserve(FRAME.size + len(data))
+            with self.lsn_lock:
+                self.last_lsn += 1
+                lsn = self.last_lsn
+            if future is not None:
+                future.lsn = lsn
+            local = w._enqueue(data, future, lsn)
+        return w, lsn, local
+
+    def submit(self, key, data: bytes):
+        """Append data to key's stream and wait until it is durable. Returns its global LSN."""
+        w, lsn, local = self._enqueue(key, data, None)
+        with w.lock:
+            w._wait_durable(local)
+        return lsn
+
+    def submit_nowait(self, key, data: bytes):
+        """Like WALWriter.submit_nowait(), with the global LSN in .lsn and as the result."""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self._enqueue(key, data, future)
+        return future
+
+    def flush_until(self, lsn, timeout=None):
+        """Block until every record with a global LSN <= lsn is durable (False on timeout)."""
+        if lsn > self.last_lsn:
+            raise ValueError(f"LSN {lsn} has not been assigned yet")
+        # LSNs are handed out inside the stream locks, so each stream's current local
+        # LSN covers every global LSN assigned so far
+        targets = []
+        for w in self.writers:
+            with w.lock:
+                targets.append(w.submitted)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for w, local in zip(self.writers, targets):
+            left = None if deadline is None else max(0.0, deadline - time.monotonic())
+            with w.lock:
+                if not w._wait_durable(local, left):
+                    return False
+        return True
+
+    def stats(self):
+        """Per-stream WALWriter.stats() plus totals."""
+        per_stream = [w.stats() for w in self.writers]
+        return {"records": sum(s["records"] for s in per_stream),
+                "batches": sum(s["batches"] for s in per_stream),
+                "p99_commit_us": max(s["p99_commit_us"] for s in per_stream),
+                "streams": per_stream}
+
+    def close(self):
+        for w in self.writers:
+            w.close()
+
+    @staticmethod
+    def replay(dir_path):
+        """
+        Yield (lsn, payload memoryview) from every stream file of dir_path in global LSN
+        order (LogReader per stream, merged by LSN). Views are valid while iterating.
+        """
+        paths = sorted(os.path.join(dir_path, name) for name in os.listdir(dir_path)
+                       if name.startswith("stream_") and name.endswith(".log"))
+        with contextlib.ExitStack() as stack:
+            readers = [stack.enter_context(LogReader(p)) for p in paths]
+            yield from heapq.merge(*readers, key=lambda rec: rec[0])